@@ -1,15 +1,65 @@
 from __future__ import annotations
-from flask import Flask, render_template, request, jsonify, redirect, session, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, session, send_file
 from pathlib import Path
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
+import array
+import atexit
+import bisect
+import collections
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import http.client
+import io
 import json
+import logging
+import logging.handlers
+import math
+import mimetypes
+import mmap
 import os
+import queue
+import re
 import secrets
+import shutil
+import socket
+import sqlite3
+import ssl
+import struct
+import sys
 import tempfile
-from datetime import datetime
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
 from zoneinfo import ZoneInfo
+from flask.json.provider import DefaultJSONProvider
 from fpdf import FPDF
 
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento local)
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele os assets saem só com gzip
+    brotli = None
+
+try:
+    import redis
+except ImportError:  # opcional: só para AURORA_BUS=redis://
+    redis = None
+
 # ==========================================
 # CONFIGURAÇÃO
 # ==========================================
@@ -30,6 +80,33 @@ if not _DATA_DIR.exists():
 USERS_FILE  = _DATA_DIR / "users.json"
 ALERTS_FILE = _DATA_DIR / "alerts.log"
 STATE_FILE  = _DATA_DIR / "state.json"
+SEQ_FILE    = _DATA_DIR / "alerts.seq"
+TRACK_FILE  = _DATA_DIR / "alerts.track"
+KEYS_FILE   = _DATA_DIR / "alerts.keys"
+SEGMENTS_DIR = _DATA_DIR / "alerts.d"
+LOCK_FILE   = _DATA_DIR / "alerts.lock"
+DB_FILE     = Path(os.environ.get("AURORA_DB", str(_DATA_DIR / "aurora.db")))
+
+# Backend de armazenamento: "files" (JSON + alerts.log) ou "sqlite"
+STORAGE_BACKEND = os.environ.get("AURORA_STORAGE", "files").strip().lower()
+
+# Durabilidade dos alertas: "always" (fsync a cada lote), "interval"
+# (agrupa por AURORA_FSYNC_INTERVAL_MS e faz um fsync) ou "none"
+FSYNC_POLICY      = os.environ.get("AURORA_FSYNC", "always").strip().lower()
+if FSYNC_POLICY not in ("always", "interval", "none"):
+    raise ValueError(f"AURORA_FSYNC inválido: {FSYNC_POLICY!r} (use always, interval ou none)")
+FSYNC_INTERVAL_MS = int(os.environ.get("AURORA_FSYNC_INTERVAL_MS", "20"))
+WRITER_QUEUE_SIZE = int(os.environ.get("AURORA_WRITER_QUEUE", "1000"))
+
+# Rotação do alerts.log: vira segmento comprimido na virada do dia ou ao
+# passar deste tamanho
+SEGMENT_MAX_BYTES = int(os.environ.get("AURORA_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+# Segmentos descomprimidos mantidos em memória, contados em alertas
+SEGMENT_CACHE_ALERTS = int(os.environ.get("AURORA_SEGMENT_CACHE", "20000"))
+
+# Por quanto tempo um reenvio com a mesma chave de idempotência devolve o
+# alerta original em vez de gravar outro
+IDEMPOTENCY_TTL = int(os.environ.get("AURORA_IDEMPOTENCY_TTL", "86400"))
 
 # Fallback: se _DATA_DIR não for gravável, usa BASE_DIR
 try:
@@ -39,8 +116,20 @@ except Exception:
     USERS_FILE  = BASE_DIR / "users.json"
     ALERTS_FILE = BASE_DIR / "alerts.log"
     STATE_FILE  = BASE_DIR / "state.json"
+    SEQ_FILE    = BASE_DIR / "alerts.seq"
+    TRACK_FILE  = BASE_DIR / "alerts.track"
+    KEYS_FILE   = BASE_DIR / "alerts.keys"
+    SEGMENTS_DIR = BASE_DIR / "alerts.d"
+    LOCK_FILE   = BASE_DIR / "alerts.lock"
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # /static é servido pelo AssetPipeline
+
+# Proxies reversos na frente do app (o Render põe um). O X-Forwarded-For é
+# lido só até esse número de saltos, da direita para a esquerda: o que o
+# cliente escreveu no cabeçalho não vira request.remote_addr. 0 = sem proxy.
+TRUSTED_PROXIES = int(os.environ.get("AURORA_TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 _default_key = "aurora-local-dev-key-2026-change-in-production"
 app.secret_key = os.environ.get("SECRET_KEY") or _default_key
 
@@ -58,70 +147,2690 @@ def today_str():
         return datetime.now().strftime("%Y-%m-%d")
     return datetime.now(TZ).strftime("%Y-%m-%d")
 
+# ==========================================
+# MÉTRICAS E LOGS
+# ==========================================
+#
+# Métricas em memória no formato de texto do Prometheus (GET /metrics) e
+# logs estruturados em JSON, uma linha por evento. Os logs passam por uma
+# fila e são escritos por uma thread própria: o request nunca espera o
+# stdout. As métricas são por processo (render.yaml roda um worker).
+
+METRICS_TOKEN     = os.environ.get("AURORA_METRICS_TOKEN", "")
+SLOW_REQUEST_MS   = int(os.environ.get("AURORA_SLOW_REQUEST_MS", "1000"))
+LOG_LEVEL         = os.environ.get("AURORA_LOG_LEVEL", "INFO").strip().upper()
+LATENCY_BUCKETS   = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_BUCKETS     = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+class Metrics:
+    """Registro de contadores, histogramas e gauges com rótulos; seguro para threads."""
+
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._meta     = {}   # nome -> (tipo, ajuda, buckets)
+        self._counters = {}   # (nome, rótulos) -> valor
+        self._hists    = {}   # (nome, rótulos) -> [contagens por bucket..., soma, total]
+        self._gauges   = {}   # nome -> função que devolve {rótulos: valor}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+
+    def gauge(self, name, help_text, fn):
+        self._meta[name] = ("gauge", help_text, None)
+        self._gauges[name] = fn
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            row = self._hists.get(key)
+            if row is None:
+                row = self._hists[key] = [0] * (len(buckets) + 3)
+            row[bisect.bisect_left(buckets, value)] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ""
+        def esc(v):
+            return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            hists    = {k: list(v) for k, v in self._hists.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, pairs), value in counters.items():
+                    if n == name:
+                        lines.append(f"{name}{self._labels(pairs)} {value}")
+            elif kind == "gauge":
+                try:
+                    values = self._gauges[name]()
+                except Exception:
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for pairs, value in values.items():
+                    lines.append(f"{name}{self._labels(pairs)} {value}")
+            else:
+                for (n, pairs), row in hists.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), row):
+                        cumulative += count
+                        le = pairs + (("le", bound if bound == "+Inf" else repr(float(bound))),)
+                        lines.append(f"{name}_bucket{self._labels(le)} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(pairs)} {row[-2]:.6f}")
+                    lines.append(f"{name}_count{self._labels(pairs)} {row[-1]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.histogram("aurora_http_request_duration_seconds", "Tempo de resposta por rota (até o primeiro byte)")
+METRICS.counter("aurora_http_requests_total", "Requisições por rota, método e status")
+METRICS.counter("aurora_alerts_ingested_total", "Alertas gravados")
+METRICS.counter("aurora_alerts_deduplicated_total", "Reenvios de alerta reconhecidos pela chave de idempotência")
+METRICS.counter("aurora_track_points_total", "Pontos de trajeto recebidos depois do alerta")
+METRICS.counter("aurora_alert_polls_total", "Consultas de alertas atendidas (lista, delta, long-poll, SSE)")
+METRICS.counter("aurora_alert_not_modified_total", "Consultas de alertas respondidas com 304")
+METRICS.histogram("aurora_storage_seconds", "Tempo de E/S do armazenamento por operação")
+METRICS.histogram("aurora_writer_batch_size", "Alertas gravados por lote do escritor", BATCH_BUCKETS)
+METRICS.histogram("aurora_ia_upstream_seconds", "Latência do upstream da Aurora IA (até os cabeçalhos)")
+METRICS.counter("aurora_ia_requests_total", "Chamadas à Aurora IA por resultado")
+METRICS.counter("aurora_shed_total", "Requisições recusadas pelo controle de admissão")
+METRICS.counter("aurora_login_total", "Tentativas de login por resultado")
+METRICS.counter("aurora_bus_received_total", "Avisos de alerta recebidos de outros workers")
+METRICS.histogram("aurora_login_hash_seconds", "Espera + cálculo do hash de senha no pool de login")
+
+class JsonLogFormatter(logging.Formatter):
+    """Uma linha JSON por evento: ts, level, event e os campos extras."""
+
+    def format(self, record):
+        entry = {
+            "ts":    datetime.fromtimestamp(record.created, TZ).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+logger = logging.getLogger("aurora")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue   = queue.SimpleQueue()
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(JsonLogFormatter())
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+def log_event(event, level=logging.INFO, **fields):
+    """Registra um evento estruturado (sem bloquear o request)."""
+    logger.log(level, event, extra={"fields": fields})
+
+@app.before_request
+def metrics_start():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def metrics_record(resp):
+    started = g.pop("request_started", None)
+    if started is None:
+        return resp
+    elapsed  = time.perf_counter() - started
+    endpoint = request.endpoint or "not_found"
+    METRICS.observe("aurora_http_request_duration_seconds", elapsed, endpoint=endpoint)
+    METRICS.inc("aurora_http_requests_total", endpoint=endpoint, method=request.method, status=resp.status_code)
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        log_event("slow_request", logging.WARNING, endpoint=endpoint, method=request.method,
+                  status=resp.status_code, ms=round(elapsed * 1000, 1))
+    return resp
+
 # ==========================================
 # GESTÃO DE ARQUIVOS
 # ==========================================
 
 def ensure_files():
     if not USERS_FILE.exists():
-        hashed = generate_password_hash("admin123")
-        USERS_FILE.write_text(json.dumps({
-            "admin": {"password": hashed, "role": "admin", "name": "Admin Aurora", "client_id": None}
-        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        USERS_FILE.write_text(json.dumps(default_users(), indent=2, ensure_ascii=False), encoding="utf-8")
     if not ALERTS_FILE.exists():
         ALERTS_FILE.write_text("", encoding="utf-8")
     if not STATE_FILE.exists():
         STATE_FILE.write_text(json.dumps({"last_id": 0}, indent=2, ensure_ascii=False), encoding="utf-8")
 
+def default_users():
+    hashed = generate_password_hash("admin123")
+    return {"admin": {"password": hashed, "role": "admin", "name": "Admin Aurora", "client_id": None}}
+
 def load_users():
-    ensure_files()
-    try:
-        return json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        hashed = generate_password_hash("admin123")
-        return {"admin": {"password": hashed, "role": "admin", "name": "Admin Aurora", "client_id": None}}
+    """Snapshot atual dos usuários (somente leitura — use save_user para alterar)."""
+    return USERS.all()
 
 def save_users(data):
-    USERS_FILE.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    USERS.replace(data)
 
-def next_alert_id():
-    ensure_files()
-    try:
-        st = json.loads(STATE_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        st = {"last_id": 0}
-    st["last_id"] = int(st.get("last_id", 0)) + 1
-    STATE_FILE.write_text(json.dumps(st, indent=2, ensure_ascii=False), encoding="utf-8")
-    return st["last_id"]
+def save_user(username, info):
+    """Grava (ou substitui) um único usuário."""
+    USERS.put(username, info)
+
+def delete_users(usernames):
+    if usernames:
+        USERS.delete(usernames)
 
 def log_alert(payload):
-    ensure_files()
-    with ALERTS_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    """Grava o alerta; True se era reenvio de uma chave já gravada (payload["id"] = original)."""
+    with METRICS.timer("aurora_storage_seconds", op="log_alert"):
+        duplicate = ALERT_WRITER.submit(payload)
+        ALERT_STORE.refresh()
+    if duplicate:
+        return True
+    METRICS.inc("aurora_alerts_ingested_total")
+    ALERT_BROKER.publish(payload)
+    ALERT_ROTATOR.wake()
+    return False
+
+def clear_alerts():
+    STORAGE.clear_alerts()
+    ALERT_STORE.clear()
+
+def clear_client_alerts(client_id):
+    """Apaga só o histórico de um cliente (None = alertas anônimos)."""
+    removed = STORAGE.delete_client_alerts(client_id)
+    ALERT_STORE.refresh()
+    return removed
 
 def get_all_alerts():
-    ensure_files()
+    with METRICS.timer("aurora_storage_seconds", op="get_all_alerts"):
+        ALERT_STORE.refresh()
+        return ALERT_STORE.all()
+
+def get_alerts_for_client(client_id):
+    """Retorna alertas do cliente específico + alertas sem client_id (disparados sem login)."""
+    ALERT_STORE.refresh()
+    if client_id is None:
+        return ALERT_STORE.all()  # admin vê tudo
+    return ALERT_STORE.for_client(client_id)
+
+def iter_alerts(client_id=None, start_day=None, end_day=None):
+    """Gerador sobre o histórico filtrado, sem carregar tudo numa lista."""
+    ALERT_STORE.refresh()
+    return ALERT_STORE.iter_alerts(client_id, start_day, end_day)
+
+def get_last_alert(client_id=None):
+    """Último alerta visível para o cliente (ou geral, se client_id for None)."""
+    ALERT_STORE.refresh()
+    return ALERT_STORE.last(client_id)
+
+# ==========================================
+# STORE DE ALERTAS EM MEMÓRIA
+# ==========================================
+
+class AlertStore:
+    """Cópia em memória dos alertas, indexada por id, client_id e dia.
+
+    O histórico é lido por completo só uma vez; nas chamadas seguintes a
+    refresh() pede ao backend apenas o que foi gravado depois do último
+    cursor (offset no alerts.log, seq no SQLite). Se o backend avisar que
+    o cursor ficou inválido (ex.: /api/clear_alerts), os índices são
+    reconstruídos do zero.
+
+    Os índices guardam posições na lista principal, o que preserva a ordem
+    de gravação mesmo que existam ids repetidos de versões antigas.
+
+    Só o trecho "quente" (alerts.log atual) fica em memória; segmentos já
+    rotacionados são lidos sob demanda via storage.iter_cold(), que pula
+    pelo manifesto os segmentos fora do intervalo pedido.
+
+    Os contadores do painel (total, hoje, com localização, por cliente)
+    saem do tamanho dos índices quentes somados aos totais do manifesto,
+    sem percorrer alertas.
+
+    Pontos de trajeto (storage.read_track) substituem o alerta quente na
+    mesma posição por uma cópia com a posição nova; _tracked guarda essas
+    posições em ordem de chegada para o SSE e o AlertColumns.
+    """
+
+    def __init__(self, storage):
+        self.storage    = storage
+        self.generation = 0
+        self._lock      = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._cursor    = None
+        self._alerts    = []
+        self._by_id     = {}
+        self._by_client = {}
+        self._by_day    = {}
+        self._by_cell   = {}   # célula da grade -> posições (índice espacial)
+        self._by_key    = {}   # idempotency_key -> posição
+        self._tracked   = []   # posições que receberam ponto de trajeto
+        self._track_cursor  = None
+        self._with_location = 0
+        self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _index(self, alert):
+        pos = len(self._alerts)
+        self._alerts.append(alert)
+        if alert.get("id") is not None:
+            self._by_id[alert["id"]] = pos
+        self._by_client.setdefault(alert.get("client_id"), []).append(pos)
+        self._by_day.setdefault(str(alert.get("ts", ""))[:10], []).append(pos)
+        if alert.get("idempotency_key"):
+            self._by_key[alert["idempotency_key"]] = pos
+        if _has_location(alert):
+            self._with_location += 1
+        point = _alert_point(alert)
+        if point is not None:
+            self._by_cell.setdefault(_geo_cell(*point), []).append(pos)
+
+    def _apply_point(self, point):
+        pos = self._by_id.get(point.get("id"))
+        if pos is None or "lat" not in point or "lng" not in point:
+            return   # alerta já no histórico frio (ou apagado)
+        old = self._alerts[pos]
+        new = self._alerts[pos] = old.with_point(_track_point(point))
+        if _has_location(new) and not _has_location(old):
+            self._with_location += 1
+        cells = [_geo_cell(*p) if p else None for p in (_alert_point(old), _alert_point(new))]
+        if cells[0] != cells[1]:
+            if cells[0] is not None:
+                positions = self._by_cell[cells[0]]
+                positions.remove(pos)
+                if not positions:
+                    del self._by_cell[cells[0]]
+            if cells[1] is not None:
+                bisect.insort(self._by_cell.setdefault(cells[1], []), pos)
+        self._tracked.append(pos)
+
+    def refresh(self):
+        """Indexa somente os alertas (e pontos de trajeto) gravados desde a última chamada."""
+        with self._lock:
+            for _ in range(3):
+                alerts, cursor, reset = self.storage.read_alerts(self._cursor)
+                if reset:
+                    self._reset()
+                for alert in alerts:
+                    self._index(alert)
+                self._cursor = cursor
+                points, cursor, reset = self.storage.read_track(self._track_cursor)
+                if reset:
+                    # alerts.track trocado (rotação, limpeza): reaplica tudo do zero
+                    self._reset()
+                    continue
+                for point in points:
+                    self._apply_point(point)
+                self._track_cursor = cursor
+                return
+
+    def track_updates(self, cursor, client_id=None):
+        """Alertas que receberam ponto de trajeto desde cursor: (novo cursor, alertas).
+
+        cursor = (geração, posição em _tracked); None ou geração antiga só
+        devolve o cursor atual. client_id segue a regra de since().
+        """
+        with self._lock:
+            if cursor is None or cursor[0] != self.generation:
+                return (self.generation, len(self._tracked)), []
+            found = {}
+            for pos in self._tracked[cursor[1]:]:
+                alert = self._alerts[pos]
+                if client_id is None or alert.get("client_id") in (client_id, None):
+                    found[pos] = alert
+            return (self.generation, len(self._tracked)), [found[p] for p in sorted(found)]
+
+    def track_count(self):
+        with self._lock:
+            return len(self._tracked)
+
+    def cursors(self):
+        """(cursor do log de alertas, cursor do trajeto) já lidos do storage.
+
+        Saem do próprio armazenamento (inode/offset ou geração/seq do banco),
+        então workers atualizados — e o mesmo worker depois de reiniciar —
+        devolvem o mesmo valor.
+        """
+        with self._lock:
+            return self._cursor, self._track_cursor
+
+    def hot_snapshot(self, start):
+        """(geração, alertas quentes a partir da posição start) — para AlertColumns."""
+        with self._lock:
+            return self.generation, self._alerts[start:]
+
+    def hot_count(self):
+        with self._lock:
+            return len(self._alerts)
+
+    def _pick(self, positions):
+        return [self._alerts[i] for i in positions]
+
+    def all(self):
+        cold = list(self.storage.iter_cold())
+        with self._lock:
+            return cold + self._alerts
+
+    def get(self, alert_id):
+        with self._lock:
+            pos = self._by_id.get(alert_id)
+            if pos is not None:
+                return self._alerts[pos]
+        return self.storage.cold_get(alert_id)
+
+    def get_hot(self, alert_id):
+        """Alerta ainda no trecho quente (o único que aceita pontos de trajeto)."""
+        with self._lock:
+            pos = self._by_id.get(alert_id)
+            return None if pos is None else self._alerts[pos]
+
+    def by_idempotency_key(self, key):
+        """Alerta quente gravado com esta chave (por qualquer worker), ou None."""
+        with self._lock:
+            pos = self._by_key.get(key)
+            return None if pos is None else self._alerts[pos]
+
+    def max_id(self):
+        with self._lock:
+            hot = max((int(i) for i in self._by_id if isinstance(i, int)), default=0)
+        return max(hot, self.storage.cold_max_id())
+
+    def for_client(self, client_id):
+        """Alertas do cliente + alertas anônimos, na ordem de gravação."""
+        cold = list(self.storage.iter_cold(client_id=client_id))
+        if client_id is None:
+            with self._lock:
+                return cold + self._alerts
+        return cold + self.for_client_hot(client_id)
+
+    def since(self, client_id, since_id):
+        """Alertas com id > since_id visíveis para o cliente (None = todos).
+
+        Percorre os índices de trás para frente e para no primeiro id já
+        visto, então o custo é proporcional aos alertas novos. Segmentos
+        frios só são lidos se o cursor for anterior a eles. Parar cedo é
+        seguro porque o storage numera na ordem do log e os ids nunca
+        voltam; since_cursor() descarta cursores de outro histórico.
+        """
+        cold = []
+        if since_id < self.storage.cold_max_id():
+            cold = list(self.storage.iter_cold(client_id=client_id, since_id=since_id))
+        with self._lock:
+            if client_id is None:
+                lists = [range(len(self._alerts))]
+            else:
+                lists = [self._by_client.get(client_id, []), self._by_client.get(None, [])]
+            found = []
+            for positions in lists:
+                for i in reversed(positions):
+                    if int(self._alerts[i].get("id") or 0) <= since_id:
+                        break
+                    found.append(i)
+            return cold + self._pick(sorted(found))
+
+    def iter_alerts(self, client_id=None, start_day=None, end_day=None):
+        """Percorre o histórico filtrado (frio e depois quente) sem montar uma lista única."""
+        yield from self.storage.iter_cold(client_id=client_id, start_day=start_day, end_day=end_day)
+        if client_id is None:
+            with self._lock:
+                hot = list(self._alerts)
+        else:
+            hot = self.for_client_hot(client_id)
+        for alert in hot:
+            if _alert_matches(alert, None, 0, start_day, end_day):
+                yield alert
+
+    def for_client_hot(self, client_id):
+        with self._lock:
+            own  = self._by_client.get(client_id, [])
+            anon = self._by_client.get(None, [])
+            return self._pick(heapq.merge(own, anon))
+
+    def for_day(self, day):
+        cold = list(self.storage.iter_cold(start_day=day, end_day=day))
+        with self._lock:
+            return cold + self._pick(self._by_day.get(day, []))
+
+    def _hot_in_box(self, bbox, since_ts, until_ts, client_id):
+        """Alertas quentes dentro da caixa e da janela de tempo, pela grade."""
+        i0, j0 = _geo_cell(bbox[0], bbox[1])
+        i1, j1 = _geo_cell(bbox[2], bbox[3])
+        alert_ts = lambda p: str(self._alerts[p].get("ts", ""))
+        with self._lock:
+            if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self._by_cell):
+                cells = ((i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+            else:
+                cells = (c for c in self._by_cell if i0 <= c[0] <= i1 and j0 <= c[1] <= j1)
+            found = []
+            for cell in list(cells):
+                positions = self._by_cell.get(cell)
+                if not positions:
+                    continue
+                lo = bisect.bisect_left(positions, since_ts, key=alert_ts) if since_ts else 0
+                hi = bisect.bisect_right(positions, until_ts, key=alert_ts) if until_ts else len(positions)
+                for p in positions[lo:hi]:
+                    alert = self._alerts[p]
+                    if client_id is None or alert.get("client_id") in (client_id, None):
+                        found.append(alert)
+            return found
+
+    def _in_box(self, bbox, since_ts, until_ts, client_id):
+        """Frio (segmentos filtrados por data e bbox do manifesto) + quente."""
+        for alert in self.storage.iter_cold(client_id=client_id, start_day=since_ts[:10] if since_ts else None,
+                                            end_day=until_ts[:10] if until_ts else None, bbox=bbox):
+            ts = str(alert.get("ts", ""))
+            if (since_ts and ts < since_ts) or (until_ts and ts > until_ts):
+                continue
+            point = _alert_point(alert)
+            if point is not None and _in_bbox(point, bbox):
+                yield alert
+        yield from self._hot_in_box(bbox, since_ts, until_ts, client_id)
+
+    def near(self, lat, lng, radius_km, since_ts=None, until_ts=None, client_id=None, limit=200):
+        """Alertas a até radius_km do ponto, do mais próximo ao mais distante.
+
+        Cada item é uma cópia do alerta com distance_km e lat/lng já
+        convertidos para número (o registro pode guardá-los como texto).
+        """
+        found = []
+        for alert in self._in_box(_bbox_around(lat, lng, radius_km), since_ts, until_ts, client_id):
+            point = _alert_point(alert)
+            dist  = haversine_km(lat, lng, *point)
+            if dist <= radius_km:
+                found.append((dist, -int(alert.get("id") or 0), alert, point))
+        found.sort(key=lambda item: item[:2])
+        return [dict(alert, lat=point[0], lng=point[1], distance_km=round(dist, 3))
+                for dist, _, alert, point in found[:limit]]
+
+    def heat(self, bbox, bins, since_ts=None, until_ts=None, client_id=None):
+        """Contagem por célula de uma grade bins x bins sobre a caixa: {(linha, coluna): n}."""
+        lat_step = (bbox[2] - bbox[0]) / bins
+        lng_step = (bbox[3] - bbox[1]) / bins
+        counts = {}
+        for alert in self._in_box(bbox, since_ts, until_ts, client_id):
+            lat, lng = _alert_point(alert)
+            key = (min(int((lat - bbox[0]) / lat_step), bins - 1), min(int((lng - bbox[1]) / lng_step), bins - 1))
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def stats(self, day):
+        """Contadores agregados: total, do dia, com/sem localização e por cliente."""
+        cold = self.storage.cold_stats()
+        with self._lock:
+            total         = cold["total"] + len(self._alerts)
+            with_location = cold["with_location"] + self._with_location
+            today         = cold["days"].get(day, 0) + len(self._by_day.get(day, ()))
+            by_client     = dict(cold["clients"])
+            for cid, positions in self._by_client.items():
+                by_client[cid] = by_client.get(cid, 0) + len(positions)
+        return {
+            "total":            total,
+            "today":            today,
+            "with_location":    with_location,
+            "without_location": total - with_location,
+            "by_client":        by_client,
+        }
+
+    def page(self, client_id=None, start_day=None, end_day=None, situation=None,
+             has_location=None, before_id=None, limit=50):
+        """Uma página do histórico, do mais novo para o mais antigo.
+
+        before_id é o cursor (id do último alerta da página anterior).
+        Devolve (alertas, próximo cursor ou None). client_id filtra só os
+        alertas daquele cliente. O trecho quente é localizado por busca
+        binária em id e data, então o custo é proporcional à página (e aos
+        alertas descartados pelos filtros de situação/localização).
+        """
+        def wanted(alert):
+            if client_id is not None and alert.get("client_id") != client_id:
+                return False
+            if situation and alert.get("situation") != situation:
+                return False
+            if has_location is not None and _has_location(alert) != has_location:
+                return False
+            return True
+
+        found = []
+        with self._lock:
+            positions = range(len(self._alerts)) if client_id is None else self._by_client.get(client_id, [])
+            alert_id  = lambda p: int(self._alerts[p].get("id") or 0)
+            alert_day = lambda p: str(self._alerts[p].get("ts", ""))[:10]
+            hi = len(positions)
+            if before_id is not None:
+                hi = bisect.bisect_left(positions, before_id, key=alert_id)
+            if end_day:
+                hi = min(hi, bisect.bisect_right(positions, end_day, key=alert_day))
+            for i in range(hi - 1, -1, -1):
+                alert = self._alerts[positions[i]]
+                if start_day and str(alert.get("ts", ""))[:10] < start_day:
+                    break
+                if wanted(alert):
+                    found.append(alert)
+                    if len(found) > limit:
+                        break
+            oldest_hot = alert_id(positions[0]) if positions else None
+
+        if len(found) <= limit:
+            cursor = before_id
+            if oldest_hot is not None:
+                cursor = oldest_hot if cursor is None else min(cursor, oldest_hot)
+            for alert in self.storage.iter_cold_reverse(client_id, cursor, start_day, end_day):
+                if wanted(alert):
+                    found.append(alert)
+                    if len(found) > limit:
+                        break
+
+        if len(found) > limit:
+            return found[:limit], int(found[limit - 1].get("id") or 0)
+        return found, None
+
+    def last(self, client_id=None):
+        with self._lock:
+            if client_id is None:
+                if self._alerts:
+                    return self._alerts[-1]
+            else:
+                candidates = [lst[-1] for lst in (self._by_client.get(client_id),
+                                                  self._by_client.get(None)) if lst]
+                if candidates:
+                    return self._alerts[max(candidates)]
+        return self.storage.cold_last(client_id)
+
+# ==========================================
+# ESTATÍSTICAS EM COLUNAS
+# ==========================================
+
+STATS_GROUPS = ("day", "hour", "situation", "client", "location")
+_epoch_days  = {}   # "YYYY-MM-DD" -> dias desde 1970-01-01 (cache)
+
+def _ts_epoch(ts):
+    """'YYYY-MM-DD HH:MM:SS' (horário de Brasília) -> segundos; sem fuso, só para agrupar."""
+    ts = str(ts or "")
+    day = _epoch_days.get(ts[:10])
+    if day is None:
+        try:
+            day = (datetime.strptime(ts[:10], "%Y-%m-%d") - datetime(1970, 1, 1)).days
+        except ValueError:
+            return 0
+        _epoch_days[ts[:10]] = day
     try:
-        txt = ALERTS_FILE.read_text(encoding="utf-8").strip()
-        if not txt:
+        return day * 86400 + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+    except ValueError:
+        return day * 86400
+
+_day_labels = {}
+
+def _epoch_label(seconds, step):
+    day = _day_labels.get(seconds // 86400)
+    if day is None:
+        day = _day_labels[seconds // 86400] = (datetime(1970, 1, 1) + timedelta(days=seconds // 86400)).strftime("%Y-%m-%d")
+    return day if step == 86400 else f"{day} {seconds % 86400 // 3600:02d}:00"
+
+class AlertColumns:
+    """Histórico completo em colunas (módulo array) para agregações rápidas.
+
+    Uma linha por alerta, em ordem de gravação: ts (epoch), código da
+    situação (1 byte), índice do cliente e flag de localização. Como ts
+    cresce com a gravação, janelas de tempo viram duas buscas binárias e
+    séries por dia/hora são uma busca por bucket ocupado. Contagens por
+    situação e localização usam bytes.count() sobre a fatia da coluna.
+
+    sync() carrega o histórico frio uma vez e depois só acrescenta o que o
+    ALERT_STORE indexou. Uma rotação (os alertas viram segmento) mantém as
+    colunas; um clear_alerts as reconstrói. O primeiro ponto de trajeto de
+    um alerta enviado sem GPS só liga a flag de localização da linha dele.
+    """
+
+    MAX_SITUATIONS = 255   # código 255 = demais situações
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ts          = array.array("q")
+        self.situation   = array.array("B")
+        self.client      = array.array("I")
+        self.located     = array.array("B")
+        self.situations  = []
+        self._sit_codes  = {}
+        self.clients     = [None]
+        self._client_idx = {None: 0}
+        self._client_rows = {}      # índice do cliente -> linhas (array "L")
+        self._last_id    = 0
+        self._generation = None
+        self._cold_version = None
+        self._hot_seen   = 0
+        self._hot_rows   = {}       # id -> linha, só dos alertas quentes
+        self._track_cursor = None
+
+    def _append(self, alert):
+        sit = str(alert.get("situation") or "Emergência")
+        code = self._sit_codes.get(sit)
+        if code is None:
+            code = len(self.situations) if len(self.situations) < self.MAX_SITUATIONS else self.MAX_SITUATIONS
+            if code < self.MAX_SITUATIONS:
+                self.situations.append(sit)
+                self._sit_codes[sit] = code
+        cid = alert.get("client_id")
+        idx = self._client_idx.get(cid)
+        if idx is None:
+            idx = self._client_idx[cid] = len(self.clients)
+            self.clients.append(cid)
+        row = len(self.ts)
+        self.ts.append(_ts_epoch(alert.get("ts")))
+        self.situation.append(code)
+        self.client.append(idx)
+        self.located.append(1 if _has_location(alert) else 0)
+        self._client_rows.setdefault(idx, array.array("L")).append(row)
+        self._last_id = max(self._last_id, int(alert.get("id") or 0))
+
+    def sync(self):
+        with self._lock:
+            generation, hot = self.store.hot_snapshot(self._hot_seen)
+            version    = self.store.storage.cold_version()
+            skip_until = 0
+            if generation != self._generation or version != self._cold_version:
+                rotated = bool(self._generation is not None and len(self.ts)
+                               and version == self._cold_version
+                               and self.store.storage.cold_max_id() >= self._last_id)
+                if rotated:
+                    # Os alertas já vistos estão agora no segmento frio; os que
+                    # rotacionaram antes de serem vistos entram lidos do frio
+                    before, _ = self.store.hot_snapshot(0)
+                    for alert in self.store.storage.iter_cold(since_id=self._last_id):
+                        self._append(alert)
+                    skip_until = self._last_id
+                    self._hot_rows = {}
+                    generation, hot = self.store.hot_snapshot(0)
+                    if generation != before:
+                        # Outra rotação no meio da leitura: recomeça do zero
+                        skip_until = 0
+                        generation, hot = self._rebuild()
+                else:
+                    generation, hot = self._rebuild()
+                self._generation   = generation
+                self._cold_version = version
+                self._hot_seen   = 0
+            self._hot_seen += len(hot)
+            for alert in hot:
+                if skip_until and int(alert.get("id") or 0) <= skip_until:
+                    continue
+                self._append(alert)
+                self._hot_rows[alert.get("id")] = len(self.ts) - 1
+            self._track_cursor, updated = self.store.track_updates(self._track_cursor)
+            for alert in updated:
+                row = self._hot_rows.get(alert.get("id"))
+                if row is not None and _has_location(alert):
+                    self.located[row] = 1
+
+    def _rebuild(self):
+        """Recarrega o frio; repete se uma rotação acontecer no meio da leitura."""
+        for _ in range(3):
+            self._reset()
+            generation, _ = self.store.hot_snapshot(0)
+            for alert in self.store.storage.iter_cold():
+                self._append(alert)
+            again, hot = self.store.hot_snapshot(0)
+            if again == generation:
+                break
+        return again, hot
+
+    def _window(self, start, end):
+        lo = bisect.bisect_left(self.ts, start) if start is not None else 0
+        hi = bisect.bisect_right(self.ts, end) if end is not None else len(self.ts)
+        return lo, hi
+
+    def aggregate(self, group, start=None, end=None, client_id=None):
+        """Contagens agrupadas na janela [start, end] (epoch); client_id filtra um cliente."""
+        with self._lock:
+            lo, hi = self._window(start, end)
+            if client_id is not None:
+                idx  = self._client_idx.get(client_id)
+                rows = self._client_rows.get(idx, array.array("L"))
+                rows = [r for r in rows if lo <= r < hi]
+                total   = len(rows)
+                located = sum(self.located[r] for r in rows)
+            else:
+                rows    = None
+                total   = hi - lo
+                located = self.located[lo:hi].tobytes().count(1)
+
+            if group in ("day", "hour"):
+                step = 86400 if group == "day" else 3600
+                ts = self.ts if rows is None else array.array("q", (self.ts[r] for r in rows))
+                i, stop = (lo, hi) if rows is None else (0, len(ts))
+                series = []
+                while i < stop:
+                    bucket = ts[i] - ts[i] % step
+                    j = bisect.bisect_left(ts, bucket + step, i, stop)
+                    series.append((_epoch_label(bucket, step), j - i))
+                    i = j
+            elif group == "situation":
+                if rows is None:
+                    data = self.situation[lo:hi].tobytes()
+                    counts = {code: data.count(code) for code in range(len(self.situations))}
+                    counts[self.MAX_SITUATIONS] = data.count(self.MAX_SITUATIONS)
+                else:
+                    counts = collections.Counter(self.situation[r] for r in rows)
+                names  = self.situations + ["Outras"] * (self.MAX_SITUATIONS + 1 - len(self.situations))
+                series = sorted(((names[code], n) for code, n in counts.items() if n), key=lambda kv: -kv[1])
+            elif group == "client":
+                counts = collections.Counter(self.client[lo:hi] if rows is None else (self.client[r] for r in rows))
+                series = sorted(((self.clients[idx], n) for idx, n in counts.items()), key=lambda kv: -kv[1])
+            else:
+                series = [("com_localizacao", located), ("sem_localizacao", total - located)]
+
+        return {
+            "total":         total,
+            "with_location": located,
+            "coverage":      round(located / total, 4) if total else 0.0,
+            "series":        [{"key": key, "count": n} for key, n in series],
+        }
+
+# ==========================================
+# IDS DE ALERTA
+# ==========================================
+
+class AlertIdAllocator:
+    """Contador de ids de alerta compartilhado entre processos.
+
+    O valor fica em 8 bytes do alerts.seq, mapeados com mmap e protegidos
+    por flock — alocar um id não reescreve nenhum JSON. O log continua
+    sendo a fonte da verdade: ao abrir, o contador nunca fica abaixo do
+    maior id já gravado nem do last_id legado do state.json. Ids nunca
+    voltam, nem depois de clear_alerts: cursores de delta (since_id,
+    Last-Event-ID) continuam valendo.
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self._lock = threading.Lock()
+        self._fd   = None
+        self._map  = None
+
+    @contextmanager
+    def _flocked(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._fd = fd
+        with self._flocked():
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._map = mmap.mmap(fd, 8)
+            recovered = self._recover()
+            if recovered > struct.unpack_from("<Q", self._map)[0]:
+                struct.pack_into("<Q", self._map, 0, recovered)
+
+    def _recover(self):
+        try:
+            legacy = int(json.loads(STATE_FILE.read_text(encoding="utf-8")).get("last_id", 0))
+        except Exception:
+            legacy = 0
+        ALERT_STORE.refresh()
+        return max(legacy, ALERT_STORE.max_id())
+
+    def next(self):
+        with self._lock:
+            if self._map is None:
+                self._open()
+            with self._flocked():
+                value = struct.unpack_from("<Q", self._map)[0] + 1
+                struct.pack_into("<Q", self._map, 0, value)
+                return value
+
+    def current(self):
+        """Último id alocado (sem alocar outro)."""
+        with self._lock:
+            if self._map is None:
+                self._open()
+            return struct.unpack_from("<Q", self._map)[0]
+
+# ==========================================
+# ARMAZENAMENTO
+# ==========================================
+#
+# Todo acesso a disco passa por um backend com a mesma interface:
+#   load_users / save_users / update_users(change) / users_stamp
+# update_users lê, aplica change(users) e grava sob o lock do backend (flock
+# ou transação); change devolvendo False cancela a gravação.
+#   append_alerts(lote, sync) / read_alerts(cursor) / clear_alerts
+# rotate_if_needed move o trecho quente para o histórico frio; roda na thread
+# de manutenção (SegmentRotator), fora da gravação.
+# append_alerts preenche o "id" de cada alerta (payload["id"] None) dentro
+# do mesmo lock/transação da gravação: a ordem do log é sempre a ordem dos ids.
+# No mesmo lock ele confere a chave de idempotência num índice persistente
+# (que sobrevive à rotação): reenvio de chave já gravada recebe o id original,
+# não é gravado, e sua posição no lote vem na lista devolvida.
+# last_alert_id é o último id alocado; ids não voltam nem após clear_alerts.
+# read_alerts devolve (alertas_novos, novo_cursor, reset): o cursor é opaco
+# para quem chama e reset=True indica que o histórico anterior não vale mais.
+# iter_cold / cold_get / cold_last / cold_max_id dão acesso ao histórico que
+# não fica em memória (segmentos rotacionados do backend de arquivos).
+# delete_client_alerts apaga o histórico de um único cliente.
+# append_track(pontos, sync) / read_track(cursor) guardam o trajeto enviado
+# depois do alerta (POST /api/alerts/<id>/location), com o mesmo contrato de
+# cursor; o ALERT_STORE aplica cada ponto ao alerta correspondente.
+
+def _alert_matches(alert, client_id=None, since_id=0, start_day=None, end_day=None):
+    if client_id is not None and alert.get("client_id") not in (client_id, None):
+        return False
+    if since_id and int(alert.get("id") or 0) <= since_id:
+        return False
+    day = str(alert.get("ts", ""))[:10]
+    if start_day and day < start_day:
+        return False
+    if end_day and day > end_day:
+        return False
+    return True
+
+def _has_location(alert):
+    return bool(alert.get("lat") and alert.get("lng"))
+
+def _alert_id(alert):
+    return int(alert.get("id") or 0)
+
+# Índice espacial: grade de GEO_CELL_DEG graus (~1,1 km no equador)
+GEO_CELL_DEG = 0.01
+EARTH_RADIUS_KM = 6371.0088
+
+def _alert_point(alert):
+    """(lat, lng) válidos do alerta, ou None."""
+    try:
+        lat, lng = float(alert.get("lat")), float(alert.get("lng"))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None
+    return lat, lng
+
+def _geo_cell(lat, lng):
+    return math.floor(lat / GEO_CELL_DEG), math.floor(lng / GEO_CELL_DEG)
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    h = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+def _bbox_around(lat, lng, radius_km):
+    """Caixa (min_lat, min_lng, max_lat, max_lng) que contém o círculo."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    coslat = math.cos(math.radians(lat))
+    dlng = 180.0 if coslat < 1e-6 else min(180.0, dlat / coslat)
+    return max(lat - dlat, -90.0), max(lng - dlng, -180.0), min(lat + dlat, 90.0), min(lng + dlng, 180.0)
+
+def _in_bbox(point, bbox):
+    return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
+
+def _segment_bbox(alerts):
+    points = [p for p in map(_alert_point, alerts) if p]
+    if not points:
+        return None
+    lats, lngs = [p[0] for p in points], [p[1] for p in points]
+    return [min(lats), min(lngs), max(lats), max(lngs)]
+
+def _empty_stats():
+    return {"total": 0, "with_location": 0, "days": {}, "clients": {}}
+
+def _add_stats(into, stats):
+    into["total"]         += stats["total"]
+    into["with_location"] += stats["with_location"]
+    for day, n in stats["days"].items():
+        into["days"][day] = into["days"].get(day, 0) + n
+    for cid, n in stats["clients"].items():
+        into["clients"][cid] = into["clients"].get(cid, 0) + n
+
+def _segment_stats(alerts):
+    """Contadores de um segmento, no formato gravado no manifesto."""
+    days, clients = {}, {}
+    for a in alerts:
+        day = str(a.get("ts", ""))[:10]
+        days[day] = days.get(day, 0) + 1
+        clients[a.get("client_id")] = clients.get(a.get("client_id"), 0) + 1
+    return {
+        "total":         len(alerts),
+        "with_location": sum(1 for a in alerts if _has_location(a)),
+        "days":          days,
+        # lista de pares: client_id None não sobrevive como chave JSON
+        "clients":       [[cid, n] for cid, n in clients.items()],
+    }
+
+def _segment_entry(number, name, alerts):
+    """Entrada do manifesto para um segmento com estes alertas."""
+    ids  = [_alert_id(a) for a in alerts]
+    days = [str(a.get("ts", ""))[:10] for a in alerts]
+    return {
+        "number":    number,
+        "file":      name,
+        "count":     len(alerts),
+        "first_id":  min(ids),
+        "last_id":   max(ids),
+        "first_day": min(days),
+        "last_day":  max(days),
+        "clients":   sorted({a.get("client_id") for a in alerts}, key=lambda c: (c is not None, c or "")),
+        "stats":     _segment_stats(alerts),
+        "bbox":      _segment_bbox(alerts),
+    }
+
+def _entry_stats(seg):
+    """stats de uma entrada de manifesto com clients como dict."""
+    return dict(seg["stats"], clients=dict((cid, n) for cid, n in seg["stats"]["clients"]))
+
+def _shard_summary(segments):
+    """Resumo de um shard no shards.json, no mesmo formato de uma entrada de segmento."""
+    stats = _empty_stats()
+    for seg in segments:
+        _add_stats(stats, _entry_stats(seg))
+    boxes = [seg["bbox"] for seg in segments if seg.get("bbox")]
+    return {
+        "segments":  len(segments),
+        "count":     stats["total"],
+        "first_id":  min(seg["first_id"] for seg in segments),
+        "last_id":   max(seg["last_id"] for seg in segments),
+        "first_day": min(seg["first_day"] for seg in segments),
+        "last_day":  max(seg["last_day"] for seg in segments),
+        "clients":   segments[0]["clients"],
+        "stats":     dict(stats, clients=[[cid, n] for cid, n in stats["clients"].items()]),
+        "bbox":      [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                      max(b[2] for b in boxes), max(b[3] for b in boxes)] if boxes else None,
+    }
+
+# Particionamento por cliente: cada client_id tem sua pasta em alerts.d/,
+# e os alertas anônimos (sem client_id) ficam no shard "anon".
+ANON_SHARD = "anon"
+
+def alert_shard(client_id):
+    """Nome do shard (pasta em alerts.d/) que guarda os alertas do cliente."""
+    if client_id is None:
+        return ANON_SHARD
+    cid  = str(client_id)
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", cid)[:48]
+    if safe != cid:
+        safe += "-" + hashlib.sha1(cid.encode("utf-8")).hexdigest()[:8]
+    return "c-" + safe
+
+# Registro compacto de alerta: os alertas em memória (ALERT_STORE, segmentos
+# lidos) são Alert em vez de dict. A "location" aninhada não é guardada
+# quando só repete lat/lng/accuracy, e campos de baixa cardinalidade
+# (situação, nome, client_id, ip) são compartilhados por uma tabela de
+# internação limitada. Campo ausente no registro fica None no slot (os
+# templates leem alerta.campo) e listado em _absent, para [] e dict()
+# continuarem sem ele.
+
+_MISSING = object()
+_FLAT    = object()   # location == {"lat", "lng", "accuracy"} dos campos planos
+INTERN_MAX = 4096     # valores distintos internados por campo
+
+class Alert(Mapping):
+    """Alerta somente leitura com __slots__; se comporta como um dict (get, [], **, dict())."""
+
+    __slots__ = ("id", "ts", "name", "situation", "message", "client_id",
+                 "_location", "lat", "lng", "accuracy", "track", "ip", "idempotency_key",
+                 "_extra", "_absent")
+
+    # Mesma ordem do payload de /api/send_alert
+    FIELDS   = ("id", "ts", "name", "situation", "message", "client_id",
+                "location", "lat", "lng", "accuracy", "track", "ip", "idempotency_key")
+    INTERNED = ("name", "situation", "client_id", "ip")
+    _tables  = {field: {} for field in INTERNED}
+    _absents = {}   # tuplas de campos ausentes, compartilhadas entre alertas
+    _layouts = {}   # chaves do registro, na ordem -> tupla de ausentes
+
+    @classmethod
+    def _intern(cls, field, value):
+        if not isinstance(value, str):
+            return value
+        table = cls._tables[field]
+        shared = table.get(value)
+        if shared is None:
+            if len(table) >= INTERN_MAX:
+                return value
+            shared = table[value] = value
+        return shared
+
+    @classmethod
+    def from_dict(cls, data):
+        self = cls.__new__(cls)
+        get = data.get
+        self.id        = get("id")
+        self.ts        = get("ts")
+        self.message   = get("message")
+        self.lat       = get("lat")
+        self.lng       = get("lng")
+        self.accuracy  = get("accuracy")
+        self.track     = get("track")
+        self.idempotency_key = get("idempotency_key")
+        for field in cls.INTERNED:
+            setattr(self, field, cls._intern(field, get(field)))
+        layout = tuple(data)
+        absent = cls._layouts.get(layout)
+        if absent is None:
+            absent = tuple(field for field in cls.FIELDS if field not in data and field != "location")
+            absent = cls._absents.setdefault(absent, absent)
+            if len(cls._layouts) < INTERN_MAX:
+                cls._layouts[layout] = absent
+        self._absent = absent
+        location = get("location", _MISSING)
+        if isinstance(location, dict) and location == {"lat": self.lat, "lng": self.lng, "accuracy": self.accuracy}:
+            location = _FLAT
+        self._location = location
+        extra = {k: v for k, v in data.items() if k not in cls.FIELDS}
+        self._extra = extra or None
+        return self
+
+    @property
+    def location(self):
+        location = self._location
+        if location is _FLAT:
+            return {"lat": self.lat, "lng": self.lng, "accuracy": self.accuracy}
+        return None if location is _MISSING else location
+
+    def with_point(self, point):
+        """Cópia com point como posição atual e acrescentado ao trajeto ("track").
+
+        O trajeto começa pela posição enviada com o alerta, se houver.
+        """
+        new = Alert.__new__(Alert)
+        for slot in self.__slots__:
+            setattr(new, slot, getattr(self, slot))
+        if self.track:
+            track = list(self.track)
+        elif _has_location(self):
+            track = [{"ts": self.get("ts"), "lat": self.lat, "lng": self.lng, "accuracy": self.get("accuracy")}]
+        else:
+            track = []
+        track.append(point)
+        new.track     = track
+        new.lat       = point["lat"]
+        new.lng       = point["lng"]
+        new.accuracy  = point.get("accuracy")
+        new._location = _FLAT
+        absent = tuple(f for f in self._absent if f not in ("track", "lat", "lng", "accuracy"))
+        new._absent = Alert._absents.setdefault(absent, absent)
+        return new
+
+    def __getitem__(self, key):
+        if key == "location":
+            if self._location is _MISSING:
+                raise KeyError(key)
+            return self.location
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is None and key in self._absent:
+                raise KeyError(key)
+            return value
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        absent = self._absent
+        for key in self.FIELDS:
+            if key == "location":
+                if self._location is not _MISSING:
+                    yield key
+            elif key not in absent:
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return f"Alert({self.to_dict()!r})"
+
+class AuroraJSONProvider(DefaultJSONProvider):
+    """jsonify() serializa Alert como dict."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Alert):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+app.json = AuroraJSONProvider(app)
+
+def clean_client_id(value):
+    """client_id vindo de fora (JSON, token): texto de até 64 caracteres, ou None."""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return None
+    return str(value).strip()[:64] or None
+
+def _clean_alert(data):
+    """Registro lido do armazenamento pronto para indexar, ou None se inutilizável.
+
+    O /api/send_alert não exige login e versões anteriores gravavam o
+    client_id como veio. Um client_id (ou chave) que não é texto viraria
+    chave de dict no índice e derrubaria todo refresh; aqui ele é
+    normalizado, e registro sem id inteiro é ignorado.
+    """
+    if not isinstance(data, dict):
+        return None
+    alert_id = data.get("id")
+    if isinstance(alert_id, bool) or not isinstance(alert_id, int):
+        return None
+    client_id = data.get("client_id")
+    if client_id is not None and not isinstance(client_id, str):
+        data["client_id"] = clean_client_id(client_id)
+    key = data.get("idempotency_key")
+    if key is not None and not isinstance(key, str):
+        del data["idempotency_key"]
+    return Alert.from_dict(data)
+
+def _parse_alert_lines(data):
+    alerts = []
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            alert = _clean_alert(json.loads(line))
+        except Exception:
+            continue
+        if alert is not None:
+            alerts.append(alert)
+    return alerts
+
+def _parse_track_lines(data):
+    points = []
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            point = json.loads(line)
+        except Exception:
+            continue
+        if isinstance(point, dict) and point.get("id") is not None:
+            points.append(point)
+    return points
+
+def _track_point(point):
+    """Ponto como fica no trajeto do alerta (sem o id do alerta)."""
+    return {k: v for k, v in point.items() if k != "id"}
+
+class FileStorage:
+    """Backend original: users.json, alerts.log e alerts.seq.
+
+    O alerts.log é o segmento ativo, compartilhado por todos os clientes.
+    Na virada do dia (ou ao passar de AURORA_SEGMENT_MAX_BYTES) ele é
+    dividido por cliente: os alertas de cada client_id viram
+    alerts.d/<shard>/seg-NNNNNN.log.gz (gzip), registrados no
+    alerts.d/<shard>/manifest.json com faixa de ids, faixa de datas e
+    totais; o alerts.d/shards.json resume cada shard. Assim o histórico de
+    um cliente só lê o shard dele e o "anon", e apagar um cliente remove
+    uma pasta. O alerts.d/manifest.json guarda os segmentos mistos de
+    versões anteriores, que continuam sendo lidos. Gravação, rotação e
+    limpeza são serializadas entre processos por flock no alerts.lock.
+
+    Os pontos de trajeto chegam depois do alerta e vão para o alerts.track
+    (um JSON por linha, com o id do alerta). Na rotação eles são aplicados
+    aos alertas antes de virarem segmento, e o alerts.track recomeça vazio.
+    """
+
+    name = "files"
+
+    def __init__(self):
+        self.ids             = AlertIdAllocator(SEQ_FILE)
+        self._json_cache     = {}     # caminho -> (carimbo, documento) dos manifestos
+        self._cold_stats     = None   # (manifesto, índice, totais) — recalculado quando mudam
+        self._seg_stats      = {}     # segmentos antigos, sem "stats" no manifesto
+        self._seg_cache      = OrderedDict()   # caminho -> (carimbo, alertas), LRU
+        self._seg_cached     = 0               # alertas somados no _seg_cache
+        self._seg_lock       = threading.Lock()
+        self._lock_fd        = None
+        self._lock_pid       = None
+        self._keys           = {}     # chave de idempotência -> (id, epoch) do alerts.keys
+        self._keys_inode     = None
+        self._keys_offset    = 0
+        self._xlock          = threading.RLock()
+        self._xdepth         = 0
+        self._mlock          = threading.Lock()
+
+    def load_users(self):
+        ensure_files()
+        try:
+            return json.loads(USERS_FILE.read_text(encoding="utf-8"))
+        except Exception:
+            return default_users()
+
+    def save_users(self, data):
+        with self._exclusive():
+            self._write_users(data)
+
+    def update_users(self, change):
+        """Lê-altera-grava o users.json sob o flock: (usuários, carimbo, gravou)."""
+        with self._exclusive():
+            users = self.load_users()
+            if change(users) is False:
+                return users, self.users_stamp(), False
+            self._write_users(users)
+            return users, self.users_stamp(), True
+
+    @staticmethod
+    def _write_users(data):
+        # Escrita atômica: arquivo temporário na mesma pasta + rename
+        fd, tmp = tempfile.mkstemp(dir=str(USERS_FILE.parent), prefix=".users-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data, indent=2, ensure_ascii=False))
+            os.replace(tmp, USERS_FILE)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def users_stamp(self):
+        """Muda sempre que o users.json é reescrito (por qualquer processo)."""
+        try:
+            st = USERS_FILE.stat()
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def _exclusive(self):
+        """Lock entre processos e threads para gravar, rotacionar ou limpar.
+
+        O flock é por descritor, e as threads do worker compartilham o
+        mesmo; o RLock é o que as separa. Reentrante na mesma thread.
+        """
+        with self._xlock:
+            self._xdepth += 1
+            try:
+                if self._xdepth == 1 and fcntl is not None:
+                    if self._lock_fd is None or self._lock_pid != os.getpid():
+                        self._lock_fd  = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+                        self._lock_pid = os.getpid()
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if self._xdepth == 1 and fcntl is not None:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            finally:
+                self._xdepth -= 1
+
+    @staticmethod
+    def _append(path, records, sync):
+        with path.open("a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def append_alerts(self, payloads, sync):
+        """Grava o lote inteiro com um único write (e um fsync, se sync).
+
+        Devolve as posições do lote que repetiam uma chave de idempotência já
+        gravada (por qualquer processo, antes ou depois de uma rotação).
+        """
+        ensure_files()
+        with self._exclusive():
+            keys = self._key_index()
+            now  = time.time()
+            fresh, duplicates, new_keys = [], [], {}
+            for pos, payload in enumerate(payloads):
+                key   = payload.get("idempotency_key")
+                known = (new_keys.get(key) or keys.get(key)) if key else None
+                if known is not None and known[1] + IDEMPOTENCY_TTL > now:
+                    payload["id"] = known[0]
+                    duplicates.append(pos)
+                    continue
+                if payload.get("id") is None:
+                    payload["id"] = self.ids.next()
+                if key:
+                    new_keys[key] = (payload["id"], now)
+                fresh.append(payload)
+            # Alerta antes da chave: uma queda entre os dois gera no máximo um
+            # duplicado, nunca uma chave apontando para alerta que não existe
+            if fresh:
+                self._append(ALERTS_FILE, fresh, sync)
+            if new_keys:
+                self._append(KEYS_FILE, [{"key": k, "id": v[0], "t": v[1]} for k, v in new_keys.items()], sync)
+                keys.update(new_keys)
+        return duplicates
+
+    def last_alert_id(self):
+        return self.ids.current()
+
+    def append_track(self, points, sync):
+        """Pontos {"id", "ts", "lat", "lng", "accuracy"} no alerts.track."""
+        with self._exclusive():
+            self._append(TRACK_FILE, points, sync)
+
+    # --- chaves de idempotência ----------------------------------------------
+
+    def _key_index(self):
+        """{chave: (id, epoch)} do alerts.keys; chamar sob _exclusive.
+
+        Lê só o que outros processos acrescentaram desde a última vez; inode
+        novo (compactação ou clear_alerts) recarrega tudo.
+        """
+        try:
+            st = KEYS_FILE.stat()
+        except OSError:
+            self._seed_keys()
+            st = KEYS_FILE.stat()
+        if st.st_ino != self._keys_inode or st.st_size < self._keys_offset:
+            self._keys, self._keys_inode, self._keys_offset = {}, st.st_ino, 0
+        if st.st_size > self._keys_offset:
+            with KEYS_FILE.open("rb") as f:
+                f.seek(self._keys_offset)
+                chunk = f.read(st.st_size - self._keys_offset)
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].split(b"\n"):
+                try:
+                    record = json.loads(line)
+                    self._keys[record["key"]] = (record["id"], record["t"])
+                except Exception:
+                    continue
+            self._keys_offset += end
+        return self._keys
+
+    def _seed_keys(self):
+        """Primeira execução: indexa as chaves que já estão no log ativo."""
+        try:
+            alerts = _parse_alert_lines(ALERTS_FILE.read_bytes())
+        except OSError:
+            alerts = []
+        now = time.time()
+        self._replace_file(KEYS_FILE, "".join(
+            json.dumps({"key": a.get("idempotency_key"), "id": a.get("id"), "t": now}) + "\n"
+            for a in alerts if a.get("idempotency_key")).encode("utf-8"))
+
+    def _compact_keys(self):
+        """Reescreve o alerts.keys só com as chaves ainda dentro do TTL."""
+        limit = time.time() - IDEMPOTENCY_TTL
+        live  = {k: v for k, v in self._key_index().items() if v[1] > limit}
+        self._replace_file(KEYS_FILE, "".join(
+            json.dumps({"key": k, "id": v[0], "t": v[1]}) + "\n" for k, v in live.items()).encode("utf-8"))
+
+    # --- segmentos -------------------------------------------------------
+
+    def _load_json(self, path):
+        """Documento JSON (manifesto/índice), relido quando outro processo o altera."""
+        try:
+            st = path.stat()
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._mlock:
+            cached = self._json_cache.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            try:
+                doc = json.loads(path.read_text(encoding="utf-8")) if stamp else {}
+            except Exception:
+                doc = {}
+            self._json_cache[path] = (stamp, doc)
+            return doc
+
+    def _write_json(self, path, doc):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(doc, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def manifest(self):
+        """Segmentos legados (mistos, gravados antes dos shards)."""
+        return self._load_json(SEGMENTS_DIR / "manifest.json").get("segments", [])
+
+    def shard_index(self):
+        """{shard: resumo} de alerts.d/shards.json."""
+        return self._load_json(SEGMENTS_DIR / "shards.json").get("shards", {})
+
+    def shard_manifest(self, shard):
+        return self._load_json(SEGMENTS_DIR / shard / "manifest.json").get("segments", [])
+
+    def cold_version(self):
+        """Muda quando alertas frios são apagados (não quando só chegam novos)."""
+        return self._load_json(SEGMENTS_DIR / "shards.json").get("purges", 0)
+
+    def _write_index(self, shards, purged=False):
+        doc = self._load_json(SEGMENTS_DIR / "shards.json")
+        self._write_json(SEGMENTS_DIR / "shards.json",
+                         {"purges": doc.get("purges", 0) + (1 if purged else 0), "shards": shards})
+
+    def _needs_rotation(self):
+        try:
+            size = ALERTS_FILE.stat().st_size
+            if size == 0:
+                return False
+            if size >= SEGMENT_MAX_BYTES:
+                return True
+            with ALERTS_FILE.open("rb") as f:
+                first = json.loads(f.readline())
+            day = str(first.get("ts", ""))[:10]
+            return bool(day) and day < today_str()
+        except Exception:
+            return False
+
+    def rotate_if_needed(self):
+        """Rotaciona se o log passou do tamanho ou do dia; True se rotacionou.
+
+        Chamada pela thread de manutenção (SegmentRotator), nunca no caminho
+        de gravação do SOS. Confere de novo sob o lock: com vários workers
+        só um deles rotaciona.
+        """
+        if not self._needs_rotation():
+            return False
+        with self._exclusive():
+            if not self._needs_rotation():
+                return False
+            self._rotate()
+        return True
+
+    def _rotate(self):
+        """Divide o alerts.log atual em segmentos por shard e começa um log vazio.
+
+        O log ativo é trocado por rename (inode novo), o que faz os leitores
+        de todos os processos reconstruírem o trecho quente. clear_alerts e
+        delete_client_alerts usam o mesmo mecanismo.
+        """
+        track  = self._track_by_alert()
+        groups = {}   # shard -> (linhas, alertas)
+        for line in ALERTS_FILE.read_bytes().split(b"\n"):
+            parsed = _parse_alert_lines(line)
+            if parsed:
+                alert = parsed[0]
+                if alert.get("id") in track:
+                    for point in track[alert.get("id")]:
+                        alert = alert.with_point(point)
+                    line = json.dumps(dict(alert), ensure_ascii=False).encode("utf-8")
+                lines, alerts = groups.setdefault(alert_shard(alert.get("client_id")), ([], []))
+                lines.append(line)
+                alerts.append(alert)
+        if not groups:
+            return
+        shards = dict(self.shard_index())
+        for shard, (lines, alerts) in groups.items():
+            segments = list(self.shard_manifest(shard))
+            # Rotação interrompida antes de trocar o log: este lote já está no shard
+            if not (segments and segments[-1]["last_id"] >= max(map(_alert_id, alerts))):
+                number = max((seg["number"] for seg in segments), default=0) + 1
+                name   = f"{shard}/seg-{number:06d}.log.gz"
+                self._write_segment(name, b"\n".join(lines) + b"\n")
+                segments.append(_segment_entry(number, name, alerts))
+                self._write_json(SEGMENTS_DIR / shard / "manifest.json", {"segments": segments})
+            shards[shard] = _shard_summary(segments)
+        self._write_index(shards)
+        self._replace_active()
+        self._replace_track()
+        self._compact_keys()
+
+    def _track_by_alert(self):
+        """{id do alerta: pontos} do alerts.track, na ordem de chegada."""
+        try:
+            data = TRACK_FILE.read_bytes()
+        except OSError:
+            return {}
+        track = {}
+        for point in _parse_track_lines(data):
+            track.setdefault(point["id"], []).append(_track_point(point))
+        return track
+
+    def _write_segment(self, name, data):
+        path = SEGMENTS_DIR / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _replace_file(path, data):
+        new = path.with_name(path.name + ".new")
+        new.write_bytes(data)
+        os.replace(new, path)
+
+    def _replace_active(self, data=b""):
+        self._replace_file(ALERTS_FILE, data)
+
+    def _replace_track(self, data=b""):
+        """Troca o alerts.track (inode novo faz os leitores reaplicarem o trajeto)."""
+        if TRACK_FILE.exists():
+            self._replace_file(TRACK_FILE, data)
+
+    def _read_segment(self, seg):
+        """Alertas do segmento, do cache LRU quando o arquivo não mudou.
+
+        Segmentos só são regravados por rename (inode novo), então o carimbo
+        do arquivo valida a entrada. A lista devolvida é compartilhada: não
+        alterar.
+        """
+        path = SEGMENTS_DIR / seg["file"]
+        try:
+            st = path.stat()
+        except OSError:
             return []
-        alerts = []
-        for line in txt.split("\n"):
-            if line.strip():
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._seg_lock:
+            cached = self._seg_cache.get(path)
+            if cached is not None and cached[0] == stamp:
+                self._seg_cache.move_to_end(path)
+                return cached[1]
+        try:
+            with gzip.open(path, "rb") as f:
+                alerts = _parse_alert_lines(f.read())
+        except OSError:
+            return []
+        with self._seg_lock:
+            old = self._seg_cache.pop(path, None)
+            if old is not None:
+                self._seg_cached -= len(old[1])
+            if len(alerts) <= SEGMENT_CACHE_ALERTS:
+                self._seg_cache[path] = (stamp, alerts)
+                self._seg_cached += len(alerts)
+            while self._seg_cached > SEGMENT_CACHE_ALERTS:
+                self._seg_cached -= len(self._seg_cache.popitem(last=False)[1][1])
+        return alerts
+
+    def _segment_wanted(self, seg, client_id, since_id, start_day, end_day, bbox=None):
+        if bbox is not None and "bbox" in seg:
+            box = seg["bbox"]
+            if box is None or box[0] > bbox[2] or box[2] < bbox[0] or box[1] > bbox[3] or box[3] < bbox[1]:
+                return False
+        if since_id and seg["last_id"] <= since_id:
+            return False
+        if start_day and seg["last_day"] < start_day:
+            return False
+        if end_day and seg["first_day"] > end_day:
+            return False
+        if client_id is not None and client_id not in seg["clients"] and None not in seg["clients"]:
+            return False
+        return True
+
+    def _sources(self, client_id, since_id=0, start_day=None, end_day=None, bbox=None):
+        """Listas de segmentos a consultar: legado + shards do cliente (e anônimo), ou todos."""
+        index = self.shard_index()
+        if client_id is None:
+            shards = list(index)
+        else:
+            shards = [s for s in (alert_shard(client_id), ANON_SHARD) if s in index]
+        sources = [self.manifest()]
+        for shard in shards:
+            if self._segment_wanted(index[shard], client_id, since_id, start_day, end_day, bbox):
+                sources.append(self.shard_manifest(shard))
+        return [segments for segments in sources if segments]
+
+    def iter_cold(self, client_id=None, since_id=0, start_day=None, end_day=None, bbox=None):
+        """Alertas dos segmentos frios em ordem de id, pulando shards e segmentos descartados."""
+        def scan(segments):
+            for seg in segments:
+                if not self._segment_wanted(seg, client_id, since_id, start_day, end_day, bbox):
+                    continue
+                for alert in self._read_segment(seg):
+                    if _alert_matches(alert, client_id, since_id, start_day, end_day):
+                        yield alert
+
+        sources = self._sources(client_id, since_id, start_day, end_day, bbox)
+        if len(sources) == 1:
+            yield from scan(sources[0])
+        else:
+            yield from heapq.merge(*map(scan, sources), key=_alert_id)
+
+    def cold_get(self, alert_id):
+        index = self.shard_index()
+        sources = [self.manifest()] + [self.shard_manifest(shard) for shard, info in index.items()
+                                       if info["first_id"] <= alert_id <= info["last_id"]]
+        for segments in sources:
+            for seg in reversed(segments):
+                if seg["first_id"] <= alert_id <= seg["last_id"]:
+                    for alert in self._read_segment(seg):
+                        if alert.get("id") == alert_id:
+                            return alert
+        return None
+
+    def cold_last(self, client_id=None):
+        return next(self.iter_cold_reverse(client_id), None)
+
+    def iter_cold_reverse(self, client_id=None, before_id=None, start_day=None, end_day=None):
+        """Como iter_cold, do mais novo para o mais antigo e só com id < before_id.
+
+        A fusão entre shards é preguiçosa: um segmento só é descomprimido
+        quando o seu last_id passa a ser o maior candidato. Assim a primeira
+        página do admin lê um ou dois segmentos, e não o mais novo de cada
+        shard (o que também esvaziaria o cache de segmentos a cada página).
+        """
+        def segments(source):
+            for seg in reversed(source):
+                if before_id is not None and seg["first_id"] >= before_id:
+                    continue
+                if self._segment_wanted(seg, client_id, 0, start_day, end_day):
+                    yield seg
+
+        def alerts(seg):
+            for alert in reversed(self._read_segment(seg)):
+                if before_id is not None and _alert_id(alert) >= before_id:
+                    continue
+                if _alert_matches(alert, client_id, 0, start_day, end_day):
+                    yield alert
+
+        # Heap de (-chave, desempate, fonte, alertas do segmento aberto, item):
+        # item é um segmento ainda fechado (chave = last_id) ou um alerta
+        heap, tie = [], 0
+        def push(key, source, found, item):
+            nonlocal tie
+            tie += 1
+            heapq.heappush(heap, (-key, tie, source, found, item))
+
+        for source in self._sources(client_id, 0, start_day, end_day):
+            source = segments(source)
+            seg = next(source, None)
+            if seg is not None:
+                push(seg["last_id"], source, None, seg)
+        while heap:
+            _, _, source, found, item = heapq.heappop(heap)
+            if found is None:
+                found = alerts(item)
+                seg = next(source, None)
+                if seg is not None:
+                    push(seg["last_id"], source, None, seg)
+            else:
+                yield item
+            alert = next(found, None)
+            if alert is not None:
+                push(_alert_id(alert), source, found, alert)
+
+    def cold_max_id(self):
+        legacy = max((seg["last_id"] for seg in self.manifest()), default=0)
+        return max([legacy] + [info["last_id"] for info in self.shard_index().values()])
+
+    def cold_stats(self):
+        """Totais dos segmentos frios (total, com localização, por dia, por cliente)."""
+        manifest, index = self.manifest(), self.shard_index()
+        cached = self._cold_stats
+        if cached is not None and cached[0] is manifest and cached[1] is index:
+            return cached[2]
+        totals = _empty_stats()
+        for seg in manifest:
+            if seg.get("stats") is None:
+                # Manifesto de versão anterior: lê o segmento uma vez
+                stats = self._seg_stats.get(seg["file"])
+                if stats is None:
+                    stats = self._seg_stats[seg["file"]] = _segment_stats(self._read_segment(seg))
+                seg = dict(seg, stats=stats)
+            _add_stats(totals, _entry_stats(seg))
+        for info in index.values():
+            _add_stats(totals, _entry_stats(info))
+        self._cold_stats = (manifest, index, totals)
+        return totals
+
+    def read_alerts(self, cursor):
+        """Cursor = (inode, offset); lê só os bytes novos do alerts.log."""
+        return self._read_log(ALERTS_FILE, cursor, _parse_alert_lines)
+
+    def read_track(self, cursor):
+        return self._read_log(TRACK_FILE, cursor, _parse_track_lines)
+
+    @staticmethod
+    def _read_log(path, cursor, parse):
+        try:
+            st = path.stat()
+        except OSError:
+            return [], None, cursor is not None
+        inode, offset = cursor or (st.st_ino, 0)
+        reset = False
+        if st.st_ino != inode or st.st_size < offset:
+            inode, offset, reset = st.st_ino, 0, True
+        if st.st_size == offset:
+            return [], (inode, offset), reset
+        try:
+            with path.open("rb") as f:
+                f.seek(offset)
+                chunk = f.read(st.st_size - offset)
+        except OSError:
+            return [], (inode, offset), reset
+        # Só consome até a última linha completa; o resto fica para depois
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return [], (inode, offset), reset
+        return parse(chunk[:end]), (inode, offset + end + 1), reset
+
+    def clear_alerts(self):
+        with self._exclusive():
+            for seg in self.manifest():
+                try:
+                    (SEGMENTS_DIR / seg["file"]).unlink()
+                except OSError:
+                    pass
+            if self.manifest():
+                self._write_json(SEGMENTS_DIR / "manifest.json", {"segments": []})
+            shards = self.shard_index()
+            if shards:
+                self._write_index({}, purged=True)
+                for shard in shards:
+                    shutil.rmtree(SEGMENTS_DIR / shard, ignore_errors=True)
+            self._replace_active()
+            self._replace_track()
+            self._replace_file(KEYS_FILE, b"")
+
+    def delete_client_alerts(self, client_id):
+        """Apaga os alertas de um cliente; devolve quantos foram removidos.
+
+        O custo é o shard do cliente (uma pasta) mais o log ativo; segmentos
+        legados só são reescritos se citarem o cliente.
+        """
+        shard = alert_shard(client_id)
+        with self._exclusive():
+            shards  = dict(self.shard_index())
+            removed = shards.pop(shard, {}).get("count", 0)
+
+            legacy, changed = [], False
+            for seg in self.manifest():
+                if client_id not in seg["clients"]:
+                    legacy.append(seg)
+                    continue
+                changed = True
+                alerts  = self._read_segment(seg)
+                keep    = [a for a in alerts if a.get("client_id") != client_id]
+                removed += len(alerts) - len(keep)
+                if keep:
+                    self._write_segment(seg["file"], "".join(
+                        json.dumps(dict(a), ensure_ascii=False) + "\n" for a in keep).encode("utf-8"))
+                    legacy.append(_segment_entry(seg["number"], seg["file"], keep))
+                else:
+                    try:
+                        (SEGMENTS_DIR / seg["file"]).unlink()
+                    except OSError:
+                        pass
+            if changed:
+                self._write_json(SEGMENTS_DIR / "manifest.json", {"segments": legacy})
+
+            self._write_index(shards, purged=True)
+            shutil.rmtree(SEGMENTS_DIR / shard, ignore_errors=True)
+
+            # Sempre troca o log ativo (inode novo): todos os processos
+            # reconstroem o trecho quente e invalidam caches por geração
+            try:
+                lines = ALERTS_FILE.read_bytes().split(b"\n")
+            except OSError:
+                lines = []
+            keep, gone = [], set()
+            for line in lines:
+                parsed = _parse_alert_lines(line)
+                if not parsed:
+                    continue
+                if parsed[0].get("client_id") == client_id:
+                    removed += 1
+                    gone.add(parsed[0].get("id"))
+                else:
+                    keep.append(line + b"\n")
+            self._replace_active(b"".join(keep))
+            if gone:
+                try:
+                    points = _parse_track_lines(TRACK_FILE.read_bytes())
+                except OSError:
+                    points = []
+                self._replace_track("".join(json.dumps(p, ensure_ascii=False) + "\n"
+                                            for p in points if p["id"] not in gone).encode("utf-8"))
+        return removed
+
+class SQLiteStorage:
+    """Backend SQLite em modo WAL: leitores não bloqueiam o escritor.
+
+    Usuários ficam numa tabela com índices por role e client_id (o registro
+    completo vai em JSON na coluna data); alertas ficam numa tabela com seq
+    AUTOINCREMENT, usado como cursor do ALERT_STORE; os pontos de trajeto
+    ficam na alert_track, com o próprio seq. Na primeira abertura
+    de um banco vazio os dados dos arquivos JSON/log são importados.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username  TEXT PRIMARY KEY,
+            role      TEXT,
+            client_id TEXT,
+            data      TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_role   ON users(role);
+        CREATE INDEX IF NOT EXISTS idx_users_client ON users(client_id);
+        CREATE TABLE IF NOT EXISTS alerts (
+            seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+            id        INTEGER NOT NULL,
+            ts        TEXT,
+            client_id TEXT,
+            data      TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_alerts_client ON alerts(client_id, seq);
+        CREATE INDEX IF NOT EXISTS idx_alerts_ts     ON alerts(ts);
+        CREATE TABLE IF NOT EXISTS alert_track (
+            seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id  INTEGER NOT NULL,
+            data      TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_track_alert ON alert_track(alert_id);
+        CREATE TABLE IF NOT EXISTS alert_keys (
+            key       TEXT PRIMARY KEY,
+            alert_id  INTEGER NOT NULL,
+            created   REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_keys_created ON alert_keys(created);
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path   = path
+        self._local = threading.local()
+        con = self._conn()
+        con.executescript(self.SCHEMA)
+        with self._tx() as cur:
+            cur.execute("INSERT OR IGNORE INTO meta(key, value) VALUES "
+                        "('last_id', 0), ('generation', 1), ('users_version', 1)")
+        self._migrate_from_files()
+        self._migrate_keys()
+
+    def _conn(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @contextmanager
+    def _tx(self):
+        """Transação de escrita (BEGIN IMMEDIATE evita deadlock de upgrade)."""
+        con = self._conn()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def _migrate_from_files(self):
+        """Importa users.json, alerts.log e o último id, uma única vez."""
+        with self._tx() as con:
+            if con.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return
+            if not con.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+                users = None
+                try:
+                    users = json.loads(USERS_FILE.read_text(encoding="utf-8"))
+                except Exception:
+                    pass
+                self._write_users(con, users or default_users())
+            if not con.execute("SELECT 1 FROM alerts LIMIT 1").fetchone():
+                last_id = 0
+                files = FileStorage()
+                alerts = list(files.iter_cold()) + files.read_alerts(None)[0]
+                for alert in alerts:
+                    self._insert_alert(con, alert)
+                    last_id = max(last_id, int(alert.get("id") or 0))
                 try:
-                    alerts.append(json.loads(line))
+                    last_id = max(last_id, int(json.loads(STATE_FILE.read_text(encoding="utf-8")).get("last_id", 0)))
                 except Exception:
                     pass
+                con.execute("UPDATE meta SET value = ? WHERE key = 'last_id'", (last_id,))
+            con.execute("INSERT INTO meta(key, value) VALUES ('migrated', 1)")
+
+    def _migrate_keys(self):
+        """Bancos anteriores à alert_keys: indexa as chaves dos alertas já gravados."""
+        with self._tx() as con:
+            if con.execute("SELECT 1 FROM meta WHERE key = 'keys_indexed'").fetchone():
+                return
+            now = time.time()
+            for alert_id, data in con.execute(
+                    "SELECT id, data FROM alerts WHERE data LIKE '%idempotency_key%'").fetchall():
+                try:
+                    key = json.loads(data).get("idempotency_key")
+                except Exception:
+                    continue
+                if key:
+                    con.execute("INSERT OR IGNORE INTO alert_keys(key, alert_id, created) VALUES (?, ?, ?)",
+                                (key, alert_id, now))
+            con.execute("INSERT INTO meta(key, value) VALUES ('keys_indexed', 1)")
+
+    @staticmethod
+    def _write_users(con, users):
+        con.executemany(
+            "INSERT OR REPLACE INTO users(username, role, client_id, data) VALUES (?, ?, ?, ?)",
+            [(u, info.get("role"), info.get("client_id"), json.dumps(info, ensure_ascii=False))
+             for u, info in users.items()])
+
+    @staticmethod
+    def _insert_alert(con, alert):
+        con.execute("INSERT INTO alerts(id, ts, client_id, data) VALUES (?, ?, ?, ?)",
+                    (int(alert.get("id") or 0), alert.get("ts"), alert.get("client_id"),
+                     json.dumps(dict(alert), ensure_ascii=False)))
+
+    def load_users(self):
+        rows = self._conn().execute("SELECT username, data FROM users").fetchall()
+        return {u: json.loads(data) for u, data in rows} or default_users()
+
+    def save_users(self, data):
+        with self._tx() as con:
+            con.execute("DELETE FROM users")
+            self._write_users(con, data)
+            self._bump_users_version(con)
+
+    def update_users(self, change):
+        """Lê-altera-grava dentro de uma transação: (usuários, versão, gravou)."""
+        with self._tx() as con:
+            before = {u: json.loads(data) for u, data in con.execute("SELECT username, data FROM users")}
+            users  = dict(before) or default_users()
+            if change(users) is not False:
+                gone = [u for u in before if u not in users]
+                con.executemany("DELETE FROM users WHERE username = ?", [(u,) for u in gone])
+                self._write_users(con, {u: info for u, info in users.items() if before.get(u) != info})
+                self._bump_users_version(con)
+                changed = True
+            else:
+                changed = False
+            version = con.execute("SELECT value FROM meta WHERE key = 'users_version'").fetchone()[0]
+        return users, version, changed
+
+    @staticmethod
+    def _bump_users_version(con):
+        con.execute("UPDATE meta SET value = value + 1 WHERE key = 'users_version'")
+
+    def users_stamp(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'users_version'").fetchone()[0]
+
+    def append_alerts(self, payloads, sync):
+        # Em WAL, synchronous=FULL faz o COMMIT esperar o fsync do journal
+        self._conn().execute(f"PRAGMA synchronous={'FULL' if sync else 'NORMAL'}")
+        now        = time.time()
+        duplicates = []
+        with self._tx() as con:
+            con.execute("DELETE FROM alert_keys WHERE created < ?", (now - IDEMPOTENCY_TTL,))
+            for pos, payload in enumerate(payloads):
+                key = payload.get("idempotency_key")
+                if key:
+                    row = con.execute("SELECT alert_id FROM alert_keys WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        payload["id"] = row[0]
+                        duplicates.append(pos)
+                        continue
+                if payload.get("id") is None:
+                    con.execute("UPDATE meta SET value = value + 1 WHERE key = 'last_id'")
+                    payload["id"] = con.execute("SELECT value FROM meta WHERE key = 'last_id'").fetchone()[0]
+                self._insert_alert(con, payload)
+                if key:
+                    con.execute("INSERT INTO alert_keys(key, alert_id, created) VALUES (?, ?, ?)",
+                                (key, payload["id"], now))
+        return duplicates
+
+    def read_alerts(self, cursor):
+        """Cursor = (generation, seq); generation muda a cada clear_alerts."""
+        con = self._conn()
+        generation = con.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        reset = cursor is not None and cursor[0] != generation
+        last_seq = cursor[1] if cursor and not reset else 0
+        rows = con.execute("SELECT seq, data FROM alerts WHERE seq > ? ORDER BY seq", (last_seq,)).fetchall()
+        alerts = []
+        for seq, data in rows:
+            last_seq = seq
+            try:
+                alert = _clean_alert(json.loads(data))
+            except Exception:
+                continue
+            if alert is not None:
+                alerts.append(alert)
+        return alerts, (generation, last_seq), reset
+
+    def last_alert_id(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'last_id'").fetchone()[0]
+
+    def append_track(self, points, sync):
+        self._conn().execute(f"PRAGMA synchronous={'FULL' if sync else 'NORMAL'}")
+        with self._tx() as con:
+            con.executemany("INSERT INTO alert_track(alert_id, data) VALUES (?, ?)",
+                            [(int(p["id"]), json.dumps(p, ensure_ascii=False)) for p in points])
+
+    def read_track(self, cursor):
+        """Mesmo cursor (generation, seq) de read_alerts, sobre a alert_track."""
+        con = self._conn()
+        generation = con.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        reset = cursor is not None and cursor[0] != generation
+        last_seq = cursor[1] if cursor and not reset else 0
+        rows = con.execute("SELECT seq, data FROM alert_track WHERE seq > ? ORDER BY seq", (last_seq,)).fetchall()
+        if rows:
+            last_seq = rows[-1][0]
+        return _parse_track_lines(b"\n".join(data.encode("utf-8") for _, data in rows)), (generation, last_seq), reset
+
+    def rotate_if_needed(self):
+        return False
+
+    # Tudo fica no banco e em memória: não há histórico frio separado
+    def iter_cold(self, client_id=None, since_id=0, start_day=None, end_day=None, bbox=None):
+        return iter(())
+
+    def cold_get(self, alert_id):
+        return None
+
+    def cold_last(self, client_id=None):
+        return None
+
+    def iter_cold_reverse(self, client_id=None, before_id=None, start_day=None, end_day=None):
+        return iter(())
+
+    def cold_max_id(self):
+        return 0
+
+    def cold_stats(self):
+        return _empty_stats()
+
+    def cold_version(self):
+        return 0
+
+    def clear_alerts(self):
+        with self._tx() as con:
+            con.execute("DELETE FROM alerts")
+            con.execute("DELETE FROM alert_track")
+            con.execute("DELETE FROM alert_keys")
+            con.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def delete_client_alerts(self, client_id):
+        """Usa o índice (client_id, seq); a geração nova faz os leitores recarregarem."""
+        with self._tx() as con:
+            con.execute("DELETE FROM alert_track WHERE alert_id IN "
+                        "(SELECT id FROM alerts WHERE client_id IS ?)", (client_id,))
+            removed = con.execute("DELETE FROM alerts WHERE client_id IS ?", (client_id,)).rowcount
+            con.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        return removed
+
+def make_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(DB_FILE)
+    return FileStorage()
+
+# ==========================================
+# DIRETÓRIO DE USUÁRIOS EM CACHE
+# ==========================================
+
+class UserSnapshot:
+    """Visão imutável dos usuários com os índices pré-calculados."""
+
+    __slots__ = ("users", "roles", "trusted_by_client", "clients")
+
+    def __init__(self, users):
+        self.users             = users
+        self.roles             = {}
+        self.trusted_by_client = {}
+        clients                = {}
+
+        # Primeiro coleta clientes registrados com role=client
+        for username, info in users.items():
+            role = info.get("role")
+            self.roles.setdefault(role, {})[username] = info
+            if role == "client":
+                cid = info.get("client_id", username)
+                clients[cid] = {
+                    "client_id": cid,
+                    "name":      info.get("name", cid),
+                    "users":     []
+                }
+
+        # Depois associa trusted aos seus clientes
+        for username, info in self.roles.get("trusted", {}).items():
+            cid = info.get("client_id")
+            if cid:
+                self.trusted_by_client.setdefault(cid, []).append(username)
+                if cid not in clients:
+                    clients[cid] = {
+                        "client_id": cid,
+                        "name":      info.get("client_name", cid),
+                        "users":     []
+                    }
+                clients[cid]["users"].append(username)
+        self.clients = clients
+
+class UserDirectory:
+    """Cache de processo dos usuários, invalidado pelo carimbo do backend.
+
+    O carimbo é (inode, mtime, tamanho) do users.json ou um contador no
+    SQLite, então uma escrita feita por outro worker também invalida o
+    cache. As escritas são ler-alterar-gravar dentro do lock do backend
+    (storage.update_users), e o snapshot novo (copy-on-write) é o que foi
+    gravado; quem já tinha o snapshot antigo continua com ele.
+    """
+
+    def __init__(self, storage):
+        self.storage   = storage
+        self._lock     = threading.Lock()
+        self._stamp    = object()
+        self._snapshot = None
+
+    def _load(self):
+        # Chamado com _lock: lê o carimbo antes dos dados, assim uma escrita
+        # concorrente no máximo provoca uma releitura a mais.
+        stamp = self.storage.users_stamp()
+        if self._snapshot is None or stamp != self._stamp:
+            self._snapshot = UserSnapshot(self.storage.load_users())
+            self._stamp    = stamp
+        return self._snapshot
+
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is not None and self.storage.users_stamp() == self._stamp:
+            return snap
+        with self._lock:
+            return self._load()
+
+    def _swap(self, users, stamp):
+        self._snapshot = UserSnapshot(users)
+        self._stamp    = stamp
+
+    def _update(self, change):
+        """Aplica change(users) no backend, sob o lock dele (vale entre workers)."""
+        with self._lock:
+            users, stamp, changed = self.storage.update_users(change)
+            self._swap(users, stamp)
+            return changed
+
+    def all(self):
+        return self.snapshot().users
+
+    def get(self, username):
+        return self.snapshot().users.get(username)
+
+    def by_role(self, role):
+        return self.snapshot().roles.get(role, {})
+
+    def trusted_for(self, client_id):
+        return list(self.snapshot().trusted_by_client.get(client_id, []))
+
+    def clients(self):
+        return self.snapshot().clients
+
+    def put(self, username, info):
+        self._update(lambda users: users.__setitem__(username, info))
+
+    def put_if(self, username, expected, info):
+        """put() só se o registro gravado ainda for `expected` (compare-and-set)."""
+        def change(users):
+            if users.get(username) != expected:
+                return False
+            users[username] = info
+        return self._update(change)
+
+    def delete(self, usernames):
+        def change(users):
+            for u in usernames:
+                users.pop(u, None)
+        self._update(change)
+
+    def replace(self, users):
+        with self._lock:
+            self.storage.save_users(users)
+            self._swap(dict(users), self.storage.users_stamp())
+
+# ==========================================
+# GRAVAÇÃO DE ALERTAS EM LOTE (GROUP COMMIT)
+# ==========================================
+
+class AlertWriter:
+    """Thread única que grava alertas em lote, com política de fsync.
+
+    submit() coloca o alerta numa fila limitada e só retorna quando ele
+    estiver gravado de acordo com a política (True se o storage o recusou
+    como reenvio de uma chave de idempotência já gravada):
+      always   — o escritor junta tudo o que já está na fila, grava e faz fsync
+      interval — espera até AURORA_FSYNC_INTERVAL_MS para juntar mais alertas
+      none     — grava sem fsync (fica no cache do sistema operacional)
+    Com muitos alertas simultâneos, vários são confirmados pelo mesmo fsync.
+    """
+
+    ACK_TIMEOUT = 10   # segundos que o request espera pela gravação
+    MAX_BATCH   = 500
+
+    def __init__(self, storage, policy, interval_ms, maxsize):
+        self.storage  = storage
+        self.sync     = policy in ("always", "interval")
+        self.window   = interval_ms / 1000 if policy == "interval" else 0
+        self._queue   = queue.Queue(maxsize=maxsize)
+        self._lock    = threading.Lock()
+        self._thread  = None
+        self._pid     = None
+
+    def _ensure_thread(self):
+        # Inicia sob demanda e reinicia após fork (workers do gunicorn)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid    = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, payload):
+        self._ensure_thread()
+        item = {"payload": payload, "done": threading.Event(), "error": None, "duplicate": False}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Fila cheia: grava direto em vez de perder o alerta
+            return bool(self.storage.append_alerts([payload], self.sync))
+        if not item["done"].wait(self.ACK_TIMEOUT):
+            raise TimeoutError("alerta não confirmado pelo escritor")
+        if item["error"] is not None:
+            raise item["error"]
+        return item["duplicate"]
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.MAX_BATCH:
+            try:
+                if self.window:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            error = None
+            METRICS.observe("aurora_writer_batch_size", len(batch))
+            try:
+                with METRICS.timer("aurora_storage_seconds", op="append_batch"):
+                    duplicates = self.storage.append_alerts([item["payload"] for item in batch], self.sync)
+                for pos in duplicates:
+                    batch[pos]["duplicate"] = True
+            except Exception as e:
+                log_event("alert_write_error", logging.ERROR, batch=len(batch), error=str(e))
+                error = e
+            for item in batch:
+                item["error"] = error
+                item["done"].set()
+
+class SegmentRotator:
+    """Thread de manutenção que rotaciona o alerts.log fora do caminho do SOS.
+
+    Confere a cada INTERVAL segundos (virada do dia) e logo após cada alerta
+    gravado (wake), quando o log pode ter passado de AURORA_SEGMENT_MAX_BYTES.
+    Enquanto a rotação não roda, o log ativo só fica maior; nada se perde.
+    """
+
+    INTERVAL = 60
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._wake   = threading.Event()
+        self._lock   = threading.Lock()
+        self._thread = None
+        self._pid    = None
+
+    def wake(self):
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        # Inicia sob demanda e reinicia após fork (workers do gunicorn)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid    = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="alert-rotator", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.INTERVAL)
+            self._wake.clear()
+            try:
+                started = time.monotonic()
+                if self.storage.rotate_if_needed():
+                    METRICS.observe("aurora_storage_seconds", time.monotonic() - started, op="rotate")
+                    log_event("alert_log_rotated")
+            except Exception as e:
+                log_event("alert_rotate_error", logging.ERROR, error=str(e))
+
+STORAGE      = make_storage()
+ALERT_STORE  = AlertStore(STORAGE)
+ALERT_COLUMNS = AlertColumns(ALERT_STORE)
+ALERT_WRITER = AlertWriter(STORAGE, FSYNC_POLICY, FSYNC_INTERVAL_MS, WRITER_QUEUE_SIZE)
+ALERT_ROTATOR = SegmentRotator(STORAGE)
+USERS        = UserDirectory(STORAGE)
+METRICS.gauge("aurora_writer_queue_depth", "Alertas aguardando o escritor", ALERT_WRITER.pending)
+
+# ==========================================
+# PUSH DE ALERTAS (SSE / LONG-POLL)
+# ==========================================
+
+ALERT_STREAM_HEARTBEAT = 15    # segundos entre comentários "ping" no SSE
+ALERT_STREAM_MAX_AGE   = 300   # encerra o stream e deixa o navegador reconectar
+ALERT_POLL_MAX_WAIT    = 25    # espera máxima de um long-poll
+# Cada stream SSE ou long-poll ocupa uma thread do gunicorn enquanto espera.
+# Os dois têm teto próprio (acima dele: 503 + Retry-After) e a soma fica
+# abaixo das 64 threads do render.yaml, então sempre sobram threads para o
+# /api/send_alert mesmo com todos os painéis esperando.
+#
+# Os tetos formam uma escada: SSE recusado (503) fecha o EventSource e o
+# painel passa ao long-poll; long-poll recusado faz o painel consultar
+# /api/alerts?since_id= (ETag/304, sem thread presa) a cada
+# ALERT_POLL_RETRY_AFTER segundos por um minuto antes de tentar de novo.
+# ALERT_STREAM_RETRY_AFTER só vale para clientes que reconectam o SSE
+# sozinhos; os painéis daqui nunca voltam ao stream na mesma página.
+ALERT_MAX_STREAMS        = int(os.environ.get("AURORA_MAX_STREAMS", "32"))
+ALERT_MAX_POLLS          = int(os.environ.get("AURORA_MAX_POLLS", "16"))
+ALERT_STREAM_RETRY_AFTER = 30
+ALERT_POLL_RETRY_AFTER   = 5
+_alert_stream_slots      = threading.BoundedSemaphore(ALERT_MAX_STREAMS)
+_alert_poll_slots        = threading.BoundedSemaphore(ALERT_MAX_POLLS)
+
+# ==========================================
+# BARRAMENTO ENTRE WORKERS (PUB/SUB)
+# ==========================================
+#
+# Com vários workers do gunicorn (ou vários nós) o alerta é gravado por um
+# processo e os painéis esperam em outros. O barramento leva só o aviso
+# "chegou alerta para o client_id X"; quem acorda relê o ALERT_STORE a
+# partir do armazenamento compartilhado, então um aviso perdido atrasa o
+# painel até o próximo heartbeat, mas não perde alerta. AURORA_BUS escolhe
+# a implementação:
+#   local        — só o próprio processo (padrão, um worker)
+#   unix         — um socket Unix datagrama por worker em <dados>/bus/
+#   redis://...  — PUBLISH/SUBSCRIBE num servidor Redis (vários nós)
+
+BUS_URL     = os.environ.get("AURORA_BUS", "local").strip()
+BUS_DIR     = ALERTS_FILE.parent / "bus"
+BUS_CHANNEL = "aurora:alerts"
+
+def bus_origin():
+    """Identifica este processo nas mensagens (o Redis entrega a quem publicou também)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class LocalBus:
+    """Sem outros processos: nada sai daqui."""
+
+    name = "local"
+
+    def start(self, deliver):
+        pass
+
+    def publish(self, message):
+        pass
+
+class UnixSocketBus:
+    """Cada worker escuta em BUS_DIR/<pid>.sock; publish envia um datagrama a cada um."""
+
+    name = "unix"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock     = threading.Lock()
+        self._pid      = None
+        self._path     = None
+        self._out      = None
+
+    def start(self, deliver):
+        # Inicia sob demanda e de novo após fork (workers do gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"{os.getpid()}.sock"
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(str(path))
+            self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._out.setblocking(False)
+            self._path = path
+            self._pid  = os.getpid()
+            threading.Thread(target=self._listen, args=(sock, deliver), name="alert-bus", daemon=True).start()
+            atexit.register(self._close, path)
+
+    @staticmethod
+    def _close(path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _listen(self, sock, deliver):
+        while True:
+            data = sock.recv(65536)
+            try:
+                deliver(json.loads(data))
+            except Exception as e:
+                log_event("bus_error", logging.WARNING, bus=self.name, error=str(e))
+
+    def publish(self, message):
+        data = json.dumps(message).encode("utf-8")
+        with os.scandir(self.directory) as entries:
+            peers = [e.path for e in entries if e.name.endswith(".sock") and e.path != str(self._path)]
+        for peer in peers:
+            try:
+                self._out.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker que terminou sem apagar o socket
+                self._close(Path(peer))
+            except BlockingIOError:
+                pass   # fila do receptor cheia: ele já tem avisos pendentes
+
+class RedisBus:
+    """Canal PUBLISH/SUBSCRIBE do Redis; uma thread por processo escuta e reconecta."""
+
+    name = "redis"
+    RECONNECT_DELAY = 1
+
+    def __init__(self, url, channel):
+        if redis is None:
+            raise RuntimeError("AURORA_BUS=redis:// requer o pacote redis")
+        self.url     = url
+        self.channel = channel
+        self._lock   = threading.Lock()
+        self._pid    = None
+        self._client = None
+
+    def start(self, deliver):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._client = redis.Redis.from_url(self.url)
+            self._pid    = os.getpid()
+            threading.Thread(target=self._listen, args=(deliver,), name="alert-bus", daemon=True).start()
+
+    def _listen(self, deliver):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        deliver(json.loads(msg["data"]))
+            except Exception as e:
+                log_event("bus_error", logging.WARNING, bus=self.name, error=str(e))
+                time.sleep(self.RECONNECT_DELAY)
+
+    def publish(self, message):
+        self._client.publish(self.channel, json.dumps(message))
+
+def make_bus(url):
+    if url in ("", "local"):
+        return LocalBus()
+    if url == "unix":
+        return UnixSocketBus(BUS_DIR)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBus(url, BUS_CHANNEL)
+    raise ValueError(f"AURORA_BUS inválido: {url!r}")
+
+class AlertBroker:
+    """Acorda quem está esperando alertas novos de um client_id.
+
+    Cada assinante recebe um threading.Event; publish() só sinaliza, e o
+    assinante consulta o ALERT_STORE a partir do seu cursor. Assim nenhum
+    alerta se perde mesmo que vários cheguem entre duas leituras.
+    A chave None representa quem acompanha todos os alertas (admin).
+    O aviso também vai pelo barramento, que acorda os assinantes dos
+    outros workers.
+    """
+
+    def __init__(self, bus):
+        self.bus   = bus
+        self._lock = threading.Lock()
+        self._subs = {}
+
+    def _ensure_bus(self):
+        self.bus.start(self._remote)
+
+    def subscribe(self, client_id):
+        self._ensure_bus()
+        event = threading.Event()
+        with self._lock:
+            self._subs.setdefault(client_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, client_id, event):
+        with self._lock:
+            subs = self._subs.get(client_id)
+            if subs:
+                subs.discard(event)
+                if not subs:
+                    self._subs.pop(client_id, None)
+
+    def publish(self, alert):
+        cid = alert.get("client_id")
+        self._notify(cid)
+        try:
+            self._ensure_bus()
+            self.bus.publish({"client_id": cid, "id": alert.get("id"), "origin": bus_origin()})
+        except Exception as e:
+            log_event("bus_publish_error", logging.WARNING, bus=self.bus.name, error=str(e))
+
+    def _remote(self, message):
+        if message.get("origin") == bus_origin():
+            return
+        METRICS.inc("aurora_bus_received_total", bus=self.bus.name)
+        self._notify(message.get("client_id"))
+
+    def _notify(self, cid):
+        with self._lock:
+            if cid is None:
+                # Alerta anônimo aparece para todas as clientes
+                targets = [ev for subs in self._subs.values() for ev in subs]
+            else:
+                targets = list(self._subs.get(cid, ())) + list(self._subs.get(None, ()))
+        for event in targets:
+            event.set()
+
+ALERT_BROKER = AlertBroker(make_bus(BUS_URL))
+
+def wait_for_alerts(client_id, since_id, timeout):
+    """Long-poll: devolve alertas com id > since_id assim que existirem."""
+    event = ALERT_BROKER.subscribe(client_id)
+    try:
+        ALERT_STORE.refresh()
+        alerts = ALERT_STORE.since(client_id, since_id)
+        if not alerts and event.wait(timeout):
+            ALERT_STORE.refresh()
+            alerts = ALERT_STORE.since(client_id, since_id)
         return alerts
-    except Exception:
-        return []
+    finally:
+        ALERT_BROKER.unsubscribe(client_id, event)
 
-def get_alerts_for_client(client_id):
-    """Retorna alertas do cliente específico + alertas sem client_id (disparados sem login)."""
-    all_alerts = get_all_alerts()
-    if client_id is None:
-        return all_alerts  # admin vê tudo
-    return [a for a in all_alerts if a.get("client_id") == client_id or a.get("client_id") is None]
+def _location_event(alert):
+    """Posição atual de um alerta rastreado, sem o trajeto inteiro."""
+    track = alert.get("track") or ()
+    return {"id": alert.get("id"), "client_id": alert.get("client_id"), "lat": alert.get("lat"),
+            "lng": alert.get("lng"), "accuracy": alert.get("accuracy"),
+            "ts": track[-1].get("ts") if track else alert.get("ts"), "points": len(track)}
+
+def stream_alerts(client_id, since_id):
+    """Gerador SSE com heartbeat; o id de cada evento é o id do alerta.
+
+    Pontos de trajeto de alertas já enviados saem como "location" (sem id,
+    então não mexem no Last-Event-ID).
+    """
+    event    = ALERT_BROKER.subscribe(client_id)
+    deadline = time.monotonic() + ALERT_STREAM_MAX_AGE
+    track, _ = ALERT_STORE.track_updates(None)
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            event.clear()
+            ALERT_STORE.refresh()
+            for alert in ALERT_STORE.since(client_id, since_id):
+                since_id = max(since_id, int(alert.get("id") or 0))
+                data = json.dumps(dict(alert), ensure_ascii=False)
+                yield f"id: {since_id}\nevent: alert\ndata: {data}\n\n"
+            track, updated = ALERT_STORE.track_updates(track, client_id)
+            for alert in updated:
+                if int(alert.get("id") or 0) <= since_id:
+                    data = json.dumps(_location_event(alert), ensure_ascii=False)
+                    yield f"event: location\ndata: {data}\n\n"
+            if not event.wait(ALERT_STREAM_HEARTBEAT):
+                yield ": ping\n\n"
+    finally:
+        ALERT_BROKER.unsubscribe(client_id, event)
 
 def require_role(role):
     if session.get("role") != role:
@@ -130,43 +2839,231 @@ def require_role(role):
         return redirect("/trusted/login")
     return None
 
-# ==========================================
-# GESTÃO DE CLIENTES
-# ==========================================
+# ==========================================
+# GESTÃO DE CLIENTES
+# ==========================================
+
+def get_all_clients():
+    """Retorna clientes salvos no users.json (role=client), com seus trusted."""
+    return USERS.clients()
+
+def generate_client_id():
+    """Gera um ID único para novo cliente."""
+    return secrets.token_hex(8)
+
+# ==========================================
+# PRIORIDADE E CONTROLE DE ADMISSÃO
+# ==========================================
+#
+# O gunicorn roda com um pool fixo de threads (render.yaml). As rotas de
+# alerta nunca são recusadas; as rotas pesadas têm um teto próprio de
+# requisições simultâneas e são recusadas com 429 + Retry-After quando o
+# servidor já está ocupado. Assim sempre sobram threads para um SOS.
+
+CRITICAL_ENDPOINTS = {
+    "send_alert", "api_alert_location", "api_alerts", "api_alerts_stream", "api_alerts_poll",
+    "api_last_alert", "health",
+}
+SHEDDABLE_ENDPOINTS = {
+    "aurora_ia_chat", "relatorio_pdf", "central", "api_export_submit", "historico",
+}
+HEAVY_MAX_INFLIGHT  = int(os.environ.get("AURORA_HEAVY_MAX", "4"))
+SHED_BUSY_THRESHOLD = int(os.environ.get("AURORA_SHED_THRESHOLD", "32"))
+SHED_RETRY_AFTER    = 5
+SHED_MESSAGE        = "Servidor ocupado no momento. Tente novamente em instantes. Em perigo, ligue 190 ou 180."
+
+class AdmissionControl:
+    """Conta requisições em andamento por classe e decide quem entra."""
+
+    def __init__(self, heavy_max, busy_threshold):
+        self.heavy_max      = heavy_max
+        self.busy_threshold = busy_threshold
+        self._lock          = threading.Lock()
+        self.inflight       = {"critical": 0, "normal": 0, "heavy": 0}
+
+    @staticmethod
+    def classify(endpoint):
+        if endpoint in CRITICAL_ENDPOINTS:
+            return "critical"
+        if endpoint in SHEDDABLE_ENDPOINTS:
+            return "heavy"
+        return "normal"
+
+    def enter(self, cls):
+        """Registra a requisição; False significa que ela deve ser recusada."""
+        with self._lock:
+            if cls == "heavy":
+                busy = self.inflight["normal"] + self.inflight["heavy"]
+                if self.inflight["heavy"] >= self.heavy_max or busy >= self.busy_threshold:
+                    return False
+            self.inflight[cls] += 1
+            return True
+
+    def leave(self, cls):
+        with self._lock:
+            self.inflight[cls] -= 1
+
+ADMISSION = AdmissionControl(HEAVY_MAX_INFLIGHT, SHED_BUSY_THRESHOLD)
+METRICS.gauge("aurora_inflight_requests", "Requisições em andamento por classe de admissão",
+              lambda: {(("class", cls),): n for cls, n in ADMISSION.inflight.items()})
+
+@app.before_request
+def admission_check():
+    cls = ADMISSION.classify(request.endpoint)
+    if not ADMISSION.enter(cls):
+        if request.path.startswith("/api/"):
+            resp = jsonify({"ok": False, "error": SHED_MESSAGE, "reply": SHED_MESSAGE})
+        else:
+            resp = app.response_class(SHED_MESSAGE, mimetype="text/plain")
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(SHED_RETRY_AFTER)
+        METRICS.inc("aurora_shed_total", endpoint=request.endpoint)
+        return resp
+    g.admission_class = cls
+
+@app.teardown_request
+def admission_release(exc=None):
+    cls = g.pop("admission_class", None)
+    if cls is not None:
+        ADMISSION.leave(cls)
+
+# ==========================================
+# ASSETS ESTÁTICOS E PÁGINAS PRÉ-RENDERIZADAS
+# ==========================================
+#
+# Na importação, cada arquivo de static/ recebe um hash do conteúdo; os
+# templates usam asset_url("css/style.css") -> /static/css/style.css?v=<hash>,
+# servido com Cache-Control immutable. Texto (css/js/json) fica em memória
+# junto com as versões gzip (e brotli, se o módulo existir). manifest.json e
+# sw.js citam outros assets: as referências são reescritas com o hash e o
+# CACHE_VERSION do service worker passa a ser o hash do conjunto.
+#
+# As páginas públicas não dependem da sessão além do redirect do termo,
+# então o HTML é renderizado uma vez e servido com ETag e compressão.
+
+STATIC_DIR     = BASE_DIR / "static"
+ASSET_MAX_AGE  = 365 * 24 * 3600
+COMPRESSIBLE   = {".css", ".js", ".json", ".svg", ".html", ".txt"}
+# Assets que citam outros assets; processados depois dos demais, nesta ordem
+ASSET_REWRITE  = ("manifest.json", "js/sw.js")
+SERVICE_WORKER = "js/sw.js"   # URL fixa (registrada pelos navegadores), sempre revalidada
+
+def _compressed_variants(data):
+    variants = {"gzip": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data)
+    return {enc: body for enc, body in variants.items() if len(body) < len(data)}
+
+def _encoded_response(data, variants, etag, mimetype, cache_control):
+    """Resposta com a melhor codificação aceita pelo cliente e suporte a 304."""
+    body, encoding = data, None
+    for enc in ("br", "gzip"):
+        if enc in variants and enc in request.accept_encodings:
+            body, encoding = variants[enc], enc
+            break
+    resp = Response(body, mimetype=mimetype)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if variants:
+        resp.vary.add("Accept-Encoding")
+    resp.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    resp.headers["Cache-Control"] = cache_control
+    return resp.make_conditional(request)
+
+class Asset:
+    __slots__ = ("path", "digest", "mimetype", "data", "variants")
+
+    def __init__(self, path, data):
+        self.path     = path
+        self.digest   = hashlib.sha256(data).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        compressible  = path.suffix in COMPRESSIBLE
+        # Binários (imagens, áudio) ficam no disco: send_file cuida de Range
+        self.data     = data if compressible else None
+        self.variants = _compressed_variants(data) if compressible else {}
+
+class AssetPipeline:
+    """Índice dos arquivos de static/ com hash, variantes comprimidas e URLs versionadas."""
+
+    def __init__(self, root):
+        self.root    = root
+        self.assets  = {}
+        self.version = ""
+        self.build()
+
+    def build(self):
+        assets = {}
+        for path in sorted(self.root.rglob("*")):
+            rel = path.relative_to(self.root).as_posix()
+            if path.is_file() and rel not in ASSET_REWRITE and not path.name.startswith("."):
+                assets[rel] = Asset(path, path.read_bytes())
+        self.assets  = assets
+        self.version = hashlib.sha256(
+            "\n".join(f"{rel}:{a.digest}" for rel, a in sorted(assets.items())).encode("utf-8")
+        ).hexdigest()[:12]
+        for rel in ASSET_REWRITE:
+            path = self.root / rel
+            if path.is_file():
+                assets[rel] = Asset(path, self._rewrite(path.read_text(encoding="utf-8")).encode("utf-8"))
+
+    def _rewrite(self, text):
+        text = text.replace("__ASSET_VERSION__", self.version)
+        return re.sub(r'"/static/([^"?#]+)"', lambda m: f'"{self.url(m.group(1))}"', text)
+
+    def url(self, rel):
+        asset = self.assets.get(rel)
+        if asset is None or rel == SERVICE_WORKER:
+            return f"/static/{rel}"
+        return f"/static/{rel}?v={asset.digest}"
+
+    def response(self, rel):
+        asset = self.assets.get(rel)
+        if asset is None:
+            return None
+        if rel == SERVICE_WORKER:
+            cache_control = "no-cache"
+        elif request.args.get("v") == asset.digest:
+            cache_control = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        else:
+            cache_control = "public, no-cache"   # URL sem hash: revalida pelo ETag
+        if asset.data is None:
+            resp = send_file(asset.path, mimetype=asset.mimetype, etag=asset.digest, conditional=True)
+            resp.headers["Cache-Control"] = cache_control
+            return resp
+        return _encoded_response(asset.data, asset.variants, asset.digest, asset.mimetype, cache_control)
+
+class PageCache:
+    """HTML das páginas estáticas, renderizado uma vez por processo."""
+
+    def __init__(self):
+        self._pages = {}
+
+    def get(self, template):
+        page = self._pages.get(template)
+        if page is None:
+            data = render_template(template).encode("utf-8")
+            page = (data, _compressed_variants(data), hashlib.sha256(data).hexdigest()[:16])
+            if not app.debug:
+                self._pages[template] = page
+        return page
 
-def get_all_clients():
-    """Retorna clientes salvos no users.json (role=client)."""
-    users = load_users()
-    clients = {}
-
-    # Primeiro coleta clientes registrados com role=client
-    for username, info in users.items():
-        if info.get("role") == "client":
-            cid = info.get("client_id", username)
-            clients[cid] = {
-                "client_id": cid,
-                "name":      info.get("name", cid),
-                "users":     []
-            }
-
-    # Depois associa trusted aos seus clientes
-    for username, info in users.items():
-        if info.get("role") == "trusted":
-            cid = info.get("client_id")
-            if cid:
-                if cid not in clients:
-                    clients[cid] = {
-                        "client_id": cid,
-                        "name":      info.get("client_name", cid),
-                        "users":     []
-                    }
-                clients[cid]["users"].append(username)
+    def response(self, template):
+        data, variants, etag = self.get(template)
+        return _encoded_response(data, variants, etag, "text/html", "no-cache")
 
-    return clients
+ASSETS = AssetPipeline(STATIC_DIR)
+PAGES  = PageCache()
+app.jinja_env.globals["asset_url"] = ASSETS.url
 
-def generate_client_id():
-    """Gera um ID único para novo cliente."""
-    return secrets.token_hex(8)
+@app.get("/static/<path:filename>")
+def static_asset(filename):
+    resp = ASSETS.response(filename)
+    if resp is None:
+        return "", 404
+    if filename == SERVICE_WORKER:
+        # Registrado com scope "/": controla as páginas e guarda a fila offline de SOS
+        resp.headers["Service-Worker-Allowed"] = "/"
+    return resp
 
 # ==========================================
 # ROTAS PÚBLICAS
@@ -176,49 +3073,60 @@ def generate_client_id():
 def health():
     return jsonify({"ok": True, "server_time_br": now_br_str()})
 
+@app.get("/metrics")
+def metrics():
+    """Métricas no formato de texto do Prometheus.
+
+    Com AURORA_METRICS_TOKEN definido, exige Authorization: Bearer <token>.
+    """
+    if METRICS_TOKEN and not secrets.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return "", 401
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
 @app.get("/")
 def index():
     if not session.get("termo_aceito"):
         return redirect("/termo")
-    return render_template("index.html")
+    return PAGES.response("index.html")
 
 @app.get("/panic")
 def panic():
     if not session.get("termo_aceito"):
         return redirect("/termo")
-    return render_template("panic_button.html")
+    return PAGES.response("panic_button.html")
 
 @app.get("/historico")
 def historico():
-    alerts = get_all_alerts()
-    return render_template("historico.html", alerts=alerts)
+    clients = get_all_clients() if session.get("role") == "admin" else {}
+    return render_template("historico.html", clients=clients, **alert_page(_list_filters()))
 
 @app.get("/ajuda")
 def ajuda():
-    return render_template("ajuda.html")
+    return PAGES.response("ajuda.html")
 
 @app.get("/plano-seguranca")
 @app.get("/plano_seguranca")
 def plano_seguranca():
-    return render_template("plano_seguranca.html")
+    return PAGES.response("plano_seguranca.html")
 
 @app.get("/saida-rapida")
 @app.get("/saida_rapida")
 def saida_rapida():
-    return render_template("saida_rapida.html")
+    return PAGES.response("saida_rapida.html")
 
 @app.get("/legal")
 def legal():
-    return render_template("legal.html")
+    return PAGES.response("legal.html")
 
 @app.get("/offline")
 def offline():
-    return render_template("offline.html")
+    return PAGES.response("offline.html")
 
 @app.get("/termo")
 @app.get("/termo_responsabilidade")
 def termo():
-    return render_template("termo_responsabilidade.html")
+    return PAGES.response("termo_responsabilidade.html")
 
 @app.route("/aceitar-termo", methods=["POST"])
 def aceitar_termo():
@@ -229,10 +3137,97 @@ def aceitar_termo():
 # API DE ALERTAS
 # ==========================================
 
+# O app gera uma chave por SOS (Idempotency-Key ou idempotency_key no JSON)
+# e a repete nos reenvios — da própria página ou da fila offline do service
+# worker. Reenvio com chave conhecida devolve o id original sem gravar de novo.
+# Quem decide é o storage, dentro do lock da gravação (append_alerts); o
+# índice abaixo e o trecho quente só poupam a ida à fila do escritor.
+IDEMPOTENCY_MAX = 50000
+_IDEMPOTENCY_RE = re.compile(r"^[A-Za-z0-9_.:-]{8,128}$")
+
+class IdempotencyIndex:
+    """Chave de idempotência -> id do alerta, com TTL e tamanho limitado.
+
+    lock(key) serializa, neste processo, requisições simultâneas com a
+    mesma chave (a página e a fila do service worker podem reenviar juntas).
+    Entre workers quem garante é o storage.
+    """
+
+    STRIPES = 64
+
+    def __init__(self, ttl, maxsize):
+        self.ttl      = ttl
+        self.maxsize  = maxsize
+        self._data    = OrderedDict()
+        self._lock    = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(self.STRIPES)]
+
+    def lock(self, key):
+        return self._stripes[zlib.crc32(key.encode("utf-8")) % self.STRIPES]
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                return None
+            return item[1]
+
+    def remember(self, key, alert_id):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + self.ttl, alert_id)
+            self._data.move_to_end(key)
+            # Mesmo TTL para todos: os mais antigos (e vencidos) estão no começo
+            while self._data and (len(self._data) > self.maxsize or next(iter(self._data.values()))[0] < now):
+                self._data.popitem(last=False)
+
+IDEMPOTENCY = IdempotencyIndex(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX)
+
+def json_body():
+    """Corpo JSON da requisição como dict; {} se ausente, inválido ou não for objeto."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def _idempotency_key(data):
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if isinstance(key, str) and _IDEMPOTENCY_RE.match(key):
+        return key
+    return None
+
+def find_idempotent_alert(key):
+    """id do alerta já gravado com a chave: índice local ou, via log, de outro worker."""
+    alert_id = IDEMPOTENCY.get(key)
+    if alert_id is None:
+        ALERT_STORE.refresh()
+        alert = ALERT_STORE.by_idempotency_key(key)
+        if alert is not None:
+            alert_id = alert.get("id")
+    return alert_id
+
 @app.post("/api/send_alert")
 def send_alert():
-    data = request.get_json(silent=True) or {}
+    data = json_body()
+    key  = _idempotency_key(data)
+    with IDEMPOTENCY.lock(key) if key else nullcontext():
+        if key:
+            alert_id = find_idempotent_alert(key)
+            if alert_id is not None:
+                return _duplicate_response(alert_id, data)
+        return _record_alert(data, key)
+
+def _duplicate_response(alert_id, data):
+    METRICS.inc("aurora_alerts_deduplicated_total")
+    log_event("alert_duplicate", id=alert_id)
+    original = _late_location(alert_id, data) or ALERT_STORE.get(alert_id)
+    resp = jsonify({"ok": True, "id": alert_id, "duplicate": True,
+                    "track_token": track_token(original) if original else None})
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def _record_alert(data, key):
     location = data.get("location")
+    if not isinstance(location, dict):
+        location = None
 
     name      = str(data.get("name", "Não informado"))[:100].strip() or "Não informado"
     situation = str(data.get("situation", "Emergência"))[:100].strip() or "Emergência"
@@ -240,10 +3235,10 @@ def send_alert():
 
     # Pega o client_id da sessão se a mulher estiver logada,
     # ou do parâmetro enviado pelo frontend
-    client_id = session.get("client_id") or data.get("client_id")
+    client_id = session.get("client_id") or clean_client_id(data.get("client_id"))
 
     payload = {
-        "id":        next_alert_id(),
+        "id":        None,   # preenchido pelo storage junto com a gravação
         "ts":        now_br_str(),
         "name":      name,
         "situation": situation,
@@ -255,55 +3250,335 @@ def send_alert():
         "accuracy":  location.get("accuracy") if location and isinstance(location, dict) else None,
         "ip":        request.remote_addr
     }
+    if key:
+        payload["idempotency_key"] = key
 
-    log_alert(payload)
-    print(f"✅ Alerta #{payload['id']} — {situation} — cliente: {client_id}")
-    if location:
-        print(f"📍 {payload.get('lat')}, {payload.get('lng')}")
+    try:
+        duplicate = log_alert(payload)
+    except TimeoutError:
+        # Continua na fila do escritor e será gravado; só não confirmou a
+        # tempo. A chave de idempotência vai junto, então um reenvio não duplica.
+        log_event("alert_write_slow", logging.WARNING, situation=situation, client_id=client_id)
+        return jsonify({"ok": True, "pending": True}), 202
+    if key:
+        IDEMPOTENCY.remember(key, payload["id"])
+    if duplicate:
+        return _duplicate_response(payload["id"], data)
+    log_event("alert_received", id=payload["id"], situation=situation, client_id=client_id,
+              lat=payload["lat"], lng=payload["lng"])
 
-    return jsonify({"ok": True, "id": payload["id"]})
+    return jsonify({"ok": True, "id": payload["id"], "track_token": track_token(payload)})
 
-@app.get("/api/alerts")
-def api_alerts():
-    """Admin vê tudo. Trusted vê só do seu cliente."""
-    role      = session.get("role")
-    token     = request.args.get("token", "").strip()
-    client_id = None
+# Envio em duas fases: o SOS sai na hora, com a posição que a página já
+# tiver (ou nenhuma), e as leituras seguintes do GPS (watchPosition) vão para
+# /api/alerts/<id>/location, que acrescenta cada ponto ao trajeto do alerta.
+# O track_token devolvido no envio (HMAC de id, ts e chave de idempotência,
+# ou seja, deste alerta e de nenhum outro) é o que autoriza os pontos. Sem
+# SECRET_KEY própria o HMAC usaria a chave de desenvolvimento, pública no
+# código: o rastreamento fica desligado e o SOS sai só com a posição inicial.
+TRACK_WINDOW     = int(os.environ.get("AURORA_TRACK_WINDOW", "3600"))   # segundos após o alerta
+TRACK_MAX_POINTS = 360
+TRACK_ENABLED    = bool(os.environ.get("SECRET_KEY"))
 
-    if token:
-        # Token passado via URL — funciona mesmo sem sessão ativa
-        client_id = token
-    elif role == "trusted":
-        client_id = session.get("client_id")
-    elif role == "admin":
-        alerts = get_all_alerts()
+def track_token(alert):
+    if not TRACK_ENABLED:
+        return None
+    msg = f"track:{alert.get('id')}:{alert.get('ts')}:{alert.get('idempotency_key') or ''}".encode("utf-8")
+    return hmac.new(app.secret_key.encode("utf-8"), msg, hashlib.sha256).hexdigest()[:32]
+
+def _track_point_from(data):
+    """{"lat", "lng", "accuracy"} validado do corpo, ou None."""
+    point = _alert_point(data)
+    if point is None:
+        return None
+    try:
+        # round(inf) levanta OverflowError e round(nan) ValueError: ambos viram None
+        accuracy = max(round(float(data.get("accuracy"))), 0)
+    except (TypeError, ValueError, OverflowError):
+        accuracy = None
+    return {"lat": point[0], "lng": point[1], "accuracy": accuracy}
+
+@app.post("/api/alerts/<int:alert_id>/location")
+def api_alert_location(alert_id):
+    """Acrescenta uma posição ao trajeto do alerta (segunda fase do envio).
+
+    403 sem o track_token do alerta (ou sem SECRET_KEY); 410 quando o
+    rastreamento acabou (AURORA_TRACK_WINDOW passou, TRACK_MAX_POINTS
+    atingido ou o alerta já foi rotacionado para o histórico) — a página
+    para de enviar.
+    """
+    if not TRACK_ENABLED:
+        return jsonify({"ok": False, "error": "Rastreamento desativado"}), 403
+    data  = json_body()
+    token = request.headers.get("X-Track-Token") or data.get("token")
+
+    ALERT_STORE.refresh()
+    alert = ALERT_STORE.get_hot(alert_id)
+    if alert is None:
+        return jsonify({"ok": False, "error": "Rastreamento encerrado"}), 410
+    if not isinstance(token, str) or not hmac.compare_digest(token, track_token(alert)):
+        return jsonify({"ok": False, "error": "Token de rastreamento inválido"}), 403
+    point = _track_point_from(data)
+    if point is None:
+        return jsonify({"ok": False, "error": "Localização inválida"}), 400
+    if (_ts_epoch(now_br_str()) - _ts_epoch(alert.get("ts")) > TRACK_WINDOW
+            or len(alert.get("track") or ()) >= TRACK_MAX_POINTS):
+        return jsonify({"ok": False, "error": "Rastreamento encerrado"}), 410
+
+    alert = append_track_point(alert, point)
+    return jsonify({"ok": True, "id": alert_id, "points": len(alert.get("track") or ())})
+
+def append_track_point(alert, point):
+    """Grava o ponto no trajeto do alerta e avisa os painéis; devolve o alerta atualizado."""
+    with METRICS.timer("aurora_storage_seconds", op="append_track"):
+        STORAGE.append_track([{"id": alert["id"], "ts": now_br_str(), **point}], ALERT_WRITER.sync)
+        ALERT_STORE.refresh()
+    METRICS.inc("aurora_track_points_total")
+    ALERT_BROKER.publish(alert)
+    return ALERT_STORE.get_hot(alert["id"]) or alert
+
+def _late_location(alert_id, data):
+    """Posição trazida por um reenvio de alerta que saiu sem nenhuma.
+
+    Sem track_token (SECRET_KEY ausente, resposta 202 ou SOS da fila
+    offline) a página reenvia o SOS com a mesma chave de idempotência assim
+    que o GPS responde. Só ela conhece a chave, e só o primeiro ponto de um
+    alerta ainda sem posição é aceito assim; o resto do trajeto continua
+    exigindo o token. Devolve o alerta atualizado, ou None.
+    """
+    location = data.get("location")
+    point    = _track_point_from(location) if isinstance(location, dict) else None
+    if point is None:
+        return None
+    alert = ALERT_STORE.get_hot(alert_id)
+    if (alert is None or _has_location(alert)
+            or _ts_epoch(now_br_str()) - _ts_epoch(alert.get("ts")) > TRACK_WINDOW):
+        return None
+    return append_track_point(alert, point)
+
+def since_cursor(since_id):
+    """Cursor de delta válido: acima do último id alocado, ele veio de outro
+    histórico (banco novo, alerts.seq restaurado) e recomeça do zero."""
+    since_id = max(since_id or 0, 0)
+    return 0 if since_id > STORAGE.last_alert_id() else since_id
+
+def _alerts_etag(client_id, since_id):
+    """ETag forte do resultado: muda quando chega alerta (ou ponto de trajeto) novo.
+
+    Vem só do estado do armazenamento (último id e cursores dos logs), então
+    qualquer worker responde 304 ao ETag emitido por outro.
+    """
+    last    = get_last_alert(client_id)
+    last_id = last.get("id") if last else 0
+    scope   = "all" if client_id is None else format(zlib.crc32(client_id.encode("utf-8")), "08x")
+    state   = format(zlib.crc32(repr(ALERT_STORE.cursors()).encode("ascii")), "08x")
+    return f"{STORAGE.last_alert_id()}.{state}-{scope}-{last_id}-{since_id}"
+
+def _alerts_response(client_id, since_id):
+    """Lista de alertas com suporte a delta (since_id) e 304 via If-None-Match."""
+    etag = _alerts_etag(client_id, since_id)
+    METRICS.inc("aurora_alert_polls_total", mode="delta" if since_id else "list")
+    if etag in request.if_none_match:
+        METRICS.inc("aurora_alert_not_modified_total")
+        resp = app.response_class(status=304)
+    else:
+        if since_id:
+            alerts = ALERT_STORE.since(client_id, since_id)
+        else:
+            alerts = get_alerts_for_client(client_id)
         resp = jsonify(alerts)
         resp.headers["Content-Type"] = "application/json"
-        return resp
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
-    if client_id is None:
+def _alerts_scope():
+    """Resolve quem está pedindo alertas: (autorizado, client_id).
+
+    client_id None com autorizado=True significa admin (vê tudo).
+    """
+    role  = session.get("role")
+    token = clean_client_id(request.args.get("token", ""))
+    if token:
+        # Token passado via URL — funciona mesmo sem sessão ativa
+        return True, token
+    if role == "trusted" and session.get("client_id"):
+        return True, session.get("client_id")
+    if role == "admin":
+        return True, None
+    return False, None
+
+@app.get("/api/alerts")
+def api_alerts():
+    """Admin vê tudo. Trusted vê só do seu cliente.
+
+    ?since_id=N devolve apenas alertas com id maior que N; polls sem
+    novidade recebem 304 quando o navegador reenvia o ETag.
+    """
+    allowed, client_id = _alerts_scope()
+    since_id = since_cursor(request.args.get("since_id", 0, type=int))
+
+    if not allowed:
         # Sem sessão e sem token: retorna JSON vazio (nunca redireciona)
         resp = jsonify([])
         resp.headers["Content-Type"] = "application/json"
         return resp, 200
 
-    alerts = get_alerts_for_client(client_id)
+    return _alerts_response(client_id, since_id)
+
+@app.get("/api/alerts/stream")
+def api_alerts_stream():
+    """Server-Sent Events com os alertas novos do escopo.
+
+    Retoma a partir do cabeçalho Last-Event-ID (reconexão automática do
+    EventSource) ou de ?since_id=N; sem nenhum dos dois, começa do último
+    alerta existente.
+    """
+    allowed, client_id = _alerts_scope()
+    if not allowed:
+        return "", 204  # EventSource não tenta reconectar após 204
+
+    since_id = request.headers.get("Last-Event-ID", type=int)
+    if since_id is None:
+        since_id = request.args.get("since_id", type=int)
+    if since_id is None:
+        last = get_last_alert(client_id)
+        since_id = int(last.get("id") or 0) if last else 0
+
+    if not _alert_stream_slots.acquire(blocking=False):
+        METRICS.inc("aurora_shed_total", endpoint=request.endpoint)
+        return "", 503, {"Retry-After": str(ALERT_STREAM_RETRY_AFTER)}
+    METRICS.inc("aurora_alert_polls_total", mode="stream")
+
+    resp = Response(stream_alerts(client_id, since_cursor(since_id)), mimetype="text/event-stream")
+    resp.headers["Cache-Control"]     = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.call_on_close(_alert_stream_slots.release)
+    return resp
+
+@app.get("/api/alerts/poll")
+def api_alerts_poll():
+    """Long-poll: segura a requisição até chegar alerta com id > since_id."""
+    allowed, client_id = _alerts_scope()
+    if not allowed:
+        return jsonify([])
+    since_id = since_cursor(request.args.get("since_id", 0, type=int))
+    timeout  = min(max(request.args.get("timeout", ALERT_POLL_MAX_WAIT, type=float), 0), ALERT_POLL_MAX_WAIT)
+    if not _alert_poll_slots.acquire(blocking=False):
+        METRICS.inc("aurora_shed_total", endpoint=request.endpoint)
+        return jsonify([]), 503, {"Retry-After": str(ALERT_POLL_RETRY_AFTER)}
+    METRICS.inc("aurora_alert_polls_total", mode="long_poll")
+    try:
+        alerts = wait_for_alerts(client_id, since_id, timeout)
+    finally:
+        _alert_poll_slots.release()
     resp = jsonify(alerts)
-    resp.headers["Content-Type"] = "application/json"
+    resp.headers["Cache-Control"] = "no-store"
     return resp
 
+GEO_MAX_RADIUS_KM = 50
+GEO_MAX_RESULTS   = 500
+GEO_DEFAULT_HOURS = 24
+HEATMAP_MAX_BINS  = 256
+
+def _geo_window():
+    """Janela de tempo das consultas espaciais: ?hours=T (padrão 24) ou ?start=&end= (dias)."""
+    start, end = request.args.get("start", ""), request.args.get("end", "")
+    if _DAY_RE.match(start) or _DAY_RE.match(end):
+        return (start + " 00:00:00" if _DAY_RE.match(start) else None,
+                end + " 23:59:59" if _DAY_RE.match(end) else None)
+    hours = min(max(request.args.get("hours", GEO_DEFAULT_HOURS, type=float), 0), 24 * 366)
+    now = datetime.now(TZ) if TZ is not None else datetime.now()
+    return (now - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S"), None
+
+def _tile_bbox(z, x, y):
+    """Caixa (min_lat, min_lng, max_lat, max_lng) do tile z/x/y (Web Mercator)."""
+    n = 2 ** z
+    lat = lambda t: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+@app.get("/api/alerts/near")
+def api_alerts_near():
+    """Alertas a até ?radius_km= (padrão 1, máx. 50) de ?lat=&lng=, na janela de tempo.
+
+    Usa a grade espacial do ALERT_STORE: só as células que cobrem o
+    círculo são lidas. Mesmo escopo de /api/alerts (admin vê tudo).
+    """
+    allowed, client_id = _alerts_scope()
+    if not allowed:
+        return jsonify([])
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    if lat is None or lng is None or _alert_point({"lat": lat, "lng": lng}) is None:
+        return jsonify({"ok": False, "error": "lat/lng inválidos"}), 400
+    radius = min(max(request.args.get("radius_km", 1, type=float), 0), GEO_MAX_RADIUS_KM)
+    limit  = min(max(request.args.get("limit", 100, type=int), 1), GEO_MAX_RESULTS)
+    since_ts, until_ts = _geo_window()
+    ALERT_STORE.refresh()
+    return jsonify(ALERT_STORE.near(lat, lng, radius, since_ts, until_ts, client_id, limit))
+
+@app.get("/api/alerts/heatmap")
+def api_alerts_heatmap():
+    """Contagem de alertas por célula de um tile ?z=&x=&y= (padrão: mundo inteiro).
+
+    O tile é dividido em ?bins= x bins células (padrão 32, máx. 256); só as
+    células com alertas voltam, com o centro (lat, lng) e a contagem.
+    """
+    allowed, client_id = _alerts_scope()
+    if not allowed:
+        return jsonify({"bins": []})
+    z = min(max(request.args.get("z", 0, type=int), 0), 20)
+    x = min(max(request.args.get("x", 0, type=int), 0), 2 ** z - 1)
+    y = min(max(request.args.get("y", 0, type=int), 0), 2 ** z - 1)
+    bins = min(max(request.args.get("bins", 32, type=int), 1), HEATMAP_MAX_BINS)
+    since_ts, until_ts = _geo_window()
+    bbox = _tile_bbox(z, x, y)
+    ALERT_STORE.refresh()
+    counts = ALERT_STORE.heat(bbox, bins, since_ts, until_ts, client_id)
+    lat_step = (bbox[2] - bbox[0]) / bins
+    lng_step = (bbox[3] - bbox[1]) / bins
+    cells = [{"lat":   round(bbox[0] + (row + 0.5) * lat_step, 5),
+              "lng":   round(bbox[1] + (col + 0.5) * lng_step, 5),
+              "count": n} for (row, col), n in sorted(counts.items(), key=lambda item: -item[1])]
+    return jsonify({"z": z, "x": x, "y": y, "bbox": bbox, "total": sum(counts.values()), "bins": cells})
+
+@app.get("/api/stats")
+def api_stats():
+    """Agregações sobre todo o histórico: ?group=day|hour|situation|client|location.
+
+    ?start=&end= (AAAA-MM-DD) limitam a janela; admin pode filtrar por
+    ?client_id=, pessoa de confiança/token vê só o próprio cliente.
+    """
+    allowed, client_id = _alerts_scope()
+    if not allowed:
+        return jsonify({"ok": False, "error": "Não autorizado"}), 403
+    group = request.args.get("group", "day")
+    if group not in STATS_GROUPS:
+        return jsonify({"ok": False, "error": f"group deve ser um de: {', '.join(STATS_GROUPS)}"}), 400
+    if client_id is None:
+        client_id = request.args.get("client_id", "").strip() or None
+    start = request.args.get("start", "")
+    end   = request.args.get("end", "")
+    began = time.perf_counter()
+    ALERT_STORE.refresh()
+    ALERT_COLUMNS.sync()
+    result = ALERT_COLUMNS.aggregate(group,
+                                     _ts_epoch(start + " 00:00:00") if _DAY_RE.match(start) else None,
+                                     _ts_epoch(end + " 23:59:59") if _DAY_RE.match(end) else None,
+                                     client_id)
+    return jsonify(dict(result, ok=True, group=group, client_id=client_id,
+                        elapsed_ms=round((time.perf_counter() - began) * 1000, 2)))
+
 @app.get("/api/last_alert")
 def api_last_alert():
     role = session.get("role")
     if role == "trusted":
-        client_id = session.get("client_id")
-        alerts = get_alerts_for_client(client_id)
+        last = get_last_alert(session.get("client_id"))
     else:
-        alerts = get_all_alerts()
+        last = get_last_alert()
 
-    if not alerts:
+    if not last:
         return jsonify({"alerta": False})
-    last = alerts[-1]
     return jsonify({
         "alerta":    True,
         "id":        last.get("id"),
@@ -322,8 +3597,12 @@ def api_clear_alerts():
     if session.get("role") != "admin":
         return jsonify({"ok": False, "error": "Não autorizado"}), 403
     try:
-        ALERTS_FILE.write_text("", encoding="utf-8")
-        STATE_FILE.write_text('{"last_id": 0}', encoding="utf-8")
+        # {"client_id": "..."} apaga só o histórico daquele cliente
+        data = json_body()
+        if data.get("client_id"):
+            removed = clear_client_alerts(str(data["client_id"]))
+            return jsonify({"ok": True, "removed": removed})
+        clear_alerts()
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -332,28 +3611,62 @@ def api_clear_alerts():
 # RELATÓRIO PDF
 # ==========================================
 
-@app.get("/relatorio/pdf")
-def relatorio_pdf():
-    if session.get("role") not in ("admin", "trusted"):
-        return redirect("/panel/login")
+REPORT_CACHE_SIZE = 8
+_DAY_RE           = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_report_cache     = OrderedDict()
+_report_lock      = threading.Lock()
+
+def _report_filters(args=None):
+    """Filtros do relatório (?start=&end=&client_id=&situation=).
+
+    Por padrão vêm da query string; as exportações passam o corpo do POST.
+    """
+    args = request.args if args is None else args
+
+    def text(name, limit=100):
+        return str(args.get(name) or "").strip()[:limit]
+
+    def day(name):
+        value = text(name)
+        return value if _DAY_RE.match(value) else None
 
     if session.get("role") == "trusted":
-        alerts = get_alerts_for_client(session.get("client_id"))
+        client_id = session.get("client_id")
     else:
-        alerts = get_all_alerts()
+        client_id = text("client_id") or None
+    return {
+        "client_id": client_id,
+        "start":     day("start"),
+        "end":       day("end"),
+        "situation": text("situation") or None,
+    }
 
+def iter_report_alerts(filters):
+    for a in iter_alerts(filters["client_id"], filters["start"], filters["end"]):
+        if filters["situation"] and a.get("situation") != filters["situation"]:
+            continue
+        yield a
+
+def build_alerts_pdf(alerts, filters):
+    """Monta o PDF consumindo o iterador de alertas e devolve os bytes."""
     pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
     pdf.add_page()
     pdf.set_font("Arial", "B", 18)
     pdf.cell(0, 10, "RELATORIO DE ALERTAS - AURORA", ln=1)
     pdf.set_font("Arial", "", 10)
-    pdf.cell(0, 8, f"Gerado em: {now_br_str()} | Total: {len(alerts)} alertas", ln=1)
+    pdf.cell(0, 8, f"Gerado em: {now_br_str()}", ln=1)
+    applied = [f"{k}={v}" for k, v in filters.items() if v]
+    if applied:
+        pdf.cell(0, 6, "Filtros: " + " | ".join(applied), ln=1)
     pdf.ln(4)
     pdf.set_font("Arial", "B", 11)
     pdf.cell(0, 8, "-" * 80, ln=1)
     pdf.set_font("Arial", "", 10)
 
+    total = 0
     for a in alerts:
+        total += 1
         linha = f"ID {a.get('id','?')} | {a.get('ts','N/A')} | {a.get('name','N/A')} | {a.get('situation','N/A')}"
         pdf.cell(0, 7, linha, ln=1)
         if a.get("message"):
@@ -362,18 +3675,485 @@ def relatorio_pdf():
             pdf.cell(0, 6, f"   GPS: {a['lat']}, {a['lng']}", ln=1)
         pdf.ln(1)
 
-    temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    pdf.output(temp.name)
-    temp.close()
+    pdf.set_font("Arial", "B", 11)
+    pdf.cell(0, 8, "-" * 80, ln=1)
+    pdf.cell(0, 8, f"Total: {total} alertas", ln=1)
+    return bytes(pdf.output())
+
+def render_report_pdf(filters, alerts=None):
+    """PDF do filtro; reaproveita o último gerado se não chegou alerta (nem ponto de trajeto) novo.
+
+    alerts substitui iter_report_alerts(filters) quando o PDF precisa ser
+    gerado (a exportação passa um iterador que conta o progresso). O id do
+    último alerta é lido uma vez e a geração para nele, então o PDF guardado
+    no cache é exatamente o que a chave descreve, mesmo chegando alerta
+    durante a renderização.
+    """
+    last    = get_last_alert(filters["client_id"])
+    last_id = int(last.get("id") or 0) if last else 0
+    key     = (ALERT_STORE.generation, ALERT_STORE.track_count(), last_id,
+               tuple(sorted(filters.items(), key=lambda kv: kv[0])))
+    with _report_lock:
+        if key in _report_cache:
+            _report_cache.move_to_end(key)
+            return _report_cache[key]
+
+    def up_to_last(source):
+        for alert in source:
+            if int(alert.get("id") or 0) > last_id:
+                return
+            yield alert
+
+    data = build_alerts_pdf(up_to_last(iter_report_alerts(filters) if alerts is None else alerts), filters)
+    with _report_lock:
+        _report_cache[key] = data
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    return data
+
+# ==========================================
+# HISTÓRICO PAGINADO
+# ==========================================
+#
+# /panel, /historico e /central mostram uma página por vez (cursor
+# ?before=<id>) com filtros no servidor; os contadores vêm de
+# ALERT_STORE.stats(), mantidos a cada alerta indexado.
+
+ALERT_PAGE_SIZE = 50
+ALERT_PAGE_MAX  = 200
+
+def _list_filters():
+    """Filtros do relatório + ?gps=1|0 (com/sem localização)."""
+    filters = _report_filters()
+    filters["has_location"] = {"1": True, "0": False}.get(request.args.get("gps", ""))
+    return filters
+
+def alert_page(filters, limit=None):
+    """Contexto de template: página atual, links de navegação e contadores."""
+    before = request.args.get("before", type=int)
+    if limit is None:
+        limit = min(max(request.args.get("limit", ALERT_PAGE_SIZE, type=int), 1), ALERT_PAGE_MAX)
+    ALERT_STORE.refresh()
+    alerts, next_before = ALERT_STORE.page(filters["client_id"], filters["start"], filters["end"],
+                                           filters["situation"], filters["has_location"], before, limit)
+    query = {k: v for k, v in request.args.items() if k != "before" and v}
+    return {
+        "alerts":    alerts,
+        "filters":   filters,
+        "stats":     ALERT_STORE.stats(today_str()),
+        "next_url":  f"{request.path}?{urlencode(dict(query, before=next_before))}" if next_before else None,
+        "first_url": f"{request.path}?{urlencode(query)}" if before else None,
+    }
+
+# ==========================================
+# EXPORTAÇÕES EM SEGUNDO PLANO (PDF, CSV, JSONL)
+# ==========================================
+
+EXPORT_WORKERS       = 1     # renderização pesada nunca ocupa mais que isso
+EXPORT_TTL           = 900   # segundos que um arquivo pronto fica disponível
+EXPORT_MAX_PENDING   = 8     # jobs na fila ou rodando, neste worker
+EXPORT_MAX_PER_OWNER = 2     # idem, por usuária
+EXPORT_RETRY_AFTER   = 10
+EXPORT_FORMATS = {
+    "pdf":   ("application/pdf",      "pdf"),
+    "csv":   ("text/csv",             "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+}
+CSV_FIELDS = ["id", "ts", "name", "situation", "message", "client_id", "lat", "lng", "accuracy"]
+
+# Com vários workers, status e download podem cair em outro processo: o
+# estado de cada job (e o arquivo pronto) também fica em EXPORTS_DIR
+EXPORTS_DIR    = ALERTS_FILE.parent / "exports"
+_EXPORT_ID_RE  = re.compile(r"^[A-Za-z0-9_-]{8,32}$")
+
+_export_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+_export_jobs = {}
+_export_lock = threading.Lock()
+
+def build_alerts_csv(alerts):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for a in alerts:
+        writer.writerow(a)
+    return buf.getvalue().encode("utf-8")
+
+def build_alerts_jsonl(alerts):
+    return "".join(json.dumps(dict(a), ensure_ascii=False) + "\n" for a in alerts).encode("utf-8")
+
+EXPORT_BUILDERS = {
+    "pdf":   lambda alerts, filters: render_report_pdf(filters, alerts),
+    "csv":   lambda alerts, filters: build_alerts_csv(alerts),
+    "jsonl": lambda alerts, filters: build_alerts_jsonl(alerts),
+}
+
+def _export_owner():
+    return (session.get("role"), session.get("user") or session.get("trusted"))
+
+class ExportQueueFull(Exception):
+    """Fila de exportações lotada (no total ou para esta usuária); responder 429."""
+
+def _run_export(job):
+    """Executa no pool de exportação; o progresso é o nº de alertas lidos."""
+    if job.get("expired"):
+        return
+
+    def counted():
+        for alert in iter_report_alerts(job["filters"]):
+            job["processed"] += 1
+            yield alert
 
+    job["state"] = "running"
     try:
-        return send_file(temp.name, as_attachment=True, download_name="relatorio_aurora.pdf")
-    finally:
+        job["data"]  = EXPORT_BUILDERS[job["format"]](counted(), job["filters"])
+        job["state"] = "done"
+    except Exception as e:
+        log_event("export_error", logging.ERROR, job=job["id"], format=job["format"], error=str(e))
+        job["state"] = "error"
+        job["error"] = str(e)
+    job["finished"] = time.time()
+    _save_export(job)
+
+def _write_atomic(path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def _save_export(job):
+    """Grava o estado do job (e o arquivo, se pronto) para os outros workers."""
+    try:
+        EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        if job.get("data") is not None:
+            _write_atomic(EXPORTS_DIR / f"{job['id']}.bin", job["data"])
+        meta = {k: v for k, v in job.items() if k != "data"}
+        _write_atomic(EXPORTS_DIR / f"{job['id']}.json", json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+    except OSError as e:
+        log_event("export_save_error", logging.ERROR, job=job["id"], error=str(e))
+
+def _purge_exports():
+    """Esquece jobs prontos há mais de EXPORT_TTL e os que nem começaram nesse tempo."""
+    now = time.time()
+    with _export_lock:
+        for job_id, job in list(_export_jobs.items()):
+            if job.get("finished"):
+                if now - job["finished"] > EXPORT_TTL:
+                    del _export_jobs[job_id]
+            elif job["state"] == "queued" and now - job["created"] > EXPORT_TTL:
+                job["expired"] = True   # _run_export pula quando chegar a vez
+                del _export_jobs[job_id]
+    try:
+        with os.scandir(EXPORTS_DIR) as entries:
+            expired = [e.path for e in entries if now - e.stat().st_mtime > EXPORT_TTL]
+    except OSError:
+        return
+    for path in expired:
         try:
-            os.unlink(temp.name)
-        except Exception:
+            os.unlink(path)
+        except OSError:
             pass
 
+def _get_export(job_id):
+    job = _export_jobs.get(job_id)
+    if job is None and _EXPORT_ID_RE.match(job_id):
+        # Job de outro worker
+        try:
+            job = json.loads((EXPORTS_DIR / f"{job_id}.json").read_text(encoding="utf-8"))
+            job["owner"] = tuple(job["owner"])
+        except (OSError, ValueError, KeyError):
+            return None
+    if job is None or job["owner"] != _export_owner():
+        return None
+    return job
+
+def _export_data(job):
+    data = job.get("data")
+    if data is None:
+        data = (EXPORTS_DIR / f"{job['id']}.bin").read_bytes()
+    return data
+
+def _export_status(job):
+    return {
+        "id":        job["id"],
+        "format":    job["format"],
+        "state":     job["state"],
+        "processed": job["processed"],
+        "error":     job.get("error"),
+        "download":  f"/api/exports/{job['id']}/download" if job["state"] == "done" else None,
+    }
+
+def submit_export(fmt, filters):
+    """Cria o job e o põe na fila; ExportQueueFull se já há jobs demais pendentes."""
+    _purge_exports()
+    job = {
+        "id":        secrets.token_urlsafe(12),
+        "owner":     _export_owner(),
+        "format":    fmt,
+        "filters":   filters,
+        "state":     "queued",
+        "processed": 0,
+        "created":   time.time(),
+    }
+    with _export_lock:
+        pending = [j for j in _export_jobs.values() if j["state"] in ("queued", "running")]
+        if (len(pending) >= EXPORT_MAX_PENDING
+                or sum(1 for j in pending if j["owner"] == job["owner"]) >= EXPORT_MAX_PER_OWNER):
+            raise ExportQueueFull()
+        _export_jobs[job["id"]] = job
+    _save_export(job)
+    _export_pool.submit(_run_export, job)
+    return job
+
+@app.post("/api/exports")
+def api_export_submit():
+    """Agenda uma exportação. Corpo: format (pdf|csv|jsonl) + filtros do relatório."""
+    if session.get("role") not in ("admin", "trusted"):
+        return jsonify({"ok": False, "error": "Não autorizado"}), 403
+    data = json_body() or request.form
+    fmt  = str(data.get("format", "pdf")).lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"ok": False, "error": "Formato inválido"}), 400
+
+    try:
+        job = submit_export(fmt, _report_filters(data))
+    except ExportQueueFull:
+        resp = jsonify({"ok": False, "error": "Muitas exportações na fila. Tente novamente em instantes."})
+        resp.headers["Retry-After"] = str(EXPORT_RETRY_AFTER)
+        return resp, 429
+    return jsonify({"ok": True, **_export_status(job)}), 202
+
+@app.get("/api/exports/<job_id>")
+def api_export_status(job_id):
+    job = _get_export(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Exportação não encontrada"}), 404
+    return jsonify({"ok": True, **_export_status(job)})
+
+@app.get("/api/exports/<job_id>/download")
+def api_export_download(job_id):
+    job = _get_export(job_id)
+    if job is None or job["state"] != "done":
+        return jsonify({"ok": False, "error": "Exportação não disponível"}), 404
+    try:
+        data = _export_data(job)
+    except OSError:
+        return jsonify({"ok": False, "error": "Exportação não disponível"}), 404
+    mimetype, ext = EXPORT_FORMATS[job["format"]]
+    return send_file(io.BytesIO(data), mimetype=mimetype,
+                     as_attachment=True, download_name=f"relatorio_aurora.{ext}")
+
+# Os links "Baixar PDF" dos painéis: o PDF sai da mesma fila das exportações.
+# /relatorio/pdf agenda o job e redireciona para uma página que se recarrega
+# até o arquivo ficar pronto e então inicia o download.
+
+@app.get("/relatorio/pdf")
+def relatorio_pdf():
+    if session.get("role") not in ("admin", "trusted"):
+        return redirect("/panel/login")
+
+    try:
+        job = submit_export("pdf", _report_filters())
+    except ExportQueueFull:
+        resp = app.make_response((render_template("exportacao.html", job=None, busy=True), 429))
+        resp.headers["Retry-After"] = str(EXPORT_RETRY_AFTER)
+        return resp
+    return redirect(f"/relatorio/exportacao/{job['id']}", code=303)
+
+@app.get("/relatorio/exportacao/<job_id>")
+def relatorio_exportacao(job_id):
+    if session.get("role") not in ("admin", "trusted"):
+        return redirect("/panel/login")
+
+    job = _get_export(job_id)
+    if job is None:
+        return render_template("exportacao.html", job=None, busy=False), 404
+    return render_template("exportacao.html", job=_export_status(job), busy=False)
+
+# ==========================================
+# AUTENTICAÇÃO
+# ==========================================
+#
+# Conferir uma senha custa dezenas de ms de CPU (scrypt). Isso roda num pool
+# pequeno e limitado, fora da thread da requisição, e cada usuário e cada IP
+# tem um teto de falhas numa janela deslizante: uma rajada de tentativas
+# recebe 429 antes de gastar CPU e não rouba threads dos alertas. Quando o
+# custo configurado muda, o hash é refeito no próximo login bem-sucedido,
+# gravando só aquele usuário.
+
+PASSWORD_HASH_METHOD = os.environ.get("AURORA_PASSWORD_HASH", "scrypt:32768:8:1")
+LOGIN_HASH_WORKERS   = int(os.environ.get("AURORA_LOGIN_WORKERS", "2"))
+LOGIN_HASH_QUEUE     = int(os.environ.get("AURORA_LOGIN_QUEUE", "8"))   # verificações aguardando o pool
+LOGIN_HASH_TIMEOUT   = 10
+LOGIN_WINDOW         = int(os.environ.get("AURORA_LOGIN_WINDOW", "300"))
+LOGIN_MAX_PER_USER   = int(os.environ.get("AURORA_LOGIN_MAX_USER", "10"))
+LOGIN_MAX_PER_IP     = int(os.environ.get("AURORA_LOGIN_MAX_IP", "20"))
+
+# Prefixo normalizado pelo werkzeug ("scrypt:32768:8:1", "pbkdf2:sha256:600000"):
+# gerar um hash na importação também valida AURORA_PASSWORD_HASH.
+PASSWORD_HASH_PREFIX = generate_password_hash("", PASSWORD_HASH_METHOD).split("$", 1)[0]
+
+class LoginBusy(Exception):
+    """O pool de hash está lotado; a requisição deve ser recusada com 429."""
+
+class SlidingWindowLimiter:
+    """Conta eventos por chave nos últimos `window` segundos."""
+
+    MAX_KEYS = 10000
+
+    def __init__(self, limit, window):
+        self.limit   = limit
+        self.window  = window
+        self._events = {}
+        self._lock   = threading.Lock()
+
+    def _recent(self, key, now):
+        # Chamado com _lock
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def retry_after(self, key):
+        """0 se a chave ainda pode tentar; senão os segundos até liberar."""
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None or len(events) < self.limit:
+                return 0
+            return max(1, int(events[-self.limit] + self.window - now) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None:
+                events = self._events[key] = collections.deque(maxlen=self.limit)
+            events.append(now)
+            self._prune(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+    def _prune(self, now):
+        if len(self._events) <= self.MAX_KEYS:
+            return
+        for key in [k for k, ev in self._events.items() if ev[-1] <= now - self.window]:
+            del self._events[key]
+
+LOGIN_FAILURES_USER = SlidingWindowLimiter(LOGIN_MAX_PER_USER, LOGIN_WINDOW)
+LOGIN_FAILURES_IP   = SlidingWindowLimiter(LOGIN_MAX_PER_IP, LOGIN_WINDOW)
+_login_pool  = ThreadPoolExecutor(max_workers=LOGIN_HASH_WORKERS, thread_name_prefix="login")
+_login_slots = threading.BoundedSemaphore(LOGIN_HASH_WORKERS + LOGIN_HASH_QUEUE)
+_rehash_lock    = threading.Lock()
+_rehash_pending = set()
+
+def remote_ip():
+    # Já resolvido pelo ProxyFix (AURORA_TRUSTED_PROXIES); access_route[0]
+    # seria o primeiro valor do X-Forwarded-For, escolhido pelo cliente
+    return request.remote_addr
+
+def _run_hash(fn, *args):
+    """Executa fn no pool de login e espera o resultado; LoginBusy se lotado."""
+    if not _login_slots.acquire(blocking=False):
+        raise LoginBusy()
+    try:
+        future = _login_pool.submit(fn, *args)
+    except Exception:
+        _login_slots.release()
+        raise
+    future.add_done_callback(lambda _: _login_slots.release())
+    try:
+        with METRICS.timer("aurora_login_hash_seconds"):
+            return future.result(timeout=LOGIN_HASH_TIMEOUT)
+    except TimeoutError:
+        raise LoginBusy()
+
+def _check_password(stored, password):
+    if stored.startswith("pbkdf2:") or stored.startswith("scrypt:"):
+        return check_password_hash(stored, password)
+    # Senha antiga em texto puro (migrada no primeiro login)
+    return bool(stored) and hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+
+def hash_password(password):
+    return _run_hash(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def needs_rehash(stored):
+    return stored.split("$", 1)[0] != PASSWORD_HASH_PREFIX
+
+def _schedule_rehash(username, info, password):
+    """Refaz o hash em segundo plano; só grava se o usuário não mudou nesse meio-tempo."""
+    with _rehash_lock:
+        if username in _rehash_pending:
+            return
+        _rehash_pending.add(username)
+
+    def job():
+        try:
+            hashed = generate_password_hash(password, PASSWORD_HASH_METHOD)
+            if USERS.put_if(username, info, dict(info, password=hashed)):
+                log_event("password_rehashed", user=username, method=PASSWORD_HASH_PREFIX)
+        except Exception as e:
+            log_event("password_rehash_error", logging.ERROR, user=username, error=str(e))
+        finally:
+            with _rehash_lock:
+                _rehash_pending.discard(username)
+
+    _login_pool.submit(job)
+
+def authenticate(username, password, role):
+    """Confere usuário/senha com o papel esperado.
+
+    Devolve (info, retry_after): info é None quando recusado; retry_after > 0
+    significa bloqueio por excesso de tentativas ou pool ocupado (429).
+    """
+    ip   = remote_ip()
+    wait = max(LOGIN_FAILURES_USER.retry_after(username), LOGIN_FAILURES_IP.retry_after(ip))
+    if wait:
+        METRICS.inc("aurora_login_total", result="throttled")
+        log_event("login_throttled", logging.WARNING, user=username, ip=ip, retry_after=wait)
+        return None, wait
+
+    info = USERS.get(username)
+    ok   = False
+    if info and info.get("role") == role:
+        stored = info.get("password", "")
+        try:
+            ok = _run_hash(_check_password, stored, password)
+        except LoginBusy:
+            METRICS.inc("aurora_login_total", result="busy")
+            return None, SHED_RETRY_AFTER
+
+    if not ok:
+        LOGIN_FAILURES_USER.hit(username)
+        LOGIN_FAILURES_IP.hit(ip)
+        METRICS.inc("aurora_login_total", result="invalid")
+        log_event("login_failed", logging.WARNING, user=username, ip=ip)
+        return None, 0
+
+    LOGIN_FAILURES_USER.reset(username)
+    METRICS.inc("aurora_login_total", result="ok")
+    if needs_rehash(stored):
+        _schedule_rehash(username, info, password)
+    return info, 0
+
+@app.errorhandler(LoginBusy)
+def login_busy(_exc):
+    resp = app.response_class(SHED_MESSAGE, status=429, mimetype="text/plain")
+    resp.headers["Retry-After"] = str(SHED_RETRY_AFTER)
+    return resp
+
+def _login_refused(template, retry_after):
+    if not retry_after:
+        return render_template(template, error=True)
+    resp = app.make_response((render_template(template, throttled=True), 429))
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
 # ==========================================
 # ADMIN
 # ==========================================
@@ -381,29 +4161,17 @@ def relatorio_pdf():
 @app.route("/panel/login", methods=["GET", "POST"])
 def admin_login():
     if request.method == "POST":
-        users = load_users()
         u = request.form.get("user", "").strip()
         p = request.form.get("password", "")
-        info = users.get(u)
+        info, retry_after = authenticate(u, p, "admin")
 
         if info:
-            stored = info.get("password", "")
-            ok = False
-            if stored.startswith("pbkdf2:") or stored.startswith("scrypt:"):
-                ok = check_password_hash(stored, p)
-            else:
-                ok = (stored == p)
-                if ok:
-                    info["password"] = generate_password_hash(p)
-                    save_users(users)
-
-            if ok and info.get("role") == "admin":
-                session.clear()
-                session["role"]  = "admin"
-                session["user"]  = u
-                return redirect("/panel")
+            session.clear()
+            session["role"]  = "admin"
+            session["user"]  = u
+            return redirect("/panel")
 
-        return render_template("login_admin.html", error=True)
+        return _login_refused("login_admin.html", retry_after)
 
     return render_template("login_admin.html")
 
@@ -413,19 +4181,12 @@ def admin_panel():
     if redir:
         return redir
     try:
-        users   = load_users()
-        trusted = {u: info for u, info in users.items() if info.get("role") == "trusted"}
-        alerts  = get_all_alerts()
+        trusted = USERS.by_role("trusted")
         clients = get_all_clients()
+        ALERT_STORE.refresh()
+        alerts, _ = ALERT_STORE.page(limit=5)
 
-        stats = {
-            "total":            len(alerts),
-            "today":            sum(1 for a in alerts if a.get("ts", "").startswith(today_str())),
-            "trusted":          len(trusted),
-            "with_location":    sum(1 for a in alerts if a.get("lat")),
-            "without_location": sum(1 for a in alerts if not a.get("lat")),
-            "clients":          len(clients),
-        }
+        stats = dict(ALERT_STORE.stats(today_str()), trusted=len(trusted), clients=len(clients))
 
         return render_template("panel_admin.html",
                                trusted=trusted,
@@ -433,7 +4194,7 @@ def admin_panel():
                                stats=stats,
                                clients=clients)
     except Exception as e:
-        print(f"❌ admin_panel error: {e}")
+        log_event("admin_panel_error", logging.ERROR, error=str(e))
         session.clear()
         return redirect("/panel/login")
 
@@ -451,15 +4212,13 @@ def admin_add_client():
     client_id = generate_client_id()
 
     # FIX: Salva cliente dentro do users.json com role="client"
-    users = load_users()
-    users[f"__client__{client_id}"] = {
+    save_user(f"__client__{client_id}", {
         "role":       "client",
         "name":       client_name,
         "client_id":  client_id,
         "created_at": now_br_str(),
         "password":   ""
-    }
-    save_users(users)
+    })
 
     return redirect(f"/panel?msg=Cliente+criada:+{client_name}&client_id={client_id}")
 
@@ -479,24 +4238,22 @@ def admin_add_trusted():
     if len(password) < 4:
         return redirect("/panel?err=Senha+muito+curta")
 
-    users = load_users()
-    if username in users:
+    if USERS.get(username) is not None:
         return redirect("/panel?err=Usuario+ja+existe")
 
     # Carrega nome do cliente direto do users.json
     client_name = client_id
-    client_entry = users.get(f"__client__{client_id}", {})
+    client_entry = USERS.get(f"__client__{client_id}") or {}
     if client_entry:
         client_name = client_entry.get("name", client_id)
 
-    users[username] = {
-        "password":    generate_password_hash(password),
+    save_user(username, {
+        "password":    hash_password(password),
         "role":        "trusted",
         "name":        name,
         "client_id":   client_id or None,
         "client_name": client_name
-    }
-    save_users(users)
+    })
     return redirect(f"/panel?msg=Pessoa+cadastrada:+{name}")
 
 @app.post("/panel/delete_trusted")
@@ -506,18 +4263,17 @@ def admin_delete_trusted():
         return redir
 
     username = request.form.get("username", "").strip()
-    users = load_users()
+    info = USERS.get(username)
 
-    if username in users and users[username].get("role") == "trusted":
-        users.pop(username)
-        save_users(users)
+    if info and info.get("role") == "trusted":
+        delete_users([username])
         return redirect("/panel?msg=Pessoa+removida")
 
     return redirect("/panel?err=Erro+ao+remover")
 
 @app.post("/panel/delete_client")
 def admin_delete_client():
-    """Remove um cliente e todos os seus trusted."""
+    """Remove um cliente, todos os seus trusted e o histórico de alertas dele."""
     redir = require_role("admin")
     if redir:
         return redir
@@ -527,18 +4283,14 @@ def admin_delete_client():
         return redirect("/panel?err=Cliente+não+encontrado")
 
     # Remove trusted do cliente
-    users = load_users()
-    to_remove = [u for u, info in users.items()
-                 if info.get("client_id") == client_id and info.get("role") == "trusted"]
-    for u in to_remove:
-        users.pop(u)
-    save_users(users)
-
-    # Remove entrada __client__ do users.json
+    to_remove = USERS.trusted_for(client_id)
+
+    # Remove também a entrada __client__ do users.json
     client_key = f"__client__{client_id}"
-    if client_key in users:
-        users.pop(client_key)
-    save_users(users)
+    if USERS.get(client_key) is not None:
+        to_remove.append(client_key)
+    delete_users(to_remove)
+    clear_client_alerts(client_id)
 
     return redirect("/panel?msg=Cliente+removido")
 
@@ -554,31 +4306,19 @@ def logout_admin():
 @app.route("/trusted/login", methods=["GET", "POST"])
 def trusted_login():
     if request.method == "POST":
-        users = load_users()
         u = request.form.get("user", "").strip().lower()
         p = request.form.get("password", "")
-        info = users.get(u)
-
-        if info and info.get("role") == "trusted":
-            stored = info.get("password", "")
-            ok = False
-            if stored.startswith("pbkdf2:") or stored.startswith("scrypt:"):
-                ok = check_password_hash(stored, p)
-            else:
-                ok = (stored == p)
-                if ok:
-                    info["password"] = generate_password_hash(p)
-                    save_users(users)
+        info, retry_after = authenticate(u, p, "trusted")
 
-            if ok:
-                session.clear()
-                session["role"]        = "trusted"
-                session["trusted"]     = u
-                session["client_id"]   = info.get("client_id")
-                session["client_name"] = info.get("client_name", "")
-                return redirect("/trusted/panel")
+        if info:
+            session.clear()
+            session["role"]        = "trusted"
+            session["trusted"]     = u
+            session["client_id"]   = info.get("client_id")
+            session["client_name"] = info.get("client_name", "")
+            return redirect("/trusted/panel")
 
-        return render_template("login_trusted.html", error=True)
+        return _login_refused("login_trusted.html", retry_after)
 
     return render_template("login_trusted.html")
 
@@ -588,23 +4328,25 @@ def trusted_panel():
     if redir:
         return redir
     try:
-        users = load_users()
         u = session.get("trusted")
         if not u:
             session.clear()
             return redirect("/trusted/login")
 
         client_id    = session.get("client_id")
-        display_name = users.get(u, {}).get("name") or u
-        # Apenas alertas do cliente desta pessoa de confiança
-        alerts = get_alerts_for_client(client_id)[-10:]
+        display_name = (USERS.get(u) or {}).get("name") or u
+        # Apenas os últimos alertas do cliente desta pessoa de confiança,
+        # pela página do índice (sem montar o histórico inteiro)
+        ALERT_STORE.refresh()
+        alerts, _ = ALERT_STORE.page(client_id, limit=10)
+        alerts.reverse()
 
         return render_template("panel_trusted.html",
                                display_name=display_name,
                                alerts=alerts,
                                client_id=client_id or "")
     except Exception as e:
-        print(f"❌ trusted_panel error: {e}")
+        log_event("trusted_panel_error", logging.ERROR, error=str(e))
         session.clear()
         return redirect("/trusted/login")
 
@@ -620,7 +4362,6 @@ def trusted_change_password():
         return redir
 
     if request.method == "POST":
-        users  = load_users()
         u      = session.get("trusted")
         old_pw = request.form.get("old_password", "")
         new_pw = request.form.get("new_password", "")
@@ -631,15 +4372,14 @@ def trusted_change_password():
         if len(new_pw) < 4:
             return render_template("trusted_change_password.html", err="Senha muito curta.")
 
-        info   = users.get(u, {})
-        stored = info.get("password", "")
-        ok     = check_password_hash(stored, old_pw) if stored.startswith("pbkdf2:") or stored.startswith("scrypt:") else (stored == old_pw)
-
-        if not ok:
+        info, retry_after = authenticate(u, old_pw, "trusted")
+        if retry_after:
+            return render_template("trusted_change_password.html",
+                                   err="Muitas tentativas. Aguarde alguns minutos."), 429
+        if not info:
             return render_template("trusted_change_password.html", err="Senha atual incorreta.")
 
-        users[u]["password"] = generate_password_hash(new_pw)
-        save_users(users)
+        save_user(u, dict(info, password=hash_password(new_pw)))
         return render_template("trusted_change_password.html", msg="Senha alterada com sucesso!")
 
     return render_template("trusted_change_password.html")
@@ -647,17 +4387,16 @@ def trusted_change_password():
 @app.route("/trusted/recover", methods=["GET", "POST"])
 def trusted_recover():
     if request.method == "POST":
-        users = load_users()
         u     = request.form.get("usuario", "").strip().lower()
         nova  = request.form.get("nova_senha", "")
 
         if len(nova) < 4:
             return render_template("trusted_recover.html", err="Senha muito curta.")
-        if u not in users or users[u].get("role") != "trusted":
+        info = USERS.get(u)
+        if not info or info.get("role") != "trusted":
             return render_template("trusted_recover.html", err="Usuário não encontrado.")
 
-        users[u]["password"] = generate_password_hash(nova)
-        save_users(users)
+        save_user(u, dict(info, password=hash_password(nova)))
         return render_template("trusted_recover.html", msg="Senha redefinida! Faça login.")
 
     return render_template("trusted_recover.html")
@@ -666,54 +4405,292 @@ def trusted_recover():
 # AURORA IA — Proxy Anthropic
 # ==========================================
 
+AURORA_IA_URL         = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+AURORA_IA_MODEL       = "claude-haiku-4-5-20251001"
+AURORA_IA_TIMEOUT     = 30
+AURORA_IA_POOL_SIZE   = 4
+AURORA_IA_CONCURRENCY = int(os.environ.get("AURORA_IA_CONCURRENCY", "4"))
+AURORA_IA_FALLBACK    = "Sem conexão no momento. Ligue 180 ou 190 se precisar de ajuda urgente. 💜"
+AURORA_IA_CACHE_SIZE  = 256
+AURORA_IA_CACHE_TTL   = 6 * 3600
+# Token bucket por IP/sessão: AURORA_IA_RATE mensagens por minuto, rajada de AURORA_IA_BURST
+AURORA_IA_RATE        = float(os.environ.get("AURORA_IA_RATE", "10"))
+AURORA_IA_BURST       = float(os.environ.get("AURORA_IA_BURST", "5"))
+AURORA_IA_SLOW_DOWN   = "Você enviou muitas mensagens seguidas. Aguarde alguns segundos. Em perigo, ligue 190 ou 180. 💜"
+
+AURORA_IA_SYSTEM = (
+    "Você é a Aurora IA, assistente virtual especializada em apoio a mulheres "
+    "vítimas de violência doméstica no Brasil. Ofereça acolhimento, empatia e "
+    "informações sobre: Lei Maria da Penha, medidas protetivas, canais de ajuda "
+    "(180, 190, DEAM, CRAM), como reconhecer abuso e sair com segurança. "
+    "Seja gentil, sem julgamentos, nunca culpe a vítima. Em perigo imediato "
+    "oriente sempre a ligar 190 ou 180. Respostas curtas em português do Brasil."
+)
+
+class UpstreamPool:
+    """Pool de conexões HTTP(S) keep-alive para um único host.
+
+    Reaproveita a conexão TLS entre chamadas; uma conexão ociosa que o
+    servidor já fechou é descartada e a requisição é refeita uma vez.
+    """
+
+    def __init__(self, base_url, size, timeout):
+        parts        = urlsplit(base_url)
+        self.secure  = parts.scheme == "https"
+        self.host    = parts.hostname
+        self.port    = parts.port
+        self.prefix  = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle   = queue.LifoQueue(maxsize=size)
+        self._ssl    = ssl.create_default_context() if self.secure else None
+
+    def _connect(self):
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self._ssl)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body, headers):
+        """Devolve (conexão, resposta); chame release() depois de ler tudo."""
+        for attempt in range(2):
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if not reused or attempt:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+    def release(self, conn, resp):
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+class TTLCache:
+    """LRU com expiração por item; seguro para várias threads."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._data   = OrderedDict()
+        self._lock   = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class TokenBucketLimiter:
+    """Token bucket por chave (IP/sessão): rate tokens por segundo, até burst."""
+
+    MAX_KEYS = 10000
+
+    def __init__(self, rate, burst):
+        self.rate    = rate
+        self.burst   = burst
+        self._bucket = {}
+        self._lock   = threading.Lock()
+
+    def take(self, key):
+        """Consome um token; devolve 0 se liberado ou os segundos até o próximo."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._bucket.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                self._bucket[key] = (tokens - 1, now)
+                self._prune(now)
+                return 0
+            self._bucket[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        if len(self._bucket) <= self.MAX_KEYS:
+            return
+        # Baldes que já encheram de novo não carregam estado útil
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, stamp) in self._bucket.items() if now - stamp > full_after]:
+            del self._bucket[key]
+
+AURORA_IA_POOL    = UpstreamPool(AURORA_IA_URL, AURORA_IA_POOL_SIZE, AURORA_IA_TIMEOUT)
+AURORA_IA_CACHE   = TTLCache(AURORA_IA_CACHE_SIZE, AURORA_IA_CACHE_TTL)
+AURORA_IA_LIMITER = TokenBucketLimiter(AURORA_IA_RATE / 60, AURORA_IA_BURST)
+# Limita quantas threads a IA pode ocupar: o resto fica livre para os alertas
+_aurora_ia_slots = threading.BoundedSemaphore(AURORA_IA_CONCURRENCY)
+
+def _normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def aurora_ia_cache_key(messages):
+    """Hash da pergunta normalizada (caixa, acentos, pontuação) + prompt de sistema.
+
+    Só a primeira pergunta (conversa com uma única mensagem da usuária) vai
+    para o cache: é a que se repete entre pessoas. Depois disso a conversa
+    é de uma pessoa só e não há chave (None).
+    """
+    if len(messages) != 1 or not isinstance(messages[0], dict) or messages[0].get("role") != "user":
+        return None
+    raw = json.dumps([AURORA_IA_MODEL, AURORA_IA_SYSTEM, _normalize_text(messages[0].get("content", ""))],
+                     ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def client_key():
+    """Identifica quem chama para limitação: usuário logado ou IP de origem."""
+    user = session.get("user") or session.get("trusted")
+    if user:
+        return f"user:{user}"
+    return f"ip:{remote_ip()}"
+
+def _aurora_ia_request(api_key, messages, stream):
+    payload = json.dumps({
+        "model":      AURORA_IA_MODEL,
+        "max_tokens": 800,
+        "system":     AURORA_IA_SYSTEM,
+        "messages":   messages[-20:],
+        "stream":     stream,
+    }).encode("utf-8")
+    headers = {
+        "Content-Type":      "application/json",
+        "x-api-key":         api_key,
+        "anthropic-version": "2023-06-01",
+    }
+    with METRICS.timer("aurora_ia_upstream_seconds", mode="stream" if stream else "json"):
+        conn, resp = AURORA_IA_POOL.request("POST", "/v1/messages", payload, headers)
+    if resp.status != 200:
+        resp.read()
+        AURORA_IA_POOL.release(conn, resp)
+        raise RuntimeError(f"upstream HTTP {resp.status}")
+    return conn, resp
+
+def aurora_ia_reply(api_key, messages):
+    """Resposta completa (modo JSON)."""
+    conn, resp = _aurora_ia_request(api_key, messages, stream=False)
+    result = json.loads(resp.read().decode("utf-8"))
+    AURORA_IA_POOL.release(conn, resp)
+    return result["content"][0]["text"]
+
+def aurora_ia_stream(api_key, messages, cache_key=None):
+    """Repassa os tokens do upstream como SSE: eventos data {"text": ...} e um done.
+
+    Se a resposta chegar completa, ela vai para o cache com cache_key.
+    """
+    conn = resp = None
+    parts = []
+    try:
+        conn, resp = _aurora_ia_request(api_key, messages, stream=True)
+        for raw in resp:
+            line = raw.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            try:
+                event = json.loads(line[5:])
+            except Exception:
+                continue
+            if event.get("type") == "content_block_delta":
+                text = (event.get("delta") or {}).get("text")
+                if text:
+                    parts.append(text)
+                    yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+            elif event.get("type") == "message_stop":
+                METRICS.inc("aurora_ia_requests_total", result="ok")
+                if cache_key and parts:
+                    AURORA_IA_CACHE.set(cache_key, "".join(parts))
+                break
+        resp.read()
+        AURORA_IA_POOL.release(conn, resp)
+        conn = None
+    except Exception as e:
+        METRICS.inc("aurora_ia_requests_total", result="error")
+        log_event("aurora_ia_error", logging.ERROR, stream=True, error=str(e))
+        yield f"data: {json.dumps({'text': AURORA_IA_FALLBACK}, ensure_ascii=False)}\n\n"
+    finally:
+        if conn is not None:
+            conn.close()
+    yield "event: done\ndata: {}\n\n"
+
 @app.post("/api/aurora-ia")
 def aurora_ia_chat():
-    import urllib.request
-    import json as _json
+    """Proxy da Aurora IA.
 
-    data     = request.get_json(silent=True) or {}
+    Com "stream": true no corpo (ou Accept: text/event-stream) a resposta
+    sai token a token em SSE; sem isso, JSON {"reply": ...} como antes.
+    Primeiras perguntas repetidas saem do cache sem ir ao upstream; cada IP/sessão
+    tem um token bucket e recebe 429 + Retry-After quando esvazia.
+    """
+    data     = json_body()
     messages = data.get("messages", [])
-    if not messages:
+    if not messages or not isinstance(messages, list):
         return jsonify({"error": "No messages"}), 400
 
     api_key = os.environ.get("ANTHROPIC_API_KEY", "")
     if not api_key:
         return jsonify({"reply": "Aurora IA não configurada. Defina ANTHROPIC_API_KEY no servidor."}), 200
 
-    SYSTEM = (
-        "Você é a Aurora IA, assistente virtual especializada em apoio a mulheres "
-        "vítimas de violência doméstica no Brasil. Ofereça acolhimento, empatia e "
-        "informações sobre: Lei Maria da Penha, medidas protetivas, canais de ajuda "
-        "(180, 190, DEAM, CRAM), como reconhecer abuso e sair com segurança. "
-        "Seja gentil, sem julgamentos, nunca culpe a vítima. Em perigo imediato "
-        "oriente sempre a ligar 190 ou 180. Respostas curtas em português do Brasil."
-    )
-
-    payload = _json.dumps({
-        "model":      "claude-haiku-4-5-20251001",
-        "max_tokens": 800,
-        "system":     SYSTEM,
-        "messages":   messages[-20:]
-    }).encode("utf-8")
+    stream = bool(data.get("stream")) or request.accept_mimetypes.best == "text/event-stream"
+    key    = aurora_ia_cache_key(messages)
+    cached = AURORA_IA_CACHE.get(key) if key else None
+    if cached is not None:
+        METRICS.inc("aurora_ia_requests_total", result="cache_hit")
+        if stream:
+            body = f"data: {json.dumps({'text': cached}, ensure_ascii=False)}\n\nevent: done\ndata: {{}}\n\n"
+            return Response(body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+        return jsonify({"reply": cached})
 
-    req = urllib.request.Request(
-        "https://api.anthropic.com/v1/messages",
-        data=payload,
-        headers={
-            "Content-Type":      "application/json",
-            "x-api-key":         api_key,
-            "anthropic-version": "2023-06-01"
-        },
-        method="POST"
-    )
+    wait = AURORA_IA_LIMITER.take(client_key())
+    if wait:
+        METRICS.inc("aurora_ia_requests_total", result="rate_limited")
+        resp = jsonify({"reply": AURORA_IA_SLOW_DOWN})
+        resp.headers["Retry-After"] = str(max(int(wait + 0.999), 1))
+        return resp, 429
+
+    if not _aurora_ia_slots.acquire(blocking=False):
+        METRICS.inc("aurora_ia_requests_total", result="busy")
+        return jsonify({"reply": AURORA_IA_FALLBACK}), 200
+
+    if stream:
+        resp = Response(aurora_ia_stream(api_key, messages, key), mimetype="text/event-stream")
+        resp.headers["Cache-Control"]     = "no-cache"
+        resp.headers["X-Accel-Buffering"] = "no"
+        resp.call_on_close(_aurora_ia_slots.release)
+        return resp
 
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            result = _json.loads(resp.read().decode("utf-8"))
-            return jsonify({"reply": result["content"][0]["text"]})
+        reply = aurora_ia_reply(api_key, messages)
+        if key:
+            AURORA_IA_CACHE.set(key, reply)
+        METRICS.inc("aurora_ia_requests_total", result="ok")
+        return jsonify({"reply": reply})
     except Exception as e:
-        print(f"❌ Aurora IA error: {e}")
-        return jsonify({"reply": "Sem conexão no momento. Ligue 180 ou 190 se precisar de ajuda urgente. 💜"}), 200
+        METRICS.inc("aurora_ia_requests_total", result="error")
+        log_event("aurora_ia_error", logging.ERROR, stream=False, error=str(e))
+        return jsonify({"reply": AURORA_IA_FALLBACK}), 200
+    finally:
+        _aurora_ia_slots.release()
 
 # ==========================================
 # ROTAS ADICIONAIS
@@ -721,33 +4698,33 @@ def aurora_ia_chat():
 
 @app.get("/pagamentos")
 def pagamentos():
-    return render_template("pagamentos.html")
+    return PAGES.response("pagamentos.html")
 
 @app.get("/recibo")
 @app.get("/recibo_entrega")
 def recibo():
-    return render_template("recibo_entrega.html")
+    return PAGES.response("recibo_entrega.html")
 
 @app.get("/central")
 @app.get("/central_aurora")
 def central():
-    alerts = get_all_alerts()
-    return render_template("central_aurora.html", alerts=alerts)
+    clients = get_all_clients() if session.get("role") == "admin" else {}
+    return render_template("central_aurora.html", clients=clients, **alert_page(_list_filters()))
 
 @app.get("/anual")
 @app.get("/manual")
 def anual():
-    return render_template("anual_aurora.html")
+    return PAGES.response("anual_aurora.html")
 
 @app.get("/confidant")
 @app.get("/panel_confidant")
 def panel_confidant():
-    return render_template("panel_confidant.html")
+    return PAGES.response("panel_confidant.html")
 
 @app.get("/aurora-ia")
 @app.get("/ia")
 def aurora_ia():
-    return render_template("aurora_ia.html")
+    return PAGES.response("aurora_ia.html")
 
 # /debug/users removido por segurança em produção
 
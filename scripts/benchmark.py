@@ -0,0 +1,474 @@
+"""Benchmark do fluxo de alertas com uma carga realista.
+
+Carga simulada, em paralelo:
+  - rajadas de /api/send_alert (--senders, --burst, --burst-pause)
+  - N painéis de confiança consultando /api/alerts a cada 3 s, com since_id
+    e If-None-Match como o panel_trusted.html (--panels, --poll-interval)
+  - admin abrindo /panel (--admins, --admin-interval)
+  - relatório em PDF: agenda em /relatorio/pdf e acompanha o job até o
+    download (--exports, --export-interval)
+
+Antes de medir, o diretório de dados recebe um alerts.log com --alerts
+linhas (1k, 100k, 1M...) em 30 dias, já rotacionado em segmentos como o
+app deixaria. Relata vazão e p50/p95/p99 por rota e, com
+--baseline, falha (código 1) se alguma rota piorar além da tolerância.
+
+Uso:
+    python scripts/benchmark.py --alerts 1000                      # Flask test client
+    python scripts/benchmark.py --sizes 1k,100k,1m --save-baseline bench.json
+    python scripts/benchmark.py --sizes 1k,100k,1m --baseline bench.json
+    python scripts/benchmark.py --sizes 1k,100k --duration 60 --baseline scripts/bench_baseline.json
+    python scripts/benchmark.py --server gunicorn --alerts 100000  # sobe o gunicorn do render.yaml
+    python scripts/benchmark.py --url http://127.0.0.1:5000        # servidor já rodando (sem seed)
+"""
+from __future__ import annotations
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ADMIN_USER     = "admin"
+ADMIN_PASSWORD = "admin123"
+SITUATIONS     = ["Emergência", "Violência física", "Ameaça", "Perseguição", "Violência psicológica"]
+
+# ==========================================
+# DADOS DE TESTE
+# ==========================================
+
+def parse_size(text):
+    text = text.strip().lower()
+    mult = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * mult)
+
+def client_ids(count):
+    return [f"BENCH{i:04d}" for i in range(count)]
+
+def seed_data_dir(data_dir, alerts, clients, days=30):
+    """Gera users.json, alerts.log e state.json com `alerts` linhas espalhadas em `days` dias."""
+    from werkzeug.security import generate_password_hash
+
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    users = {ADMIN_USER: {"password": generate_password_hash(ADMIN_PASSWORD), "role": "admin",
+                          "name": "Admin Aurora", "client_id": None}}
+    for cid in client_ids(clients):
+        users[f"__client__{cid}"] = {"role": "client", "name": f"Cliente {cid}", "client_id": cid,
+                                     "created_at": "2026-01-01 00:00:00", "password": ""}
+    (data_dir / "users.json").write_text(json.dumps(users, ensure_ascii=False), encoding="utf-8")
+
+    rnd   = random.Random(42)
+    ids   = client_ids(clients)
+    start = datetime.now() - timedelta(days=days)
+    step  = timedelta(days=days) / max(alerts, 1)
+    with open(data_dir / "alerts.log", "w", encoding="utf-8") as f:
+        for i in range(1, alerts + 1):
+            lat, lng = -15.79 + rnd.uniform(-8, 8), -47.88 + rnd.uniform(-8, 8)
+            f.write(json.dumps({
+                "id": i, "ts": (start + step * i).strftime("%Y-%m-%d %H:%M:%S"),
+                "name": f"Usuária {i % 997}", "situation": rnd.choice(SITUATIONS),
+                "message": "", "client_id": rnd.choice(ids) if rnd.random() < 0.9 else None,
+                "location": {"lat": lat, "lng": lng, "accuracy": 20},
+                "lat": lat, "lng": lng, "accuracy": 20, "ip": "127.0.0.1",
+            }, ensure_ascii=False) + "\n")
+    (data_dir / "state.json").write_text(json.dumps({"last_id": alerts}), encoding="utf-8")
+    settle_data_dir(data_dir)
+
+def settle_data_dir(data_dir):
+    """Rotaciona o log gerado como o app faria na virada de cada dia.
+
+    Sem isso a primeira rotação (30 dias de uma vez) cairia dentro da
+    medição e seguraria o lock de gravação por segundos.
+    """
+    env = dict(os.environ, RENDER_DATA_DIR=str(data_dir), AURORA_LOG_LEVEL="WARNING")
+    subprocess.run([sys.executable, "-c", "import app; app.STORAGE.rotate_if_needed()"],
+                   cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+# ==========================================
+# CLIENTES HTTP
+# ==========================================
+
+class InProcessClient:
+    """Flask test client (um por usuária virtual)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        resp = self.client.open(path, method=method, json=json_body, data=form, headers=headers or {})
+        body = resp.get_data()
+        resp.close()
+        return resp.status_code, resp.headers, body
+
+class HttpClient:
+    """Conexão keep-alive com cookie de sessão, para um servidor de verdade."""
+
+    def __init__(self, base_url, timeout=60):
+        parts        = urlsplit(base_url)
+        self.host    = parts.hostname
+        self.port    = parts.port or 80
+        self.timeout = timeout
+        self.cookie  = None
+        self.conn    = None
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            body = urlencode(form).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        cookie = resp.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        if resp.will_close:
+            self.conn.close()
+            self.conn = None
+        return resp.status, resp.headers, data
+
+# ==========================================
+# CENÁRIO
+# ==========================================
+
+class Recorder:
+    """Latências e status por rota, acumulados por todas as threads."""
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.samples = {}   # rota -> [segundos]
+        self.errors  = {}
+        self.shed    = {}
+
+    def call(self, route, client, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, headers, body = client.request(method, path, **kwargs)
+        except Exception:
+            status, headers, body = 0, {}, b""
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status in (429, 503):
+                self.shed[route] = self.shed.get(route, 0) + 1
+            elif status == 0 or status >= 500:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, headers, body
+
+def _paced(stop, interval, offset=0.0):
+    """Gera um tique a cada `interval` segundos (agenda fixa, sem acumular atraso)."""
+    next_at = time.monotonic() + offset
+    while not stop.is_set():
+        delay = next_at - time.monotonic()
+        if delay > 0 and stop.wait(delay):
+            return
+        yield
+        next_at += interval
+
+def panel_worker(rec, client, stop, cid, interval, offset, opened):
+    """Painel aberto: lista completa uma vez (fora da janela medida), depois deltas."""
+    since_id, etag = 0, None
+
+    def poll(route):
+        nonlocal since_id, etag
+        path = f"/api/alerts?token={cid}" + (f"&since_id={since_id}" if since_id else "")
+        status, headers, body = rec.call(route, client, "GET", path,
+                                         headers={"If-None-Match": etag} if etag else None)
+        if status == 200:
+            etag = headers.get("ETag")
+            alerts = json.loads(body or b"[]")
+            if alerts:
+                since_id = max(since_id, max(int(a.get("id") or 0) for a in alerts))
+
+    poll("GET /api/alerts (abertura)")
+    opened.wait()
+    for _ in _paced(stop, interval, offset):
+        poll("GET /api/alerts")
+
+def sender_worker(rec, client, stop, ids, burst, pause, seed):
+    rnd = random.Random(seed)
+    for _ in _paced(stop, pause, rnd.uniform(0, pause)):
+        for _ in range(burst):
+            rec.call("POST /api/send_alert", client, "POST", "/api/send_alert", json_body={
+                "name": "Bench", "situation": rnd.choice(SITUATIONS), "client_id": rnd.choice(ids),
+                "location": {"lat": -15.79 + rnd.uniform(-1, 1), "lng": -47.88 + rnd.uniform(-1, 1), "accuracy": 15},
+            })
+
+def admin_login(client):
+    client.request("POST", "/panel/login", form={"user": ADMIN_USER, "password": ADMIN_PASSWORD})
+
+def admin_worker(rec, client, stop, interval, offset):
+    admin_login(client)
+    for _ in _paced(stop, interval, offset):
+        rec.call("GET /panel", client, "GET", "/panel")
+
+def export_worker(rec, client, stop, interval, offset):
+    admin_login(client)
+    today = datetime.now().strftime("%Y-%m-%d")
+    for _ in _paced(stop, interval, offset):
+        # /relatorio/pdf só agenda o job (303); o PDF sai da fila de exportações
+        status, headers, _ = rec.call("GET /relatorio/pdf", client, "GET",
+                                      f"/relatorio/pdf?start={today}&end={today}")
+        if status != 303:
+            continue
+        job_id = headers.get("Location", "").rsplit("/", 1)[-1]
+        while not stop.is_set():
+            status, _, body = rec.call("GET /api/exports/<id>", client, "GET", f"/api/exports/{job_id}")
+            state = json.loads(body).get("state") if status == 200 else "error"
+            if state == "done":
+                rec.call("GET /api/exports/<id>/dl", client, "GET", f"/api/exports/{job_id}/download")
+            if state not in ("queued", "running"):
+                break
+            stop.wait(0.2)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[k]
+
+def run_scenario(make_client, args):
+    rec  = Recorder()
+    stop = threading.Event()
+    ids  = client_ids(args.clients)
+    threads = []
+
+    def spawn(target, *a):
+        threads.append(threading.Thread(target=target, args=(rec, make_client(), stop) + a, daemon=True))
+
+    # A abertura dos painéis (histórico inteiro do cliente) acontece antes
+    # da janela medida; senão os percentis medem a rajada de abertura, e não
+    # o regime de deltas/304
+    opened = threading.Barrier(args.panels + 1)
+    for i in range(args.panels):
+        spawn(panel_worker, ids[i % len(ids)], args.poll_interval, args.poll_interval * i / max(args.panels, 1), opened)
+    for i in range(args.senders):
+        spawn(sender_worker, ids, args.burst, args.burst_pause, i)
+    for i in range(args.admins):
+        spawn(admin_worker, args.admin_interval, args.admin_interval * i / max(args.admins, 1))
+    for i in range(args.exports):
+        spawn(export_worker, args.export_interval, args.export_interval * i / max(args.exports, 1))
+
+    panels, others = threads[:args.panels], threads[args.panels:]
+    for t in panels:
+        t.start()
+    opened.wait()
+    started = time.perf_counter()
+    for t in others:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=120)
+    wall = time.perf_counter() - started
+
+    routes = {}
+    for route, values in sorted(rec.samples.items()):
+        values.sort()
+        routes[route] = {
+            "count":  len(values),
+            "rps":    round(len(values) / wall, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "errors": rec.errors.get(route, 0),
+            "shed":   rec.shed.get(route, 0),
+        }
+    return routes
+
+# ==========================================
+# EXECUÇÃO
+# ==========================================
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_ready(client, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if client.request("GET", "/health")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("servidor não respondeu em /health")
+
+def _warmup(client):
+    """Primeira leitura completa do histórico (carga do AlertStore), medida à parte."""
+    start = time.perf_counter()
+    admin_login(client)
+    client.request("GET", "/api/alerts")
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def run_size(args, alerts):
+    """Roda o cenário para um tamanho de log; devolve o resultado em dict."""
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+        return {"warmup_ms": _warmup(make_client()), "routes": run_scenario(make_client, args)}
+
+    data_dir = Path(tempfile.mkdtemp(prefix=f"aurora-bench-{alerts}-"))
+    seed_data_dir(data_dir, alerts, args.clients)
+
+    if args.server == "gunicorn":
+        port = _free_port()
+        env  = dict(os.environ, RENDER_DATA_DIR=str(data_dir))
+        if args.workers > 1:
+            env.setdefault("AURORA_BUS", "unix")
+        proc = subprocess.Popen(
+            ["gunicorn", "app:app", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+             "--worker-class", "gthread", "--threads", str(args.threads), "--timeout", "120"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            make_client = lambda: HttpClient(f"http://127.0.0.1:{port}")
+            _wait_ready(make_client())
+            return {"warmup_ms": _warmup(make_client()), "routes": run_scenario(make_client, args)}
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    # Test client: o app lê RENDER_DATA_DIR na importação, então cada
+    # tamanho roda num processo novo
+    cmd = [sys.executable, __file__, "--in-process-child", str(data_dir)] + _scenario_argv(args)
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _scenario_argv(args):
+    return ["--duration", str(args.duration), "--clients", str(args.clients),
+            "--panels", str(args.panels), "--poll-interval", str(args.poll_interval),
+            "--senders", str(args.senders), "--burst", str(args.burst), "--burst-pause", str(args.burst_pause),
+            "--admins", str(args.admins), "--admin-interval", str(args.admin_interval),
+            "--exports", str(args.exports), "--export-interval", str(args.export_interval)]
+
+def in_process_child(args):
+    os.environ["RENDER_DATA_DIR"] = args.in_process_child
+    os.environ.setdefault("AURORA_LOG_LEVEL", "WARNING")
+    sys.path.insert(0, str(ROOT))
+    from app import app
+
+    make_client = lambda: InProcessClient(app)
+    result = {"warmup_ms": _warmup(make_client()), "routes": run_scenario(make_client, args)}
+    print(json.dumps(result))
+
+def print_report(size, result):
+    print(f"\n== {size} alertas — carga inicial {result['warmup_ms']} ms")
+    print(f"{'rota':<28}{'n':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'erros':>7}{'429/503':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:<28}{r['count']:>7}{r['rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+              f"{r['p99_ms']:>10}{r['errors']:>7}{r['shed']:>9}")
+
+def compare(baseline, results, tolerance, min_ms, min_samples=20):
+    """Lista de regressões: p95/p99 acima da tolerância, erros novos ou rota sem vazão.
+
+    Percentis só são comparados em rotas com pelo menos min_samples
+    amostras nas duas execuções (p99 exige 5x isso); abaixo disso é ruído.
+    """
+    problems = []
+    for size, result in results.items():
+        base = baseline.get("sizes", {}).get(size)
+        if not base:
+            continue
+        for route, b in base["routes"].items():
+            r = result["routes"].get(route)
+            if r is None or not r["count"]:
+                problems.append(f"{size} {route}: sem requisições")
+                continue
+            for key, needed in (("p95_ms", min_samples), ("p99_ms", min_samples * 5)):
+                if min(r["count"], b["count"]) < needed:
+                    continue
+                limit = max(b[key] * (1 + tolerance), b[key] + min_ms)
+                if r[key] > limit:
+                    problems.append(f"{size} {route}: {key} {r[key]} > {limit:.2f} (baseline {b[key]})")
+            if r["errors"] > b["errors"]:
+                problems.append(f"{size} {route}: {r['errors']} erros (baseline {b['errors']})")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alerts", default="1k", help="linhas no alerts.log (ex.: 1000, 100k, 1m)")
+    parser.add_argument("--sizes", help="vários tamanhos separados por vírgula (ex.: 1k,100k,1m)")
+    parser.add_argument("--server", choices=["inprocess", "gunicorn"], default="inprocess")
+    parser.add_argument("--url", help="servidor já rodando; não gera dados")
+    parser.add_argument("--threads", type=int, default=64, help="threads do gunicorn (--server gunicorn)")
+    parser.add_argument("--workers", type=int, default=1, help="workers do gunicorn (--server gunicorn)")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--panels", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=3)
+    parser.add_argument("--senders", type=int, default=2)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--burst-pause", type=float, default=5)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--admin-interval", type=float, default=5)
+    parser.add_argument("--exports", type=int, default=1)
+    parser.add_argument("--export-interval", type=float, default=10)
+    parser.add_argument("--json", help="grava o resultado neste arquivo")
+    parser.add_argument("--baseline", help="compara com este resultado salvo e falha se piorar")
+    parser.add_argument("--save-baseline", help="grava o resultado como baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="piora relativa aceita (0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=5, help="piora absoluta sempre aceita, em ms")
+    parser.add_argument("--in-process-child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.in_process_child:
+        in_process_child(args)
+        return 0
+
+    sizes   = [s for s in (args.sizes or args.alerts).split(",") if s.strip()]
+    results = {}
+    for size in sizes:
+        key = "url" if args.url else str(parse_size(size))
+        results[key] = run_size(args, parse_size(size))
+        print_report(key, results[key])
+        if args.url:
+            break
+
+    report = {"server": "url" if args.url else args.server, "scenario": _scenario_argv(args), "sizes": results}
+    for path in filter(None, [args.json, args.save_baseline]):
+        Path(path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        problems = compare(baseline, results, args.tolerance, args.min_ms)
+        if baseline.get("scenario") != report["scenario"] or baseline.get("server") != report["server"]:
+            problems.insert(0, "cenário diferente do baseline (rode com os mesmos parâmetros: "
+                               + " ".join(baseline.get("scenario", [])) + ")")
+        if problems:
+            print("\n❌ Regressões em relação ao baseline:")
+            for p in problems:
+                print(f"  - {p}")
+            return 1
+        print("\n✅ Sem regressões em relação ao baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
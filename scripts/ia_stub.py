@@ -0,0 +1,78 @@
+"""Upstream falso da API de mensagens, para testar a Aurora IA localmente.
+
+Uso:
+    python scripts/ia_stub.py --port 8089 --delay 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=teste python app.py
+
+Responde POST /v1/messages no formato da API (JSON ou SSE com "stream": true),
+mantendo a conexão aberta (keep-alive) para exercitar o pool do app.
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("Olá, eu sou a Aurora IA (resposta de teste). Se estiver em perigo "
+         "imediato, ligue 190 ou 180.")
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/messages":
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        question = ""
+        if body.get("messages"):
+            question = str(body["messages"][-1].get("content", ""))[:60]
+        reply = f"{REPLY} Você perguntou: {question}"
+
+        if not body.get("stream"):
+            time.sleep(self.delay)
+            data = json.dumps({"content": [{"type": "text", "text": reply}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk('event: message_start\ndata: {"type": "message_start"}\n\n')
+        for word in reply.split(" "):
+            time.sleep(self.delay)
+            event = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": word + " "}}
+            self._chunk(f"event: content_block_delta\ndata: {json.dumps(event)}\n\n")
+        self._chunk('event: message_stop\ndata: {"type": "message_stop"}\n\n')
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.05, help="segundos entre tokens")
+    args = parser.parse_args()
+    StubHandler.delay = args.delay
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"🤖 Stub da Aurora IA em http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -53,75 +53,226 @@ document.addEventListener("DOMContentLoaded", function () {
         });
     });
 
-    // GPS
-    async function getCurrentLocation() {
+    // GPS em paralelo: watchPosition começa ao apertar o botão e segue
+    // refinando a posição enquanto o alerta já está sendo enviado
+    const TRACK_MIN_METERS = 15;          // deslocamento mínimo para mandar um ponto novo
+    const TRACK_MIN_INTERVAL_MS = 3000;   // intervalo mínimo entre pontos
+    const TRACK_HEARTBEAT_MS = 30000;     // parado: reenvia a posição a cada 30 s
+    const TRACK_MAX_MS = 60 * 60 * 1000;  // mesmo limite do servidor (AURORA_TRACK_WINDOW)
+    const FIX_WAIT_MS = 2 * 60 * 1000;    // alerta sem posição: espera o primeiro fix por até 2 min
+
+    let gpsWatchId = null;
+    let tracking = null;     // { id, token, last, sentAt, until }
+    let pendingFix = null;   // { payload, timer } — alerta que saiu sem posição e sem track_token
+    let sending = false;
+
+    function startGps() {
+        if (gpsWatchId !== null) return;
         if (!elements.shareLocation || !elements.shareLocation.checked) {
             console.log("⚠️ Localização não autorizada");
-            return null;
+            return;
         }
-
         if (!navigator.geolocation) {
             console.error("❌ GPS não suportado");
             showGpsStatus("GPS não suportado neste dispositivo", "poor");
-            return null;
+            return;
         }
-
-        try {
-            showGpsStatus("Obtendo localização...");
-
-            const position = await new Promise((resolve, reject) => {
-                navigator.geolocation.getCurrentPosition(resolve, reject, {
-                    enableHighAccuracy: true,
-                    timeout: 10000,
-                    maximumAge: 0
-                });
-            });
-
+        showGpsStatus("Obtendo localização...");
+        gpsWatchId = navigator.geolocation.watchPosition(position => {
             currentLocation = {
                 lat: position.coords.latitude,
                 lng: position.coords.longitude,
                 accuracy: Math.round(position.coords.accuracy)
             };
-
-            console.log("✅ Localização obtida:", currentLocation);
             showGpsStatus(`GPS obtido ±${currentLocation.accuracy}m`, "good");
-            return currentLocation;
-
-        } catch (error) {
+            if (pendingFix) resendWithLocation(currentLocation);
+            sendTrackPoint(currentLocation);
+        }, error => {
             console.error("❌ Erro GPS:", error);
             showGpsStatus("Erro ao capturar GPS", "poor");
-            return null;
+            if (error.code === error.PERMISSION_DENIED) stopGps();
+        }, {
+            enableHighAccuracy: true,
+            timeout: 60000,
+            maximumAge: 30000
+        });
+    }
+
+    function stopGps() {
+        if (gpsWatchId !== null) navigator.geolocation.clearWatch(gpsWatchId);
+        gpsWatchId = null;
+        tracking = null;
+        if (pendingFix) clearTimeout(pendingFix.timer);
+        pendingFix = null;
+    }
+
+    function distanceMeters(a, b) {
+        const rad = Math.PI / 180;
+        const dLat = (b.lat - a.lat) * rad;
+        const dLng = (b.lng - a.lng) * rad;
+        const h = Math.sin(dLat / 2) ** 2 + Math.cos(a.lat * rad) * Math.cos(b.lat * rad) * Math.sin(dLng / 2) ** 2;
+        return 2 * 6371000 * Math.asin(Math.sqrt(h));
+    }
+
+    // Segunda fase: cada posição nova vai para o trajeto do alerta já enviado
+    function sendTrackPoint(location) {
+        if (!tracking || !location) return;
+        const now = Date.now();
+        if (now > tracking.until) {
+            stopGps();
+            return;
         }
+        const last = tracking.last;
+        if (last) {
+            const moved = distanceMeters(last, location) >= TRACK_MIN_METERS;
+            const sharper = location.accuracy < last.accuracy / 2;
+            const stale = now - tracking.sentAt >= TRACK_HEARTBEAT_MS;
+            if (now - tracking.sentAt < TRACK_MIN_INTERVAL_MS || !(moved || sharper || stale)) return;
+        }
+        const current = tracking;
+        current.last = location;
+        current.sentAt = now;
+        fetch(`/api/alerts/${current.id}/location`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json", "X-Track-Token": current.token },
+            body: JSON.stringify(location)
+        }).then(response => {
+            // 403/404/410: rastreamento encerrado no servidor
+            if ([403, 404, 410].includes(response.status) && tracking === current) stopGps();
+        }).catch(err => console.warn("📴 Ponto de trajeto não enviado:", err));
+    }
+
+    function startTracking(result, sentLocation) {
+        if (!result || !result.id || !result.track_token || gpsWatchId === null) return false;
+        tracking = {
+            id: result.id,
+            token: result.track_token,
+            last: sentLocation,
+            sentAt: sentLocation ? Date.now() : 0,
+            until: Date.now() + TRACK_MAX_MS
+        };
+        // A posição pode ter chegado enquanto o alerta era enviado
+        if (currentLocation && currentLocation !== sentLocation) sendTrackPoint(currentLocation);
+        return true;
+    }
+
+    // Sem track_token (servidor sem SECRET_KEY, resposta 202 "pending" ou
+    // SOS na fila offline) e sem posição no envio: o GPS continua ligado e o
+    // primeiro fix vai num reenvio com a mesma chave de idempotência, que o
+    // servidor aplica ao alerta original em vez de gravar outro
+    function waitForFix(payload) {
+        if (gpsWatchId === null) return;
+        const timer = setTimeout(() => {
+            if (pendingFix && pendingFix.timer === timer) {
+                pendingFix = null;
+                if (!tracking && !isHolding) stopGps();
+            }
+        }, FIX_WAIT_MS);
+        pendingFix = { payload: payload, timer: timer };
+        // O fix pode ter chegado enquanto o primeiro envio estava no ar
+        if (currentLocation) resendWithLocation(currentLocation);
+    }
+
+    function resendWithLocation(location) {
+        const pending = pendingFix;
+        clearTimeout(pending.timer);
+        pendingFix = null;
+        const payload = Object.assign({}, pending.payload, { location: location });
+        fetch("/api/send_alert", {
+            method: "POST",
+            headers: { "Content-Type": "application/json", "Idempotency-Key": payload.idempotency_key },
+            body: JSON.stringify(payload)
+        }).then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        }).then(result => {
+            startTracking(result, location);
+        }).catch(() => queueAlertOffline(payload)).finally(() => {
+            if (!tracking && !pendingFix && !isHolding) stopGps();
+        });
+    }
+
+    // Fila offline: o service worker guarda o SOS e reenvia quando a rede voltar
+    function newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + "-" + Math.random().toString(36).slice(2, 14);
+    }
+
+    function queueAlertOffline(payload) {
+        if (!("serviceWorker" in navigator)) return Promise.resolve(false);
+        const timeout = new Promise(resolve => setTimeout(() => resolve(null), 3000));
+        return Promise.race([navigator.serviceWorker.ready, timeout]).then(reg => {
+            if (!reg || !reg.active) return false;
+            return new Promise(resolve => {
+                const channel = new MessageChannel();
+                channel.port1.onmessage = e => resolve(Boolean(e.data && e.data.ok));
+                reg.active.postMessage({ type: "QUEUE_ALERT", payload: payload }, [channel.port2]);
+                setTimeout(() => resolve(false), 3000);
+            });
+        }).catch(() => false);
+    }
+
+    if ("serviceWorker" in navigator) {
+        navigator.serviceWorker.register("/static/js/sw.js", { scope: "/" })
+            .catch(err => console.error("❌ Erro SW:", err));
+
+        navigator.serviceWorker.addEventListener("message", event => {
+            if (event.data && event.data.type === "ALERT_SENT" && event.data.ok) {
+                showStatus("✅ ALERTA PENDENTE ENVIADO!", "success");
+            }
+        });
+
+        // Navegadores sem Background Sync: reenvia quando a conexão voltar
+        window.addEventListener("online", () => {
+            navigator.serviceWorker.ready.then(reg => reg.active && reg.active.postMessage({ type: "FLUSH_ALERTS" }));
+        });
     }
 
     // Enviar alerta
     async function sendSOSAlert() {
+        sending = true;
         try {
             if (!selectedSituation) {
                 showStatus("⚠️ Selecione a situação", "error");
                 return false;
             }
 
-            showStatus("⏳ Preparando alerta...", "info");
-
-            const location = await getCurrentLocation();
+            // Não espera o GPS: vai com a última posição conhecida (ou nenhuma)
+            startGps();
+            const location = currentLocation;
 
             const payload = {
                 name: elements.name ? (elements.name.value.trim() || "Usuária") : "Usuária",
                 situation: selectedSituation,
                 message: elements.message ? elements.message.value.trim() : "",
                 location: location,
-                timestamp: new Date().toISOString()
+                timestamp: new Date().toISOString(),
+                idempotency_key: newIdempotencyKey()
             };
 
             console.log("📤 Enviando:", payload);
             showStatus("📤 Enviando...", "info");
 
-            const response = await fetch("/api/send_alert", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(payload)
-            });
+            let response = null;
+            try {
+                response = await fetch("/api/send_alert", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json", "Idempotency-Key": payload.idempotency_key },
+                    body: JSON.stringify(payload)
+                });
+            } catch (networkError) {
+                console.warn("📴 Falha de rede:", networkError);
+            }
+
+            // Sem rede ou servidor indisponível: entrega para a fila do service worker
+            if (!response || response.status >= 500 || response.status === 408 || response.status === 429) {
+                if (await queueAlertOffline(payload)) {
+                    showStatus("📴 Sem conexão. O alerta foi salvo e será enviado automaticamente. Em perigo, ligue 190.", "error");
+                    if (!location) waitForFix(payload);
+                    return false;
+                }
+                throw new Error(response ? `HTTP ${response.status}` : "sem conexão");
+            }
 
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
@@ -130,6 +281,7 @@ document.addEventListener("DOMContentLoaded", function () {
             const result = await response.json();
             console.log("✅ Enviado:", result);
             showStatus("✅ ALERTA ENVIADO COM SUCESSO!", "success");
+            if (!startTracking(result, location) && !location) waitForFix(payload);
 
             if (elements.sos) {
                 elements.sos.classList.add("sent");
@@ -142,6 +294,9 @@ document.addEventListener("DOMContentLoaded", function () {
             console.error("❌ Erro:", error);
             showStatus(`❌ Erro ao enviar: ${error.message}`, "error");
             return false;
+        } finally {
+            sending = false;
+            if (!tracking && !pendingFix && !isHolding) stopGps();
         }
     }
 
@@ -151,6 +306,7 @@ document.addEventListener("DOMContentLoaded", function () {
         if (isHolding) return;
 
         isHolding = true;
+        startGps();   // o GPS já trabalha durante o segundo de espera
         if (elements.sos) elements.sos.classList.add("holding");
         showStatus("⚠️ Segure por 1 segundo...", "info");
 
@@ -170,6 +326,8 @@ document.addEventListener("DOMContentLoaded", function () {
 
         if (elements.sos) elements.sos.classList.remove("holding");
         isHolding = false;
+        // Desistiu antes de enviar: não deixa o GPS ligado
+        if (!sending && !tracking && !pendingFix) stopGps();
 
         // Only reset status if alert was not successfully sent
         if (elements.status && !elements.status.textContent.includes("✅")) {
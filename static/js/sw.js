@@ -3,7 +3,7 @@
 // Single consolidated SW (replaces service-worker.js + sw.js)
 // ============================================
 
-const CACHE_VERSION = "aurora-v3";
+const CACHE_VERSION = "aurora-__ASSET_VERSION__";  // hash dos assets, preenchido pelo servidor
 const STATIC_CACHE = `${CACHE_VERSION}-static`;
 const DYNAMIC_CACHE = `${CACHE_VERSION}-dynamic`;
 
@@ -16,6 +16,13 @@ const STATIC_ASSETS = [
     "/static/manifest.json"
 ];
 
+// Páginas públicas que podem ficar no cache para uso offline; painéis e
+// histórico (com login) nunca são guardados no aparelho
+const OFFLINE_PAGES = [
+    "/", "/panic", "/ajuda", "/plano-seguranca", "/plano_seguranca", "/saida-rapida",
+    "/saida_rapida", "/legal", "/offline", "/termo", "/termo_responsabilidade"
+];
+
 // Install — cache static assets
 self.addEventListener("install", event => {
     console.log("🛠️ Aurora SW v3.1 — instalando...");
@@ -72,8 +79,10 @@ self.addEventListener("fetch", event => {
         event.respondWith(
             fetch(request)
                 .then(response => {
-                    const clone = response.clone();
-                    caches.open(DYNAMIC_CACHE).then(cache => cache.put(request, clone));
+                    if (response.ok && OFFLINE_PAGES.includes(url.pathname)) {
+                        const clone = response.clone();
+                        caches.open(DYNAMIC_CACHE).then(cache => cache.put(request, clone));
+                    }
                     return response;
                 })
                 .catch(() =>
@@ -104,22 +113,95 @@ self.addEventListener("fetch", event => {
     );
 });
 
-// Background sync for queued alerts
+// ============================================
+// FILA OFFLINE DE SOS (IndexedDB + Background Sync)
+// ============================================
+// A página entrega aqui o SOS que não conseguiu enviar. Ele fica no
+// IndexedDB até o servidor confirmar; o reenvio usa a mesma
+// idempotency_key, então o servidor grava o alerta uma única vez.
+
+const ALERT_DB = "aurora-alerts";
+const OUTBOX = "outbox";
+const ALERT_MAX_AGE_MS = 24 * 60 * 60 * 1000;  // mesmo TTL da deduplicação no servidor
+
+function openAlertDb() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(ALERT_DB, 1);
+        request.onupgradeneeded = () =>
+            request.result.createObjectStore(OUTBOX, { keyPath: "idempotency_key" });
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function outbox(mode, action) {
+    return openAlertDb().then(db => new Promise((resolve, reject) => {
+        const tx = db.transaction(OUTBOX, mode);
+        const request = action(tx.objectStore(OUTBOX));
+        tx.oncomplete = () => { db.close(); resolve(request.result); };
+        tx.onerror = tx.onabort = () => { db.close(); reject(tx.error); };
+    }));
+}
+
+function notifyClients(message) {
+    return self.clients.matchAll({ includeUncontrolled: true }).then(clients =>
+        clients.forEach(client => client.postMessage(message))
+    );
+}
+
+async function queueAlert(payload) {
+    await outbox("readwrite", store => store.put({ ...payload, queued_at: Date.now() }));
+    if (self.registration.sync) {
+        await self.registration.sync.register("sync-alerts").catch(() => null);
+    }
+}
+
+// Rejeita enquanto sobrar alerta pendente: o Background Sync tenta de novo
+async function flushAlerts() {
+    const queued = await outbox("readonly", store => store.getAll());
+    for (const item of queued) {
+        const { queued_at, ...payload } = item;
+        if (Date.now() - queued_at > ALERT_MAX_AGE_MS) {
+            await outbox("readwrite", store => store.delete(item.idempotency_key));
+            continue;
+        }
+        const response = await fetch("/api/send_alert", {
+            method: "POST",
+            credentials: "same-origin",
+            headers: { "Content-Type": "application/json", "Idempotency-Key": item.idempotency_key },
+            body: JSON.stringify(payload)
+        });
+        // 5xx, 408 e 429 são temporários; outros 4xx nunca vão passar
+        if (response.status >= 500 || response.status === 408 || response.status === 429) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        await outbox("readwrite", store => store.delete(item.idempotency_key));
+        const result = response.ok ? await response.json().catch(() => ({})) : {};
+        await notifyClients({ type: "ALERT_SENT", ok: response.ok, id: result.id, queued_at: queued_at });
+    }
+}
+
 self.addEventListener("sync", event => {
     if (event.tag === "sync-alerts") {
-        event.waitUntil(
-            self.clients.matchAll().then(clients =>
-                clients.forEach(client =>
-                    client.postMessage({ type: "SYNC_ALERTS", timestamp: Date.now() })
-                )
-            )
-        );
+        event.waitUntil(flushAlerts());
     }
 });
 
 // Message handler
 self.addEventListener("message", event => {
-    if (event.data && event.data.type === "SKIP_WAITING") {
+    const data = event.data || {};
+    if (data.type === "SKIP_WAITING") {
         self.skipWaiting();
+    } else if (data.type === "QUEUE_ALERT") {
+        // Responde pela MessageChannel assim que o alerta estiver no IndexedDB
+        const reply = event.ports[0];
+        event.waitUntil(
+            queueAlert(data.payload)
+                .then(() => reply && reply.postMessage({ ok: true }))
+                .catch(err => reply && reply.postMessage({ ok: false, error: String(err) }))
+                .then(() => flushAlerts().catch(() => null))
+        );
+    } else if (data.type === "FLUSH_ALERTS") {
+        event.waitUntil(flushAlerts().catch(() => null));
     }
 });
@@ -0,0 +1,56 @@
+"""Fixtures comuns: o app é importado uma vez, com uma pasta de dados temporária.
+
+app.py lê RENDER_DATA_DIR, SECRET_KEY e os limites na importação, então o
+ambiente é montado aqui antes do import. Cada teste começa com o histórico
+de alertas vazio.
+"""
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+os.environ["RENDER_DATA_DIR"]  = tempfile.mkdtemp(prefix="aurora-tests-")
+os.environ["SECRET_KEY"]       = "tests-" + "k" * 32
+os.environ["AURORA_LOG_LEVEL"] = "WARNING"
+os.environ.pop("AURORA_STORAGE", None)
+os.environ.pop("AURORA_BUS", None)
+sys.path.insert(0, str(ROOT))
+
+import app as aurora  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def empty_history():
+    aurora.clear_alerts()
+    yield
+    aurora.clear_alerts()
+
+
+@pytest.fixture
+def client():
+    return aurora.app.test_client()
+
+
+@pytest.fixture
+def admin():
+    client = aurora.app.test_client()
+    with client.session_transaction() as session:
+        session["role"] = "admin"
+    return client
+
+
+@pytest.fixture
+def idempotency_key():
+    # O índice de chaves em memória sobrevive ao clear_alerts: uma por teste
+    return f"test-{uuid.uuid4().hex}"
+
+
+def send(client, **body):
+    """POST /api/send_alert; devolve (status, json)."""
+    resp = client.post("/api/send_alert", json=body)
+    return resp.status_code, resp.get_json()
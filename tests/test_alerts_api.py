@@ -0,0 +1,104 @@
+"""Leitura de alertas pelos painéis: delta por since_id, 304 e limites de SSE/long-poll."""
+import pytest
+
+from conftest import aurora, send
+
+
+def get_alerts(client, query="", etag=None):
+    return client.get("/api/alerts" + query, headers={"If-None-Match": etag} if etag else {})
+
+
+def test_since_id_returns_only_newer(client):
+    first = [send(client, client_id="C1")[1]["id"] for _ in range(3)]
+    newer = send(client, client_id="C1")[1]["id"]
+    send(client, client_id="C2")
+
+    resp = get_alerts(client, f"?token=C1&since_id={first[-1]}")
+    assert [a["id"] for a in resp.get_json()] == [newer]
+
+
+def test_since_id_ahead_of_history_starts_over(client):
+    # Cursor de outro histórico (banco novo, restauração): recomeça do zero
+    sent = [send(client, client_id="C1")[1]["id"] for _ in range(2)]
+    resp = get_alerts(client, "?token=C1&since_id=999999")
+    assert [a["id"] for a in resp.get_json()] == sent
+
+
+def test_unchanged_poll_is_304(client):
+    send(client, client_id="C1")
+    etag = get_alerts(client, "?token=C1").headers["ETag"]
+
+    resp = get_alerts(client, "?token=C1", etag)
+    assert resp.status_code == 304 and resp.data == b""
+
+
+def test_new_alert_or_track_point_changes_etag(client):
+    _, body = send(client, client_id="C1")
+    etag = get_alerts(client, "?token=C1").headers["ETag"]
+
+    client.post(f"/api/alerts/{body['id']}/location", json={"lat": 1, "lng": 2},
+                headers={"X-Track-Token": body["track_token"]})
+    resp = get_alerts(client, "?token=C1", etag)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+
+    send(client, client_id="C1")
+    assert get_alerts(client, "?token=C1", etag).status_code == 200
+
+
+def test_etag_does_not_depend_on_process_state(client):
+    send(client, client_id="C1")
+    etag = get_alerts(client, "?token=C1").headers["ETag"]
+    # Outro worker (ou este depois de reiniciar) monta o índice do zero
+    aurora.ALERT_STORE.clear()
+    assert get_alerts(client, "?token=C1", etag).status_code == 304
+
+
+def test_alerts_without_scope_are_empty(client):
+    send(client, client_id="C1")
+    resp = get_alerts(client)
+    assert resp.status_code == 200 and resp.get_json() == []
+
+
+@pytest.fixture
+def no_free_slots():
+    """Ocupa todas as vagas de SSE e long-poll deste worker."""
+    taken = []
+    for slots, count in ((aurora._alert_stream_slots, aurora.ALERT_MAX_STREAMS),
+                         (aurora._alert_poll_slots, aurora.ALERT_MAX_POLLS)):
+        for _ in range(count):
+            assert slots.acquire(blocking=False)
+            taken.append(slots)
+    yield
+    for slots in taken:
+        slots.release()
+
+
+def test_long_poll_over_capacity_is_503(admin, no_free_slots):
+    resp = admin.get("/api/alerts/poll?timeout=0")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(aurora.ALERT_POLL_RETRY_AFTER)
+
+
+def test_stream_over_capacity_is_503(admin, no_free_slots):
+    resp = admin.get("/api/alerts/stream")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(aurora.ALERT_STREAM_RETRY_AFTER)
+
+
+def test_fallback_poll_still_works_at_capacity(admin, no_free_slots):
+    # O painel recusado cai no /api/alerts?since_id=, que não ocupa vaga
+    sent = send(admin, client_id="C1")[1]["id"]
+    resp = get_alerts(admin, f"?since_id={sent - 1}")
+    assert [a["id"] for a in resp.get_json()] == [sent]
+
+
+def test_long_poll_returns_pending_alert_and_frees_slot(admin):
+    sent = send(admin, client_id="C1")[1]["id"]
+    resp = admin.get(f"/api/alerts/poll?since_id={sent - 1}&timeout=1")
+    assert [a["id"] for a in resp.get_json()] == [sent]
+    # A vaga volta ao semáforo depois da resposta
+    for _ in range(aurora.ALERT_MAX_POLLS):
+        assert aurora._alert_poll_slots.acquire(blocking=False)
+    for _ in range(aurora.ALERT_MAX_POLLS):
+        aurora._alert_poll_slots.release()
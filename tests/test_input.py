@@ -0,0 +1,79 @@
+"""Entrada malformada: corpo, client_id e posições inválidos não derrubam gravação nem leitura."""
+import json
+
+import pytest
+
+from conftest import aurora, send
+
+
+@pytest.mark.parametrize("raw", ["[1, 2]", '"texto"', "null", "{quebrado", ""])
+def test_send_accepts_any_body(client, raw):
+    resp = client.post("/api/send_alert", data=raw, content_type="application/json")
+    assert resp.status_code == 200
+    alert = aurora.ALERT_STORE.get(resp.get_json()["id"])
+    assert alert["situation"] == "Emergência" and alert["client_id"] is None
+
+
+@pytest.mark.parametrize("value, stored", [
+    (["C1"], None),
+    ({"id": "C1"}, None),
+    (True, None),
+    (123, "123"),
+    ("  C1  ", "C1"),
+    ("x" * 500, "x" * 64),
+])
+def test_client_id_is_normalized(client, value, stored):
+    _, body = send(client, client_id=value)
+    assert aurora.ALERT_STORE.get(body["id"])["client_id"] == stored
+    # Leituras seguintes continuam funcionando
+    assert any(a["id"] == body["id"] for a in aurora.get_all_alerts())
+
+
+def test_empty_token_has_no_scope(client):
+    send(client, client_id="C1")
+    resp = client.get("/api/alerts", query_string={"token": ""})
+    assert resp.get_json() == []
+
+
+@pytest.mark.parametrize("location", ["-15,-47", [1, 2], {"lat": "abc", "lng": None}, {"lat": 91, "lng": 0}])
+def test_bad_location_is_not_indexed(client, admin, location):
+    _, body = send(client, client_id="C1", location=location)
+    assert aurora.ALERT_STORE.get(body["id"]) is not None
+    assert admin.get("/api/alerts/near?lat=-15.79&lng=-47.88&radius_km=50").get_json() == []
+    assert admin.get("/panel").status_code == 200
+
+
+@pytest.mark.parametrize("point, status", [
+    ('{"lat": -15.8, "lng": -47.9, "accuracy": Infinity}', 200),
+    ('{"lat": -15.8, "lng": -47.9, "accuracy": "abc"}', 200),
+    ('{"lat": NaN, "lng": -47.9}', 400),
+    ('{"lat": "x", "lng": -47.9}', 400),
+    ('{"lat": 200, "lng": -47.9}', 400),
+    ("[]", 400),
+])
+def test_track_point_validation(client, point, status):
+    _, body = send(client, client_id="C1")
+    resp = client.post(f"/api/alerts/{body['id']}/location", data=point, content_type="application/json",
+                       headers={"X-Track-Token": body["track_token"]})
+    assert resp.status_code == status
+    if status == 200:
+        assert aurora.ALERT_STORE.get(body["id"])["accuracy"] is None
+
+
+def test_near_rejects_bad_coordinates(admin):
+    assert admin.get("/api/alerts/near?lat=abc&lng=1").status_code == 400
+    assert admin.get("/api/alerts/near?lat=nan&lng=1").status_code == 400
+
+
+def test_malformed_stored_lines_are_skipped(client):
+    _, body = send(client, client_id="C1")
+    bad_id = aurora.STORAGE.ids.next()
+    with aurora.STORAGE._exclusive(), aurora.ALERTS_FILE.open("a", encoding="utf-8") as f:
+        f.write("isto não é json\n")
+        f.write(json.dumps({"id": "sem-numero", "client_id": "C1"}) + "\n")
+        f.write(json.dumps({"id": bad_id, "client_id": ["C1"], "idempotency_key": {"k": 1}}) + "\n")
+
+    aurora.ALERT_STORE.clear()
+    assert [a["id"] for a in aurora.get_all_alerts()] == [body["id"], bad_id]
+    assert aurora.ALERT_STORE.get(bad_id)["client_id"] is None
+    assert send(client, client_id="C1")[1]["id"] == bad_id + 1
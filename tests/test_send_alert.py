@@ -0,0 +1,91 @@
+"""Envio do SOS: gravação, deduplicação por chave de idempotência e trajeto."""
+import threading
+
+from conftest import aurora, send
+
+
+def test_send_stores_alert(client):
+    status, body = send(client, name="Maria", situation="Ameaça", client_id="C1",
+                        location={"lat": -15.79, "lng": -47.88, "accuracy": 12})
+    assert status == 200 and body["ok"]
+
+    alert = aurora.ALERT_STORE.get(body["id"])
+    assert alert["name"] == "Maria"
+    assert alert["client_id"] == "C1"
+    assert (alert["lat"], alert["lng"], alert["accuracy"]) == (-15.79, -47.88, 12)
+    assert body["track_token"] == aurora.track_token(alert)
+
+
+def test_ids_are_sequential(client):
+    ids = [send(client, client_id="C1")[1]["id"] for _ in range(3)]
+    assert ids == list(range(ids[0], ids[0] + 3))
+
+
+def test_same_key_returns_original(client, idempotency_key):
+    _, first = send(client, idempotency_key=idempotency_key, situation="Ameaça")
+    resp = client.post("/api/send_alert", json={"situation": "Ameaça"},
+                       headers={"Idempotency-Key": idempotency_key})
+    again = resp.get_json()
+
+    assert again["duplicate"] is True
+    assert again["id"] == first["id"]
+    assert resp.headers["Idempotent-Replayed"] == "true"
+    assert len(aurora.get_all_alerts()) == 1
+
+
+def test_concurrent_resends_store_once(idempotency_key):
+    results = []
+
+    def resend():
+        results.append(send(aurora.app.test_client(), idempotency_key=idempotency_key)[1]["id"])
+
+    threads = [threading.Thread(target=resend) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(results)) == 1
+    assert [a["id"] for a in aurora.get_all_alerts()] == results[:1]
+
+
+def test_key_survives_restart(client, idempotency_key):
+    _, first = send(client, idempotency_key=idempotency_key)
+    # Outro processo (ou o mesmo depois de reiniciar) só tem o armazenamento
+    aurora.IDEMPOTENCY._data.clear()
+    aurora.ALERT_STORE.clear()
+    _, again = send(client, idempotency_key=idempotency_key)
+    assert again["duplicate"] is True and again["id"] == first["id"]
+
+
+def test_malformed_key_is_ignored(client):
+    ids = {send(client, idempotency_key="curta")[1]["id"] for _ in range(2)}
+    assert len(ids) == 2
+
+
+def test_resend_with_location_fills_alert_without_position(client, idempotency_key, monkeypatch):
+    # Sem track_token a página reenvia o SOS com a mesma chave e a posição
+    monkeypatch.setattr(aurora, "TRACK_ENABLED", False)
+    _, first = send(client, idempotency_key=idempotency_key)
+    assert first["track_token"] is None
+
+    _, again = send(client, idempotency_key=idempotency_key, location={"lat": -23.5, "lng": -46.6})
+    assert again["duplicate"] is True
+    alert = aurora.ALERT_STORE.get(first["id"])
+    assert (alert["lat"], alert["lng"]) == (-23.5, -46.6)
+
+    # Só a primeira posição é aceita assim; o resto do trajeto exige token
+    send(client, idempotency_key=idempotency_key, location={"lat": -20.0, "lng": -40.0})
+    assert aurora.ALERT_STORE.get(first["id"])["lat"] == -23.5
+
+
+def test_location_updates_need_track_token(client):
+    _, body = send(client, client_id="C1")
+    url = f"/api/alerts/{body['id']}/location"
+
+    assert client.post(url, json={"lat": 1, "lng": 2}).status_code == 403
+    resp = client.post(url, json={"lat": 1, "lng": 2, "accuracy": 8},
+                       headers={"X-Track-Token": body["track_token"]})
+    assert resp.status_code == 200
+    alert = aurora.ALERT_STORE.get(body["id"])
+    assert (alert["lat"], alert["lng"], alert["accuracy"]) == (1, 2, 8)
@@ -0,0 +1,67 @@
+"""Rotação do alerts.log em segmentos e remoção do histórico de um cliente."""
+from conftest import aurora, send
+
+
+def ids(alerts):
+    return [a["id"] for a in alerts]
+
+
+def send_mix(client):
+    """Dois alertas de cada cliente (C1, C2) e dois anônimos, intercalados."""
+    return [send(client, client_id=cid)[1]["id"] for cid in ("C1", "C2", None) * 2]
+
+
+def test_rotation_by_size_keeps_every_alert_readable(client, monkeypatch):
+    sent = send_mix(client)
+    monkeypatch.setattr(aurora, "SEGMENT_MAX_BYTES", 1)
+    aurora.STORAGE.rotate_if_needed()
+
+    assert aurora.ALERTS_FILE.stat().st_size == 0
+    assert aurora.STORAGE.cold_max_id() == sent[-1]
+    assert ids(aurora.get_all_alerts()) == sent
+    assert ids(aurora.get_alerts_for_client("C1")) == [sent[0], sent[2], sent[3], sent[5]]
+    assert aurora.ALERT_STORE.get(sent[1])["client_id"] == "C2"
+
+    monkeypatch.setattr(aurora, "SEGMENT_MAX_BYTES", 8 * 1024 * 1024)
+    _, body = send(client, client_id="C1")
+    assert body["id"] == sent[-1] + 1
+    page, _ = aurora.ALERT_STORE.page(limit=3)
+    assert ids(page) == [body["id"], sent[5], sent[4]]
+
+
+def test_rotation_by_day():
+    # Direto no storage: log_alert acordaria o rotator antes do segundo alerta
+    old = {"id": None, "ts": "2020-01-01 10:00:00", "client_id": "C1", "situation": "Ameaça"}
+    new = {"id": None, "ts": aurora.now_br_str(), "client_id": "C1", "situation": "Ameaça"}
+    aurora.STORAGE.append_alerts([old, new], True)
+    aurora.STORAGE.rotate_if_needed()
+
+    assert aurora.ALERTS_FILE.stat().st_size == 0
+    assert ids(aurora.get_alerts_for_client("C1")) == [old["id"], new["id"]]
+    assert aurora.get_last_alert("C1")["id"] == new["id"]
+
+
+def test_delete_client_removes_hot_and_cold(client, admin, monkeypatch):
+    rotated = send_mix(client)
+    monkeypatch.setattr(aurora, "SEGMENT_MAX_BYTES", 1)
+    aurora.STORAGE.rotate_if_needed()
+    monkeypatch.setattr(aurora, "SEGMENT_MAX_BYTES", 8 * 1024 * 1024)
+    hot = send_mix(client)
+
+    resp = admin.post("/api/clear_alerts", json={"client_id": "C1"})
+    assert resp.get_json() == {"ok": True, "removed": 4}
+
+    remaining = aurora.get_all_alerts()
+    assert all(a["client_id"] != "C1" for a in remaining)
+    assert ids(remaining) == [i for n, i in enumerate(rotated + hot) if n % 3 != 0]
+    # ids nunca são reaproveitados
+    assert send(client, client_id="C1")[1]["id"] == hot[-1] + 1
+
+
+def test_clear_alerts_requires_admin(client, admin):
+    send(client, client_id="C1")
+    assert client.post("/api/clear_alerts", json={}).status_code == 403
+    assert len(aurora.get_all_alerts()) == 1
+
+    assert admin.post("/api/clear_alerts", json={}).get_json() == {"ok": True}
+    assert aurora.get_all_alerts() == []